@@ -0,0 +1,95 @@
+import hashlib
+import threading
+
+FANOUT = 16
+DEPTH = 3
+HASH_LENGTH = 16
+
+
+def hash_of(src: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(src, digest_size=HASH_LENGTH).digest(), byteorder='big')
+
+
+class MerkleTree:
+    """Hash tree over the document snapshots, the leaves are the buckets of the document IDs
+
+    Hash of the leaf is XOR of the hashes of its documents and hash of the node is XOR of its children,
+    so the change of one document updates one path only. Replicas are compared from the root
+    and only the nodes with different hashes are descended.
+    """
+
+    def __init__(self, fanout: int = FANOUT, depth: int = DEPTH):
+        self._fanout = fanout
+        self._depth = depth
+        self._lock = threading.Lock()
+
+        self._levels = [[0] * (fanout ** level) for level in range(depth + 1)]
+        self._entries = dict()
+        self._buckets = dict()
+
+    @property
+    def fanout(self) -> int:
+        return self._fanout
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def leaves_count(self) -> int:
+        return len(self._levels[self._depth])
+
+    def leaf_of(self, doc_id: str) -> int:
+        return hash_of(doc_id.encode('utf-8')) % self.leaves_count
+
+    def update(self, doc_id: str, snapshot: bytes):
+        entry = hash_of(doc_id.encode('utf-8') + bytes(snapshot))
+
+        with self._lock:
+            previous = self._entries.get(doc_id, 0)
+            self._entries[doc_id] = entry
+
+            leaf = self.leaf_of(doc_id)
+            self._buckets.setdefault(leaf, set()).add(doc_id)
+            self._apply(leaf, previous ^ entry)
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            previous = self._entries.pop(doc_id, None)
+            if previous is None:
+                return
+
+            leaf = self.leaf_of(doc_id)
+            bucket = self._buckets[leaf]
+            bucket.discard(doc_id)
+            if len(bucket) == 0:
+                del self._buckets[leaf]
+
+            self._apply(leaf, previous)
+
+    def node(self, level: int, index: int) -> bytes:
+        return self._levels[level][index].to_bytes(HASH_LENGTH, byteorder='big')
+
+    def root(self) -> bytes:
+        return self.node(0, 0)
+
+    def children(self, level: int, index: int) -> list:
+        """Hashes of the children of the node, the leaves have no children"""
+        if level >= self._depth:
+            return list()
+
+        start = index * self._fanout
+        with self._lock:
+            hashes = self._levels[level + 1][start:start + self._fanout]
+
+        return [value.to_bytes(HASH_LENGTH, byteorder='big') for value in hashes]
+
+    def doc_ids(self, leaf: int) -> set:
+        with self._lock:
+            return set(self._buckets.get(leaf, set()))
+
+    def _apply(self, leaf: int, delta: int):
+        index = leaf
+        for level in range(self._depth, -1, -1):
+            self._levels[level][index] ^= delta
+            index //= self._fanout
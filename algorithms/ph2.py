@@ -1,7 +1,13 @@
 from bisect import bisect_left
+from collections import Counter
 
 from algorithms import Frozen
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 BLOCK_SIZE = 8
 MAX_VALUE = (1 << BLOCK_SIZE) - 1
 
@@ -14,74 +20,153 @@ PRIME_NUMBERS = [
     233, 239, 241, 251
 ]
 
+# NumPy is slower than the loop for the short documents
+NUMPY_MIN_LENGTH = 64
+
+
+def hashing_python(_bytes: bytes) -> bytes:
+    required_bytes_per_block = BLOCK_SIZE // 8
+    bytes_len = len(_bytes)
+
+    def search(alist, item):
+        'Locate the leftmost value exactly equal to item'
+        i = bisect_left(alist, item)
+        if i != len(alist) and alist[i] == item:
+            return True
+
+        return False
+
+    sum_regular = 0
+    overflow_regular = 0
+    sum_primes = 0
+    overflow_primes = 0
+    primes_count = 0
+    regular_count = 0
+
+    for i in range(0, bytes_len, required_bytes_per_block):
+        start = i
+        end = i + required_bytes_per_block
+        part = _bytes[start:end:1]
+        item = int.from_bytes(part, byteorder='big', signed=False)
+
+        if search(PRIME_NUMBERS, item):
+            diff = MAX_VALUE - sum_primes
+            if item >= diff:
+                sum_primes = item - diff
+                overflow_primes = (overflow_primes + 1) % MAX_VALUE
+            else:
+                sum_primes += item
+            primes_count = (primes_count + 1) % MAX_VALUE
+        else:
+            diff = MAX_VALUE - sum_regular
+            if item >= diff:
+                sum_regular = item - diff
+                overflow_regular = (overflow_regular + 1) % MAX_VALUE
+            else:
+                sum_regular += item
+            regular_count = (regular_count + 1) % MAX_VALUE
+
+    return bytes(
+        [
+            regular_count % MAX_VALUE,
+            primes_count % MAX_VALUE,
+            sum_regular % MAX_VALUE,
+            overflow_regular % MAX_VALUE,
+            sum_primes % MAX_VALUE,
+            overflow_primes % MAX_VALUE,
+        ]
+    )
+
+
+if numpy is not None:
+    BLOCK_VALUES = numpy.arange(MAX_VALUE + 1, dtype=numpy.uint64)
+    IS_PRIME = numpy.isin(BLOCK_VALUES, PRIME_NUMBERS)
+
+PRIMES_SET = frozenset(PRIME_NUMBERS)
+
+
+def totals_numpy(_bytes: bytes) -> tuple:
+    """Counts and sums of the regular and the prime one byte blocks"""
+    histogram = numpy.bincount(numpy.frombuffer(_bytes, dtype=numpy.uint8), minlength=MAX_VALUE + 1)
+    histogram = histogram.astype(numpy.uint64)
+
+    return (
+        int(histogram[~IS_PRIME].sum()),
+        int(histogram[IS_PRIME].sum()),
+        int((histogram[~IS_PRIME] * BLOCK_VALUES[~IS_PRIME]).sum()),
+        int((histogram[IS_PRIME] * BLOCK_VALUES[IS_PRIME]).sum()),
+    )
+
+
+def totals_python(_bytes: bytes) -> tuple:
+    regular_count = primes_count = sum_regular = sum_primes = 0
+    for value, count in Counter(_bytes).items():
+        if value in PRIMES_SET:
+            primes_count += count
+            sum_primes += value * count
+        else:
+            regular_count += count
+            sum_regular += value * count
+
+    return regular_count, primes_count, sum_regular, sum_primes
+
+
+def hashing_totals(regular_count: int, primes_count: int, sum_regular: int, sum_primes: int) -> bytes:
+    """Same as hashing_python for one byte blocks
+
+    The running sum of the loop is kept below MAX_VALUE by subtracting MAX_VALUE on every overflow,
+    so it is the total sum modulo MAX_VALUE and the number of the overflows is the total sum divided by MAX_VALUE.
+    """
+    return bytes(
+        [
+            regular_count % MAX_VALUE,
+            primes_count % MAX_VALUE,
+            sum_regular % MAX_VALUE,
+            (sum_regular // MAX_VALUE) % MAX_VALUE,
+            sum_primes % MAX_VALUE,
+            (sum_primes // MAX_VALUE) % MAX_VALUE,
+        ]
+    )
+
+
+def hashing_numpy(_bytes: bytes) -> bytes:
+    return hashing_totals(*totals_numpy(_bytes))
+
 
 class PH2(Frozen):
+    """Hash of the appended bytes, the blocks are one byte
+
+    Only the counts and the sums of the blocks are kept, so the appended bytes are not retained.
+    """
 
     def __init__(self):
         super().__init__()
-        self._bytes = bytearray()
+        self._totals = (0, 0, 0, 0)
+        self._hashed = None
+
+    @staticmethod
+    def from_hashed(hashed: bytes):
+        """Restores the hash computed before, such PH2 could not be appended"""
+        res = PH2()
+        res._hashed = bytes(hashed)
+        res.froze()
+
+        return res
 
     @Frozen.decorator
     def append(self, _bytes: bytes):
-        self._bytes.extend(_bytes)
+        if numpy is not None and len(_bytes) >= NUMPY_MIN_LENGTH:
+            totals = totals_numpy(bytes(_bytes))
+        else:
+            totals = totals_python(_bytes)
+
+        self._totals = tuple(total + added for total, added in zip(self._totals, totals))
 
     def hashing(self) -> bytes:
-        required_bytes_per_block = BLOCK_SIZE // 8
-
-        need_to_add_bytes = required_bytes_per_block - (len(self._bytes) % required_bytes_per_block)
-        need_to_add_bytes = need_to_add_bytes % required_bytes_per_block # to avoid extra adding
-        self._bytes.extend([0] * need_to_add_bytes)
-
-        bytes_len = len(self._bytes)
-
-        def search(alist, item):
-            'Locate the leftmost value exactly equal to item'
-            i = bisect_left(alist, item)
-            if i != len(alist) and alist[i] == item:
-                return True
-
-            return False
-
-        sum_regular = 0
-        overflow_regular = 0
-        sum_primes = 0
-        overflow_primes = 0
-        primes_count = 0
-        regular_count = 0
-
-        for i in range(0, bytes_len, required_bytes_per_block):
-            start = i
-            end = i + required_bytes_per_block
-            part = self._bytes[start:end:1]
-            item = int.from_bytes(part, byteorder='big', signed=False)
-
-            if search(PRIME_NUMBERS, item):
-                diff = MAX_VALUE - sum_primes
-                if item >= diff:
-                    sum_primes = item - diff
-                    overflow_primes = (overflow_primes + 1) % MAX_VALUE
-                else:
-                    sum_primes += item
-                primes_count = (primes_count + 1) % MAX_VALUE
-            else:
-                diff = MAX_VALUE - sum_regular
-                if item >= diff:
-                    sum_regular = item - diff
-                    overflow_regular = (overflow_regular + 1) % MAX_VALUE
-                else:
-                    sum_regular += item
-                regular_count = (regular_count + 1) % MAX_VALUE
-
-        return bytes(
-            [
-                regular_count % MAX_VALUE,
-                primes_count % MAX_VALUE,
-                sum_regular % MAX_VALUE,
-                overflow_regular % MAX_VALUE,
-                sum_primes % MAX_VALUE,
-                overflow_primes % MAX_VALUE,
-            ]
-        )
+        if self._hashed is not None:
+            return self._hashed
+
+        return hashing_totals(*self._totals)
 
     def digest(self) -> int:
         hashed = self.hashing()
@@ -0,0 +1,64 @@
+import math
+import threading
+import time
+from collections import deque
+
+THRESHOLD = 8.0
+WINDOW_SIZE = 100
+MIN_STD_DEVIATION = 0.1
+MAX_DEVIATIONS = 20.0
+
+
+class PhiAccrualFailureDetector:
+    """Suspicion level of the node by the intervals between its heartbeats
+
+    Phi is -log10 of the probability that the next heartbeat is still coming, the intervals are assumed to be
+    normally distributed. The node is suspected when phi is above the threshold: 8 means about one false
+    suspicion in 10^8 heartbeats.
+    """
+
+    def __init__(self, first_interval: float, threshold: float = THRESHOLD, window_size: int = WINDOW_SIZE,
+                 min_std_deviation: float = MIN_STD_DEVIATION, now: float = None):
+        self._threshold = threshold
+        self._min_std_deviation = min_std_deviation
+        self._lock = threading.Lock()
+
+        # the history is started by the expected interval, so the silent node is suspected too
+        self._intervals = deque([first_interval], maxlen=window_size)
+        self._last_heartbeat = time.monotonic() if now is None else now
+
+    def heartbeat(self, now: float = None):
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            # the silence of the suspected node is not an interval, it would make the detector slow next time
+            if self._phi(now) < self._threshold:
+                self._intervals.append(now - self._last_heartbeat)
+            self._last_heartbeat = now
+
+    def phi(self, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            return self._phi(now)
+
+    def is_available(self, now: float = None) -> bool:
+        return self.phi(now) < self._threshold
+
+    def since_last_heartbeat(self, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+        return now - self._last_heartbeat
+
+    def _phi(self, now: float) -> float:
+        mean = sum(self._intervals) / len(self._intervals)
+        variance = sum((interval - mean) ** 2 for interval in self._intervals) / len(self._intervals)
+        std_deviation = max(math.sqrt(variance), self._min_std_deviation)
+
+        # logistic approximation of the normal CDF, y is clamped to keep exp in the float range
+        y = (now - self._last_heartbeat - mean) / std_deviation
+        y = min(max(y, -MAX_DEVIATIONS), MAX_DEVIATIONS)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if y > 0:
+            return -math.log10(e / (1.0 + e))
+
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
@@ -1,29 +1,64 @@
+from collections import Counter
+
 from algorithms import Frozen
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# NumPy is slower than Counter for the short documents
+NUMPY_MIN_LENGTH = 256
+
+
+def byte_histogram(_bytes: bytes) -> list:
+    """Number of every byte value in the bytes"""
+    if numpy is not None and len(_bytes) >= NUMPY_MIN_LENGTH:
+        return numpy.bincount(numpy.frombuffer(_bytes, dtype=numpy.uint8), minlength=256).tolist()
+
+    res = [0] * 256
+    for value, count in Counter(_bytes).items():
+        res[value] = count
+
+    return res
+
+
+def membership_table(primes: list) -> list:
+    """Entries incremented by every byte value, the last entry is the jocker one for the bytes without prime divisors"""
+    return [
+        tuple(i for i, prime in enumerate(primes) if _byte % prime == 0) or (len(primes),)
+        for _byte in range(256)
+    ]
+
 
 class SpectralBloomFilter(Frozen):
     PRIMES = [2, 3, 5, 7, 11, 13, 17]
+    MEMBERSHIP = membership_table(PRIMES)
 
     def __init__(self, *args, **kwargs):
         super().__init__()
         self._size = len(SpectralBloomFilter.PRIMES) + 1
         self._entries = [0] * self._size
 
+    @staticmethod
+    def from_bytes(_bytes: bytes):
+        res = SpectralBloomFilter()
+        res._entries = list(_bytes)
+
+        return res
+
     @Frozen.decorator
     def add(self, _bytes: bytes):
-        for _b in _bytes:
-            self._add_single(_b)
+        counts = [0] * self._size
+        for _byte, count in enumerate(byte_histogram(_bytes)):
+            if count == 0:
+                continue
 
-    @Frozen.decorator
-    def _add_single(self, _byte: int):
-        is_jocker = True
-        for i, prime in enumerate(SpectralBloomFilter.PRIMES):
-            if _byte % prime == 0:
-                self._entries[i] = (self._entries[i] + 1) % 255
-                is_jocker = False
-
-        if is_jocker:
-            self._entries[-1] = (self._entries[-1] + 1) % 255
+            for i in SpectralBloomFilter.MEMBERSHIP[_byte]:
+                counts[i] += count
+
+        for i, count in enumerate(counts):
+            self._entries[i] = (self._entries[i] + count) % 255
 
     def get(self) -> bytes:
         return bytes(self._entries)
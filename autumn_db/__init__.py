@@ -1,35 +1,158 @@
 import datetime
+import functools
+import os
+import re
+import threading
+import time
+import uuid
 
+_EPOCH = datetime.datetime(1970, 1, 1)
 
+
+def _default_node_id() -> int:
+    # the processes of one host differ by PID, the hosts differ by MAC
+    res = (uuid.getnode() ^ (os.getpid() << 24)) & DocumentId.MAX_NODE_ID
+    return res or 1
+
+
+@functools.total_ordering
 class DocumentId:
+    """128-bit document ID: |Timestamp, microseconds|Node ID|Sequence|
+                                    64bits             48bits  16bits
+
+    IDs generated by the node are monotonic, the sequence distinguishes IDs of the same microsecond
+    and the node ID distinguishes the nodes. The string form is the timestamp in UTC_FORMAT followed by
+    the node ID and the sequence in hex, the legacy IDs are the timestamp only and have zero node ID and sequence.
+    On the wire the ID is LENGTH bytes.
+    """
+    __slots__ = ('_value', '_str')
+
     UTC_FORMAT = '%Y_%m_%d_%H_%M_%S_%f'
+    LENGTH = 16
+    NODE_ID_BITS = 48
+    SEQUENCE_BITS = 16
+    MAX_NODE_ID = (1 << NODE_ID_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+    PATTERN = r'(\d{4})_(\d{2})_(\d{2})_(\d{2})_(\d{2})_(\d{2})_(\d{6})(?:_([0-9a-f]{12})_([0-9a-f]{4}))?'
+    _PATTERN = re.compile(PATTERN)
+
+    _generation_lock = threading.Lock()
+    _last_generated = (0, 0)
+    _node_id = None
 
     def __init__(self, src: str = None):
+        self._str = None
         if src is None:
-            src = datetime.datetime.utcnow().strftime(DocumentId.UTC_FORMAT)
+            self._value = DocumentId._generate()
+            return
 
-        if not DocumentId.is_valid(src):
+        match = DocumentId._PATTERN.fullmatch(src)
+        if match is None:
             raise Exception(f"Document ID {src} is not valid")
 
-        self._id = src
+        parts = match.groups()
+        timestamp = datetime.datetime(*(int(part) for part in parts[:7])) - _EPOCH
+        node_id = int(parts[7], 16) if parts[7] is not None else 0
+        sequence = int(parts[8], 16) if parts[8] is not None else 0
+
+        self._value = DocumentId._pack(timestamp // datetime.timedelta(microseconds=1), node_id, sequence)
+        self._str = src
+
+    @staticmethod
+    def from_bytes(src: bytes):
+        if len(src) != DocumentId.LENGTH:
+            raise Exception(f"Document ID has {len(src)} bytes instead of {DocumentId.LENGTH}")
+
+        res = DocumentId.__new__(DocumentId)
+        res._value = int.from_bytes(src, byteorder='big', signed=False)
+        res._str = None
+
+        return res
+
+    def to_bytes(self) -> bytes:
+        return self._value.to_bytes(DocumentId.LENGTH, byteorder='big', signed=False)
+
+    @property
+    def timestamp(self) -> int:
+        return self._value >> (DocumentId.NODE_ID_BITS + DocumentId.SEQUENCE_BITS)
+
+    @property
+    def node_id(self) -> int:
+        return (self._value >> DocumentId.SEQUENCE_BITS) & DocumentId.MAX_NODE_ID
+
+    @property
+    def sequence(self) -> int:
+        return self._value & DocumentId.MAX_SEQUENCE
+
+    def __int__(self):
+        return self._value
 
     def __str__(self):
-        return self._id
+        if self._str is None:
+            # the same as strftime by UTC_FORMAT without parsing the format
+            t = _EPOCH + datetime.timedelta(microseconds=self.timestamp)
+            res = f'{t.year:04}_{t.month:02}_{t.day:02}_{t.hour:02}_{t.minute:02}_{t.second:02}_{t.microsecond:06}'
+            if self.node_id != 0 or self.sequence != 0:
+                res = f'{res}_{self.node_id:012x}_{self.sequence:04x}'
+            self._str = res
+
+        return self._str
 
     def __repr__(self):
         return self.__str__()
 
+    def __eq__(self, other):
+        if not isinstance(other, DocumentId):
+            return NotImplemented
+
+        return self._value == other._value
+
+    def __lt__(self, other):
+        if not isinstance(other, DocumentId):
+            return NotImplemented
+
+        return self._value < other._value
+
     def __hash__(self):
-        return hash(self._id)
+        return hash(self._value)
 
-    PATTERN = r'\d{4}_\d{2}_\d{2}_\d{2}_\d{2}_\d{2}_\d{6}'
     @staticmethod
-    def is_valid(doc_id: str):
+    def set_node_id(node_id: int):
+        if not 0 < node_id <= DocumentId.MAX_NODE_ID:
+            raise Exception(f"Node ID should be in [1, {DocumentId.MAX_NODE_ID}]")
+
+        with DocumentId._generation_lock:
+            DocumentId._node_id = node_id
 
-        import re
-        match = re.match(DocumentId.PATTERN, doc_id)
+    @staticmethod
+    def _pack(timestamp: int, node_id: int, sequence: int) -> int:
+        return (((timestamp << DocumentId.NODE_ID_BITS) | node_id) << DocumentId.SEQUENCE_BITS) | sequence
+
+    @staticmethod
+    def _generate() -> int:
+        # IDs generated by the process are unique and growing even if the clock goes back
+        with DocumentId._generation_lock:
+            if DocumentId._node_id is None:
+                DocumentId._node_id = _default_node_id()
+
+            timestamp = time.time_ns() // 1000
+            last_timestamp, last_sequence = DocumentId._last_generated
+            sequence = 0
+            if timestamp <= last_timestamp:
+                timestamp = last_timestamp
+                sequence = last_sequence + 1
+                if sequence > DocumentId.MAX_SEQUENCE:
+                    timestamp += 1
+                    sequence = 0
 
-        return match is not None
+            DocumentId._last_generated = (timestamp, sequence)
+
+            return DocumentId._pack(timestamp, DocumentId._node_id, sequence)
+
+    @staticmethod
+    def is_valid(doc_id: str):
+        return DocumentId._PATTERN.fullmatch(doc_id) is not None
 
 
-DOC_ID_LENGTH = len(str(DocumentId()))
+DOC_ID_LENGTH = DocumentId.LENGTH
@@ -1,12 +1,21 @@
+import asyncio
+import datetime
 import json
+import logging
 import os
+import shutil
+import threading
+import time
+from concurrent import futures
 from enum import Enum
-from queue import Queue
+from queue import Queue, Empty
 
 from autumn_db import DocumentId, DOC_ID_LENGTH
 from autumn_db.data_storage.collection import CollectionOperations
 from autumn_db.data_storage.collection.impl import CollectionOperationsImpl
-from autumn_db.event_bus import EventBus, DocumentOrientedEvent
+from autumn_db.data_storage.collection.log_structured import LogStructuredCollectionOperations
+from autumn_db.data_storage.wal import WriteAheadLog, WALRecord, WALRecordType, FsyncPolicy
+from autumn_db.event_bus import EventBus, Event, DocumentOrientedEvent, DocumentsBatchOrientedEvent
 from db_driver import DocumentOperation, CollectionName
 
 
@@ -18,21 +27,49 @@ class DBOperationType(Enum):
 
 
 class DBOperation:
+    """Completion of the operation is exposed by the future
+
+    The future is resolved by the worker after the operation is applied to the storage, it carries the result
+    or the exception. The operation could be waited by the threads (result, wait) and awaited by asyncio.
+    """
 
     def __init__(self, oper_type: DBOperationType, collection: str):
         self._oper_type = oper_type
         self._collection = collection
-        self._is_finished = False
+        self._future = futures.Future()
 
     @property
     def collection(self) -> str:
         return self._collection
 
-    def finished(self):
-        self._is_finished = True
+    @property
+    def future(self) -> futures.Future:
+        return self._future
+
+    def finished(self, result=None):
+        if not self._future.done():
+            self._future.set_result(result)
+
+    def failed(self, error: Exception):
+        if not self._future.done():
+            self._future.set_exception(error)
 
     def is_finished(self) -> bool:
-        return self._is_finished
+        return self._future.done()
+
+    def wait(self, timeout: float = None) -> bool:
+        done, _ = futures.wait([self._future], timeout)
+        return len(done) > 0
+
+    def result(self, timeout: float = None):
+        return self._future.result(timeout)
+
+    def add_done_callback(self, callback):
+        # the callback is invoked from the thread which finishes the operation
+        self._future.add_done_callback(lambda _: callback(self))
+
+    def __await__(self):
+        return asyncio.wrap_future(self._future).__await__()
 
     @property
     def operation_type(self) -> DBOperationType:
@@ -71,7 +108,7 @@ class ReadOperation(DocumentIdBasedOperation):
             data = str(data)
 
         self._response = data
-        self.finished()
+        self.finished(data)
 
 
 class DeleteOperation(DocumentIdBasedOperation):
@@ -107,6 +144,36 @@ class UpdateOperation(DocumentIdBasedOperation):
         return self._data
 
 
+class BatchOperation(DBOperation):
+    """Operations of the same type on the same collection which are executed as a unit"""
+
+    def __init__(self, oper_type: DBOperationType, collection: str, operations: list):
+        super().__init__(oper_type, collection)
+        for oper in operations:
+            if oper.operation_type != oper_type or oper.collection != collection:
+                raise Exception(f"Batch of {oper_type} on {collection} could not contain {oper.operation_type} "
+                                f"on {oper.collection}")
+
+        self._operations = operations
+
+    @property
+    def operations(self) -> list:
+        return self._operations
+
+    @property
+    def document_ids(self) -> list:
+        return [oper.document_id for oper in self._operations]
+
+    def failed(self, error: Exception):
+        for oper in self._operations:
+            oper.failed(error)
+
+        super().failed(error)
+
+    def __len__(self):
+        return len(self._operations)
+
+
 class DatabaseOperations:
 
     def _handle_create_operation(self, payload: bytearray): ...
@@ -148,70 +215,326 @@ class DatabaseOperationsMockImpl(DatabaseOperations):
         print(doc_id)
 
 
-class DBCoreEngine:
+class StorageEngine(Enum):
+    FILESYSTEM = 'filesystem'
+    LOG_STRUCTURED = 'log_structured'
+
+    @property
+    def collection_class(self) -> type:
+        if self == StorageEngine.LOG_STRUCTURED:
+            return LogStructuredCollectionOperations
+
+        return CollectionOperationsImpl
+
 
-    def __init__(self, db_holder: str = None):
+class DBCoreEngine:
+    HOLDER_CONFIG_NAME = 'holder.json'
+    STORAGE_ENGINE_KEY = 'storage_engine'
+    MIGRATION_DIR = '.migration'
+    WAL_DIR = '.wal'
+    LOADERS = 8
+
+    def __init__(self, db_holder: str = None, storage_engine: StorageEngine = None,
+                 fsync_policy: FsyncPolicy = FsyncPolicy.ALWAYS,
+                 fsync_interval_ms: int = WriteAheadLog.DEFAULT_INTERVAL_MS, loaders: int = LOADERS):
         if db_holder is None:
             db_holder = os.getcwd()
 
         self._db_holder = db_holder
         if not os.path.exists(self._db_holder):
             os.mkdir(self._db_holder)
-        self._collections = self._discover_existing()
-
-    def create_collection(self, name: str):
-        if name in self._collections.keys():
-            raise Exception(f"Collection {name} already exists")
-        collection = CollectionOperationsImpl(name, self._db_holder)
-        collection.create()
+        self._storage_engine = self._init_storage_engine(db_holder, storage_engine)
+        self._lock = threading.RLock()
+        self._ready = threading.Condition(self._lock)
+
+        # existing collections are opened in background, the one requested before is opened by the caller
+        self._collections = dict()
+        self._loading = {name: threading.Lock() for name in self._discover_existing()}
+        # name -> exception of the collections which could not be opened, they are not retried
+        self._failed = dict()
+        self._loader = futures.ThreadPoolExecutor(max_workers=loaders, thread_name_prefix='collection-loader')
+        for name in list(self._loading.keys()):
+            self._loader.submit(self._open_collection, name)
+
+        self._wal = WriteAheadLog(os.path.join(db_holder, DBCoreEngine.WAL_DIR), fsync_policy, fsync_interval_ms)
+        self._replay_wal()
 
-        self._collections[name] = collection
+    @property
+    def storage_engine(self) -> StorageEngine:
+        return self._storage_engine
 
-    def delete_collection(self, name: str):
-        collection = self._collections[name]
-        collection.delete()
-        del self._collections[name]
+    @property
+    def wal(self) -> WriteAheadLog:
+        return self._wal
+
+    def close(self):
+        self._loader.shutdown(wait=True, cancel_futures=True)
+        self._wal.close()
+        with self._lock:
+            for collection in self._collections.values():
+                collection.close()
+
+    def _replay_wal(self):
+        replayed = 0
+        for record in self._wal.replay():
+            try:
+                self._apply_wal_record(record)
+            except Exception as e:
+                logging.warning(f"Could not replay {record.record_type} of {record.collection}/{record.doc_id}: {e}")
+            replayed += 1
+
+        if replayed > 0:
+            logging.info(f"Replayed {replayed} write-ahead log records of {self._db_holder}")
+
+        # the replayed documents are synced and the old log files are dropped
+        self._wal.checkpoint()
+
+    def _apply_wal_record(self, record: WALRecord):
+        collection = self.get_collection_safely(record.collection)
+        exists = collection.document_exists(record.doc_id)
+
+        if record.record_type == WALRecordType.DELETE:
+            if exists:
+                collection.delete_document(record.doc_id)
+            return
+
+        if not exists:
+            collection.create_document(record.doc_id, record.data, record.updated_at)
+            return
+
+        # the document could be written partially by the crash, but newer replicated version must be kept
+        try:
+            stored_updated_at = collection.get_updated_at(record.doc_id)
+        except Exception:
+            stored_updated_at = None
+
+        if stored_updated_at is None or stored_updated_at <= record.updated_at:
+            collection.update_document(record.doc_id, record.data, record.updated_at)
+
+    @staticmethod
+    def _init_storage_engine(db_holder: str, storage_engine: StorageEngine = None) -> StorageEngine:
+        # the storage engine is chosen once per holder and is kept by its config
+        used = DBCoreEngine.read_storage_engine(db_holder)
+        if used is None:
+            used = storage_engine if storage_engine is not None else StorageEngine.FILESYSTEM
+            DBCoreEngine._write_storage_engine(db_holder, used)
+
+        if storage_engine is not None and storage_engine != used:
+            raise Exception(f"Holder {db_holder} uses {used.value} storage engine, migrate it first")
+
+        return used
+
+    @staticmethod
+    def read_storage_engine(db_holder: str):
+        pathname = os.path.join(db_holder, DBCoreEngine.HOLDER_CONFIG_NAME)
+        if os.path.exists(pathname):
+            with open(pathname, 'r') as f:
+                config = json.loads(f.read())
+
+            return StorageEngine(config[DBCoreEngine.STORAGE_ENGINE_KEY])
+
+        # holders created before the config are filesystem based if they contain any collection
+        has_collections = any(entry.is_dir() and not entry.name.startswith('.') for entry in os.scandir(db_holder))
+        if has_collections:
+            return StorageEngine.FILESYSTEM
+
+        return None
+
+    @staticmethod
+    def _write_storage_engine(db_holder: str, storage_engine: StorageEngine):
+        pathname = os.path.join(db_holder, DBCoreEngine.HOLDER_CONFIG_NAME)
+        with open(pathname, 'w') as f:
+            f.write(json.dumps({DBCoreEngine.STORAGE_ENGINE_KEY: storage_engine.value}))
+
+    @staticmethod
+    def migrate(db_holder: str, storage_engine: StorageEngine):
+        """Moves all collections of the holder to another storage engine, the holder must not be in use"""
+        source_engine = DBCoreEngine.read_storage_engine(db_holder)
+        if source_engine is None or source_engine == storage_engine:
+            DBCoreEngine._write_storage_engine(db_holder, storage_engine)
+            return
+
+        migration_path = os.path.join(db_holder, DBCoreEngine.MIGRATION_DIR)
+        new_path = os.path.join(migration_path, 'new')
+        old_path = os.path.join(migration_path, 'old')
+        shutil.rmtree(migration_path, ignore_errors=True)
+        os.makedirs(new_path)
+        os.makedirs(old_path)
+
+        names = [entry.name for entry in os.scandir(db_holder) if entry.is_dir() and not entry.name.startswith('.')]
+        for name in names:
+            source = source_engine.collection_class(name, db_holder)
+            target = storage_engine.collection_class(name, new_path)
+            target.create()
+
+            for doc_id in source.scan():
+                data, updated_at = source.read_document_with_updated_at(doc_id)
+                target.create_document(doc_id, data, updated_at)
+
+            source.close()
+            target.close()
+
+        for name in names:
+            os.rename(os.path.join(db_holder, name), os.path.join(old_path, name))
+            os.rename(os.path.join(new_path, name), os.path.join(db_holder, name))
+
+        DBCoreEngine._write_storage_engine(db_holder, storage_engine)
+        shutil.rmtree(migration_path)
 
-    def _discover_existing(self) -> dict:
-        collections_candidates = [f for f in os.scandir(self._db_holder) if f.is_dir()]
+    def create_collection(self, name: str):
+        with self._lock:
+            if name in self._collections.keys() or name in self._loading.keys() or name in self._failed.keys():
+                raise Exception(f"Collection {name} already exists")
+            collection = self._storage_engine.collection_class(name, self._db_holder)
+            collection.create()
 
-        exclude = set()
-        for candidate in collections_candidates:
-            dirs = [f.path for f in os.scandir(candidate) if f.is_dir()]
+            self._collections[name] = collection
 
-            for required_dir in ['data', 'metadata']:
-                if required_dir in dirs:
-                    exclude.add(candidate)
-                    break
+    def delete_collection(self, name: str):
+        self._open_collection(name)
+        with self._lock:
+            collection = self._collections[name]
+            collection.delete()
+            del self._collections[name]
+
+    def _discover_existing(self) -> list:
+        # a directory is the collection if it has all directories of the storage engine
+        required_dirs = self._storage_engine.collection_class.REQUIRED_DIRS
+
+        res = list()
+        for entry in os.scandir(self._db_holder):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+
+            if all(os.path.isdir(os.path.join(entry.path, required_dir)) for required_dir in required_dirs):
+                res.append(entry.name)
+
+        return res
+
+    def _open_collection(self, name: str):
+        """Opens the discovered collection once, returns None if there is no such collection"""
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is not None:
+                return collection
+
+            if name in self._failed.keys():
+                raise Exception(f"Collection {name} could not be opened: {self._failed[name]}")
+
+            name_lock = self._loading.get(name)
+            if name_lock is None:
+                return None
+
+        with name_lock:
+            with self._lock:
+                if name in self._collections.keys():
+                    return self._collections[name]
+
+                if name in self._failed.keys():
+                    raise Exception(f"Collection {name} could not be opened: {self._failed[name]}")
+
+            try:
+                collection = self._storage_engine.collection_class(name, self._db_holder)
+            except Exception as e:
+                logging.error(f"Could not open collection {name}: {e}")
+                # the waiters are woken up, the failure is reported by wait_until_ready and get_collection_safely
+                with self._lock:
+                    self._failed[name] = e
+                    del self._loading[name]
+                    self._ready.notify_all()
+                raise
+
+            with self._lock:
+                self._collections[name] = collection
+                del self._loading[name]
+                self._ready.notify_all()
+
+        return collection
+
+    def is_ready(self, name: str = None) -> bool:
+        """Whether the collection (or every collection if the name is not set) is opened"""
+        with self._lock:
+            if name is None:
+                return len(self._loading) == 0
+
+            return name not in self._loading.keys()
+
+    def wait_until_ready(self, names: list = None, timeout: float = None) -> bool:
+        """Waits for the collections to be opened, raises if any of them could not be opened"""
+        if names is None:
+            predicate = lambda: len(self._loading) == 0
+        else:
+            predicate = lambda: all(name not in self._loading.keys() for name in names)
+
+        with self._ready:
+            res = self._ready.wait_for(predicate, timeout)
+            failed = [name for name in self._failed.keys() if names is None or name in names]
+
+        if len(failed) > 0:
+            raise Exception(f"Collections {', '.join(sorted(failed))} could not be opened")
+
+        return res
 
-        collections = [entry for entry in collections_candidates if entry not in exclude]
+    @property
+    def failed_collections(self) -> dict:
+        with self._lock:
+            res = dict(self._failed)
 
-        result = {collection.name: CollectionOperationsImpl(collection.name, self._db_holder) for collection in collections}
-        return result
+        return res
 
     @property
     def collections(self) -> dict:
+        # the collections which are not opened yet are opened by the caller, the failed ones are skipped
+        with self._lock:
+            names = list(self._loading.keys())
+
+        for name in names:
+            try:
+                self._open_collection(name)
+            except Exception:
+                pass
+
         return self._collections
 
+    def cache_stats(self) -> dict:
+        with self._lock:
+            collections = list(self._collections.values())
+
+        return {collection.name: collection.cache.stats() for collection in collections}
+
     def get_collection_safely(self, collection_name: str) -> CollectionOperations:
-        if collection_name not in self._collections.keys():
-            self.create_collection(collection_name)
+        # operations are executed by several workers, the collection must be created once
+        collection = self._open_collection(collection_name)
+        if collection is not None:
+            return collection
+
+        with self._lock:
+            if collection_name not in self._collections.keys() and collection_name not in self._loading.keys():
+                self.create_collection(collection_name)
 
-        return self._collections[collection_name]
+        return self._open_collection(collection_name)
 
 
 class DBOperationEngine:
+    """Executes operations by the pool of workers
 
-    def __init__(self, db_core: DBCoreEngine):
-        self._in_progress = set()
-        self._read_queue = Queue()
-        self._create_queue = Queue()
-        self._update_queue = Queue()
-        self._delete_queue = Queue()
+    Every document is bound to one worker by the hash of its collection and ID, so the operations
+    on the same document are executed in order while the operations on different documents are parallel.
+    """
+    DEFAULT_WORKERS = 4
+    RETRY_ATTEMPTS = 5
+    RETRY_INITIAL_DELAY = 0.01
+    RETRY_MAX_DELAY = 1.0
+    STOP_CHECK_INTERVAL = 0.5
+
+    def __init__(self, db_core: DBCoreEngine, workers: int = DEFAULT_WORKERS):
+        self._partitions = [Queue() for _ in range(workers)]
 
         self._db_core_engine = db_core
 
         self._is_stopped = False
+        self._workers = list()
+        self._workers_lock = threading.Lock()
 
         self._event_bus = EventBus()
 
@@ -224,68 +547,144 @@ class DBOperationEngine:
         return self._db_core_engine
 
     def add_operation(self, operation: DBOperation):
-        if operation.operation_type == DBOperationType.CREATE:
-            self._create_queue.put(operation)
+        if isinstance(operation, BatchOperation):
+            for partition, part in self._split_batch(operation).items():
+                self._partitions[partition].put(part)
+            return
 
-        if operation.operation_type == DBOperationType.UPDATE:
-            self._update_queue.put(operation)
+        self._partitions[self._partition_of(operation)].put(operation)
 
-        if operation.operation_type == DBOperationType.READ:
-            self._read_queue.put(operation)
+    def _partition_of(self, operation: DBOperation) -> int:
+        return hash((operation.collection, str(operation.document_id))) % len(self._partitions)
 
-        if operation.operation_type == DBOperationType.DELETE:
-            self._delete_queue.put(operation)
+    def _split_batch(self, batch: BatchOperation) -> dict:
+        by_partition = dict()
+        for oper in batch.operations:
+            by_partition.setdefault(self._partition_of(oper), list()).append(oper)
 
-    def processing(self):
-        while not self._is_stopped:
-            deleted_per_iteration = set()
-            if self._delete_queue.qsize() > 0:
-                del_operation: DeleteOperation = self._delete_queue.get()
+        if len(by_partition) == 1:
+            partition = next(iter(by_partition.keys()))
+            return {partition: batch}
 
-                self._handle_delete_operation(del_operation)
-                deleted_per_iteration.add(del_operation.document_id)
+        # every part is executed by own worker, the batch is finished after the last part unless one has failed
+        left = len(by_partition)
+        failed = False
+        left_lock = threading.Lock()
 
-            if self._read_queue.qsize() > 0:
-                read_operation: ReadOperation = self._read_queue.get()
-                if read_operation.document_id in deleted_per_iteration:
-                    continue
+        def on_part_finished(part: BatchOperation):
+            nonlocal left, failed
+            error = part.future.exception()
+            with left_lock:
+                left -= 1
+                is_first_failure = error is not None and not failed
+                failed = failed or error is not None
+                is_finished = left == 0 and not failed
 
-                self._handle_read_operation(read_operation)
+            if is_first_failure:
+                batch.failed(error)
 
-            if self._create_queue.qsize() > 0:
-                create_operation: CreateOperation = self._create_queue.get()
+            if is_finished:
+                batch.finished([oper.result() for oper in batch.operations])
 
-                self._handle_create_operation(create_operation)
+        res = dict()
+        for partition, operations in by_partition.items():
+            part = BatchOperation(batch.operation_type, batch.collection, operations)
+            part.add_done_callback(on_part_finished)
+            res[partition] = part
 
-            if self._update_queue.qsize() > 0:
-                update_operation: UpdateOperation = self._update_queue.get()
-                if update_operation.document_id in deleted_per_iteration:
-                    continue
+        return res
 
-                try:
-                    self._handle_update_operation(update_operation)
-                except Exception as e:
-                    self._update_queue.put(update_operation)
+    def processing(self):
+        with self._workers_lock:
+            if len(self._workers) == 0:
+                self._workers = [
+                    threading.Thread(target=self._worker, args=(partition,), daemon=True)
+                    for partition in self._partitions
+                ]
+                for worker in self._workers:
+                    worker.start()
+
+        for worker in self._workers:
+            worker.join()
+
+    def stop(self):
+        self._is_stopped = True
+        for partition in self._partitions:
+            partition.put(None)
+
+    def _worker(self, partition: Queue):
+        while not self._is_stopped:
+            try:
+                operation = partition.get(timeout=DBOperationEngine.STOP_CHECK_INTERVAL)
+            except Empty:
+                continue
+
+            if operation is None:
+                # wakes the worker up to check whether the engine is stopped
+                continue
+
+            self._execute(operation)
+
+    def _execute(self, operation: DBOperation):
+        handlers = {
+            DBOperationType.CREATE: (self._handle_create_operation, self._handle_create_batch),
+            DBOperationType.UPDATE: (self._handle_update_operation, self._handle_update_batch),
+            DBOperationType.READ: (self._handle_read_operation, self._handle_read_batch),
+            DBOperationType.DELETE: (self._handle_delete_operation, None),
+        }
+        single, batch = handlers[operation.operation_type]
+        handler = batch if isinstance(operation, BatchOperation) else single
+
+        error = None
+        for attempt in range(DBOperationEngine.RETRY_ATTEMPTS):
+            try:
+                handler(operation)
+                return
+            except Exception as e:
+                logging.warning(f"{operation.operation_type} on {operation.collection} failed: {e}")
+                error = e
+                self._backoff(attempt)
+
+        logging.warning(f"{operation.operation_type} on {operation.collection} is dropped after "
+                        f"{DBOperationEngine.RETRY_ATTEMPTS} attempts")
+        operation.failed(error)
+
+    @staticmethod
+    def _backoff(attempt: int):
+        # the worker sleeps instead of re-queueing, so the order of the operations on the document is kept
+        delay = DBOperationEngine.RETRY_INITIAL_DELAY * (2 ** attempt)
+        time.sleep(min(delay, DBOperationEngine.RETRY_MAX_DELAY))
 
     def _handle_create_operation(self, operation: CreateOperation):
         collection: CollectionOperations = self._db_core_engine.get_collection_safely(operation.collection)
 
         doc_id = str(operation.document_id)
-        collection.create_document(doc_id, operation.data)
+        updated_at = datetime.datetime.utcnow()
+
+        record = WALRecord(WALRecordType.CREATE, operation.collection, doc_id, updated_at, operation.data)
+        with self._db_core_engine.wal.logged([record]) as durable:
+            collection.create_document(doc_id, operation.data, updated_at)
 
         ev = DocumentOrientedEvent(CollectionName(operation.collection), DocumentOperation.CREATE_DOC,
                                    DocumentId(doc_id))
-        self.event_bus.publish(DocumentOperation.CREATE_DOC, ev)
+        self._finish_when_durable(durable, [(operation, operation.document_id)], ev)
 
     def _handle_update_operation(self, operation: UpdateOperation):
         collection: CollectionOperations = self._db_core_engine.get_collection_safely(operation.collection)
 
         filename = str(operation.document_id)
+        updated_at = datetime.datetime.utcnow()
 
-        collection.update_document(operation.document_id, operation.data)
+        # the update of the absent document must not be logged, otherwise the replay would create it
+        if not collection.document_exists(filename):
+            raise Exception(f"Document {filename} does not exist")
+
+        record = WALRecord(WALRecordType.UPDATE, operation.collection, filename, updated_at, operation.data)
+        with self._db_core_engine.wal.logged([record]) as durable:
+            collection.update_document(operation.document_id, operation.data, updated_at)
 
         ev = DocumentOrientedEvent(CollectionName(operation.collection), DocumentOperation.UPDATE_DOC, DocumentId(filename))
-        self.event_bus.publish(DocumentOperation.UPDATE_DOC, ev)
+        self._finish_when_durable(durable, [(operation, operation.document_id)], ev)
 
     def _handle_read_operation(self, operation: ReadOperation):
         collection: CollectionOperations = self._db_core_engine.get_collection_safely(operation.collection)
@@ -297,8 +696,104 @@ class DBOperationEngine:
 
         operation.set_data(data)
 
+    def _handle_create_batch(self, batch: BatchOperation):
+        collection: CollectionOperations = self._db_core_engine.get_collection_safely(batch.collection)
+
+        updated_at = datetime.datetime.utcnow()
+        records = [
+            WALRecord(WALRecordType.CREATE, batch.collection, str(oper.document_id), updated_at, oper.data)
+            for oper in batch.operations
+        ]
+        with self._db_core_engine.wal.logged(records) as durable:
+            collection.create_documents([(str(oper.document_id), oper.data) for oper in batch.operations], updated_at)
+
+        ev = DocumentsBatchOrientedEvent(CollectionName(batch.collection), DocumentOperation.CREATE_DOC,
+                                         batch.document_ids)
+        finished = [(oper, oper.document_id) for oper in batch.operations]
+        self._finish_when_durable(durable, finished + [(batch, batch.document_ids)], ev)
+
+    def _handle_update_batch(self, batch: BatchOperation):
+        collection: CollectionOperations = self._db_core_engine.get_collection_safely(batch.collection)
+
+        updated_at = datetime.datetime.utcnow()
+        # the updates of the absent documents are not logged, they are failed at once
+        missing = [oper for oper in batch.operations if not collection.document_exists(str(oper.document_id))]
+        pending = [oper for oper in batch.operations if oper not in missing]
+        records = {
+            oper: WALRecord(WALRecordType.UPDATE, batch.collection, str(oper.document_id), updated_at, oper.data)
+            for oper in pending
+        }
+
+        updated = list()
+        aborted = None
+        with self._db_core_engine.wal.logged(list(records.values())) as durable:
+            for attempt in range(DBOperationEngine.RETRY_ATTEMPTS):
+                if len(pending) == 0:
+                    break
+
+                failed = collection.update_documents([(oper.document_id, oper.data) for oper in pending],
+                                                     updated_at)
+                failed = set(str(doc_id) for doc_id in failed)
+
+                updated.extend(oper.document_id for oper in pending if str(oper.document_id) not in failed)
+                pending = [oper for oper in pending if str(oper.document_id) in failed]
+                if len(pending) > 0:
+                    self._backoff(attempt)
+
+            # the updates which are dropped must not be redone by the replay
+            if len(pending) > 0:
+                aborted = self._db_core_engine.wal.abort([records[oper] for oper in pending])
+
+        ev = DocumentsBatchOrientedEvent(CollectionName(batch.collection), DocumentOperation.UPDATE_DOC, updated)
+        dropped = missing + pending
+        finished = [(oper, oper.document_id) for oper in batch.operations if oper not in dropped]
+
+        if len(dropped) > 0:
+            logging.warning(f"Update of {len(dropped)} documents on {batch.collection} is dropped")
+            error = Exception(f"Could not update documents {', '.join(str(oper.document_id) for oper in dropped)}")
+            # the updated documents are finished first, the batch failure is propagated to the rest
+            self._finish_when_durable(durable, finished, ev)
+            failed_when = aborted if aborted is not None else durable
+            failed_when.add_done_callback(lambda _: batch.failed(error))
+            return
+
+        self._finish_when_durable(durable, finished + [(batch, updated)], ev)
+
+    def _handle_read_batch(self, batch: BatchOperation):
+        collection: CollectionOperations = self._db_core_engine.get_collection_safely(batch.collection)
+
+        data = collection.read_documents(batch.document_ids)
+        for oper, doc in zip(batch.operations, data):
+            oper.set_data(doc)
+
+        batch.finished([oper.data for oper in batch.operations])
+
     def _handle_delete_operation(self, operation: DeleteOperation):
         collection: CollectionOperations = self._db_core_engine.get_collection_safely(operation.collection)
 
         filename = str(operation.document_id)
-        collection.delete_document(filename)
+        record = WALRecord(WALRecordType.DELETE, operation.collection, filename, datetime.datetime.utcnow())
+        with self._db_core_engine.wal.logged([record]) as durable:
+            collection.delete_document(filename)
+
+        self._finish_when_durable(durable, [(operation, operation.document_id)])
+
+    def _finish_when_durable(self, durable: futures.Future, finished: list, event: Event = None):
+        """Finishes the operations by the (operation, result) pairs and publishes the event once the records are synced
+
+        The worker does not wait for the sync, so the operations of all workers share one fsync. The neighbors
+        are not told about the write which could be lost by the crash.
+        """
+        def on_durable(future: futures.Future):
+            if future.exception() is not None:
+                for operation, _ in finished:
+                    operation.failed(future.exception())
+                return
+
+            if event is not None:
+                self.event_bus.publish(DocumentOperation(event.event_code), event)
+
+            for operation, result in finished:
+                operation.finished(result)
+
+        durable.add_done_callback(on_durable)
@@ -1,44 +1,80 @@
+import asyncio
+import itertools
 import json
+import logging
 import os
 import socket
 import threading
 
 from autumn_db import DocumentId
-from autumn_db.autumn_db import DBCoreEngine, DBOperationEngine, CreateOperation, ReadOperation, UpdateOperation
+from autumn_db.autumn_db import DBCoreEngine, DBOperationEngine, CreateOperation, ReadOperation, UpdateOperation, \
+    DBOperation as DBOperationBase, BatchOperation, DBOperationType
+from autumn_db.data_storage.predicate import Predicate, matches_all
 from autumn_db.event_bus.active_anti_entropy import AAEConfig, ActiveAntiEntropy
-from db_driver import DRIVER_COLLECTION_NAME_LENGTH_BYTES as COLLECTION_NAME_LENGTH_BYTES, DRIVER_OPERATION_LENGTH, \
-    DRIVER_DOCUMENT_ID_LENGTH, DocumentOperation
+from db_driver import DRIVER_COLLECTION_NAME_LENGTH_BYTES as COLLECTION_NAME_LENGTH_BYTES, \
+    DRIVER_DOCUMENT_ID_LENGTH, DocumentOperation, Frame, FrameReader, read_frame_async, FRAME_READ_CHUNK_SIZE, \
+    FRAME_FLAG_ERROR, FRAME_FLAG_MORE, DRIVER_BATCH_COUNT_LENGTH, encode_batch_items, decode_batch_items
 from db_driver import DRIVER_BYTEORDER as BYTEORDER
 from db_driver import DocumentOperation as DBOperation
 
 
-# MESSAGE format
-# |OpCode|Collection name length|Collection name|Data   |
-#  1byte        1byte               1-255bytes   Xbytes
+# MESSAGE format (is carried by the frame, see db_driver.Frame)
+# |Collection name length|Collection name|Data   |
+#         1byte               1-255bytes   Xbytes
 class ClientEndpoint:
-    BUFFER_SIZE = 1
-
-    def __init__(self, port: int, db_core: DBCoreEngine):
+    BACKLOG = 4096
+    MAX_IN_FLIGHT_PER_CONNECTION = 1024
+    # documents per frame of the streamed response
+    STREAM_FRAME_ITEMS = 256
+    MAX_SCAN_PAGE_SIZE = 10000
+    # the page of the selective filter is returned partially after so many documents are examined per its item
+    SCAN_EXAMINED_PER_ITEM = 16
+
+    def __init__(self, port: int, db_core: DBCoreEngine, workers: int = DBOperationEngine.DEFAULT_WORKERS,
+                 warm_collections: list = None):
         self._db_core = db_core
+        # operations which are answered by the frames of the generator instead of the queued DB operation
+        self._streamed = {
+            DBOperation.RANGE_SCAN.value: self._range_scan_frames,
+            DBOperation.SCAN.value: self._scan_frames,
+            DBOperation.QUERY.value: self._query_frames,
+        }
+
+        # the listed collections are opened before the clients are accepted, the rest are opened in background
+        # and requests to them wait for their collection only
+        if warm_collections is not None:
+            db_core.wait_until_ready(warm_collections)
 
         conf = self._read_aae_config()
-        self._db_opers = DBOperationEngine(db_core)
-        aae = ActiveAntiEntropy(conf, self._db_opers)
+        self._db_opers = DBOperationEngine(db_core, workers)
+        self._aae = ActiveAntiEntropy(conf, self._db_opers)
 
-        threading.Thread(target=aae.processing, args=()).start()
+        threading.Thread(target=self._aae.processing, args=()).start()
 
         th = threading.Thread(target=self._db_opers.processing, args=())
         th.start()
 
-        self._db_opers.event_bus.subscribe(DocumentOperation.UPDATE_DOC, aae.callback)
-        self._db_opers.event_bus.subscribe(DocumentOperation.CREATE_DOC, aae.callback)
+        self._db_opers.event_bus.subscribe(DocumentOperation.UPDATE_DOC, self._aae.callback)
+        self._db_opers.event_bus.subscribe(DocumentOperation.CREATE_DOC, self._aae.callback)
 
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._port = port
         self._socket.bind(
             ('0.0.0.0', port)
         )
-        self._socket.listen()
+        self._socket.listen(ClientEndpoint.BACKLOG)
+
+    @property
+    def aae(self) -> ActiveAntiEntropy:
+        return self._aae
+
+    def replication_stats(self) -> dict:
+        """Queue depth, in-flight documents and compression per neighbor, see NeighborReplicator.stats"""
+        return self._aae.stats()
+
+    def liveness(self) -> dict:
+        """Failure detector state per neighbor, see NeighborReplicator.liveness"""
+        return self._aae.liveness()
 
     @staticmethod
     def _read_aae_config() -> AAEConfig:
@@ -56,71 +92,384 @@ class ClientEndpoint:
         while True:
             connection, client_address = self._socket.accept()
 
-            received = bytearray()
+            # connections are long-lived, each one is served by own thread
+            threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+    def _serve_connection(self, connection: socket.socket):
+        reader = FrameReader(connection)
+        try:
             while True:
-                part = connection.recv(ClientEndpoint.BUFFER_SIZE)
-                if not part or part == b'\x00':
+                frame = reader.read_frame()
+                if frame is None:
                     break
 
-                received.extend(part)
-
-            oper = received[0]
-            received = received[DRIVER_OPERATION_LENGTH::]
-            if DBOperation.CREATE_DOC.value == oper:
-                collection_name_length_bytes = received[:COLLECTION_NAME_LENGTH_BYTES:1]
-                received = received[COLLECTION_NAME_LENGTH_BYTES::]
+                if frame.opcode in self._streamed:
+                    for response in self._streamed[frame.opcode](frame):
+                        connection.sendall(response.encode())
+                    continue
 
-                collection_name_length = int.from_bytes(collection_name_length_bytes, BYTEORDER, signed=False)
-                collection_name_bytes = received[:collection_name_length:1]
-                collection_name = collection_name_bytes.decode('utf-8')
+                response = self._handle_frame_sync(frame)
+                if response is not None:
+                    connection.sendall(response.encode())
+        except Exception as e:
+            logging.warning(e)
+        finally:
+            connection.close()
 
-                received = received[collection_name_length::]
-                doc_str = received.decode('utf-8')
-                oper = CreateOperation(collection_name, doc_str)
+    def _handle_frame_sync(self, frame: Frame):
+        try:
+            oper = self._map_to_operation(frame)
+            if oper is not None:
                 self._db_opers.add_operation(oper)
 
-                doc_id = oper.document_id
-                response_bytes = str(doc_id).encode('utf-8')
-                connection.sendall(response_bytes)
+                # the response is sent after the operation is applied
+                oper.result()
+
+            response = self._build_response(oper)
+        except Exception as e:
+            logging.warning(e)
+            return self._error_frame(frame, e)
 
-            if DBOperation.READ_DOC.value == oper:
-                collection_name_length_bytes = received[:COLLECTION_NAME_LENGTH_BYTES:1]
-                received = received[COLLECTION_NAME_LENGTH_BYTES::]
+        return self._response_frame(frame, response)
 
-                collection_name_length = int.from_bytes(collection_name_length_bytes, BYTEORDER, signed=False)
-                collection_name_bytes = received[:collection_name_length:1]
-                collection_name = collection_name_bytes.decode('utf-8')
+    def async_processing(self):
+        """Serves the clients by asyncio event loop, the connections are handled concurrently"""
+        asyncio.run(self.serve())
 
-                received = received[collection_name_length::]
-                doc_id = received.decode('utf-8')
-                doc_id = DocumentId(doc_id)
+    async def serve(self):
+        self._socket.setblocking(False)
+        server = await asyncio.start_server(
+            self._handle_connection, sock=self._socket, limit=FRAME_READ_CHUNK_SIZE
+        )
+
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # requests of the connection are handled concurrently, the responses are matched by request ID
+        write_lock = asyncio.Lock()
+        in_flight = asyncio.Semaphore(ClientEndpoint.MAX_IN_FLIGHT_PER_CONNECTION)
+        tasks = set()
 
-                oper = ReadOperation(collection_name, doc_id)
+        async def handle(frame: Frame):
+            try:
+                await self._handle_frame_async(frame, writer, write_lock)
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                frame = await read_frame_async(reader)
+                if frame is None:
+                    break
+
+                await in_flight.acquire()
+                task = asyncio.create_task(handle(frame))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if len(tasks) > 0:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except Exception as e:
+            logging.warning(e)
+            for task in tasks:
+                task.cancel()
+        finally:
+            writer.close()
+
+    async def _handle_frame_async(self, frame: Frame, writer: asyncio.StreamWriter, write_lock: asyncio.Lock):
+        if frame.opcode in self._streamed:
+            await self._stream_async(self._streamed[frame.opcode](frame), writer, write_lock)
+            return
+
+        try:
+            oper = self._map_to_operation(frame)
+            if oper is not None:
                 self._db_opers.add_operation(oper)
 
-                while not oper.is_finished():
+                # the response is sent after the operation is applied
+                await oper
+
+            response = self._response_frame(frame, self._build_response(oper))
+        except Exception as e:
+            logging.warning(e)
+            response = self._error_frame(frame, e)
+
+        if response is None:
+            return
+
+        async with write_lock:
+            writer.write(response.encode())
+            await writer.drain()
+
+    @staticmethod
+    async def _stream_async(frames, writer: asyncio.StreamWriter, write_lock: asyncio.Lock):
+        # the documents are read by the thread pool, so the event loop is not blocked by the disk
+        loop = asyncio.get_running_loop()
+        while True:
+            response = await loop.run_in_executor(None, next, frames, None)
+            if response is None:
+                return
+
+            async with write_lock:
+                writer.write(response.encode())
+                await writer.drain()
+
+    def _range_scan_frames(self, request: Frame):
+        """Frames of the range scan response, all of them but the last one have FRAME_FLAG_MORE"""
+        if request.request_id == 0:
+            return
+
+        try:
+            collection_name, received = self._split_collection_name(request.payload)
+            bounds = list()
+            for i in range(2):
+                src = bytes(received[i * DRIVER_DOCUMENT_ID_LENGTH:(i + 1) * DRIVER_DOCUMENT_ID_LENGTH])
+                bounds.append(DocumentId.from_bytes(src) if any(src) else None)
+            limit = int.from_bytes(received[2 * DRIVER_DOCUMENT_ID_LENGTH:][:DRIVER_BATCH_COUNT_LENGTH], BYTEORDER,
+                                   signed=False)
+
+            collection = self._db_core.get_collection_safely(collection_name)
+            doc_ids = collection.scan(bounds[0], bounds[1], limit or None)
+
+            chunk_size = ClientEndpoint.STREAM_FRAME_ITEMS
+            for i in range(0, max(len(doc_ids), 1), chunk_size):
+                chunk = doc_ids[i:i + chunk_size]
+
+                items = list()
+                for doc_id, data in zip(chunk, collection.read_documents(chunk)):
+                    # the document is deleted after the scan
+                    if data is not None:
+                        items.append(DocumentId(doc_id).to_bytes() + data.encode('utf-8'))
+
+                flags = FRAME_FLAG_MORE if i + chunk_size < len(doc_ids) else 0
+                yield Frame(request.opcode, encode_batch_items(items), flags, request.request_id)
+        except Exception as e:
+            logging.warning(e)
+            yield self._error_frame(request, e)
+
+    def _scan_frames(self, request: Frame):
+        """The page of the scan as one frame: the next cursor followed by the matched documents"""
+        if request.request_id == 0:
+            return
+
+        try:
+            collection_name, received = self._split_collection_name(request.payload)
+            src = bytes(received[:DRIVER_DOCUMENT_ID_LENGTH])
+            cursor = DocumentId.from_bytes(src) if any(src) else None
+            received = received[DRIVER_DOCUMENT_ID_LENGTH:]
+            page_size = int.from_bytes(received[:DRIVER_BATCH_COUNT_LENGTH], BYTEORDER, signed=False)
+            page_size = min(max(page_size, 1), ClientEndpoint.MAX_SCAN_PAGE_SIZE)
+            received = received[DRIVER_BATCH_COUNT_LENGTH:]
+            predicates = Predicate.parse_all(json.loads(bytes(received).decode('utf-8'))) if len(received) > 0 \
+                else list()
+
+            collection = self._db_core.get_collection_safely(collection_name)
+            cursor, items = self._scan_page(collection, cursor, page_size, predicates)
+
+            payload = bytearray(cursor.to_bytes() if cursor is not None else bytes(DRIVER_DOCUMENT_ID_LENGTH))
+            payload.extend(encode_batch_items(items))
+            yield Frame(request.opcode, payload, request_id=request.request_id)
+        except Exception as e:
+            logging.warning(e)
+            yield self._error_frame(request, e)
+
+    @staticmethod
+    def _scan_page(collection, cursor: DocumentId, page_size: int, predicates: list) -> tuple:
+        """Returns the next cursor (None at the end of the collection) and the items of the matched documents
+
+        The documents after the cursor are read by the chunks of the page size, so the page holds
+        at most page size documents in memory. The cursor is the last examined ID, the scan is resumed after it
+        even if that document is deleted meanwhile.
+        """
+        items = list()
+        max_examined = page_size * ClientEndpoint.SCAN_EXAMINED_PER_ITEM
+        examined = 0
+
+        while len(items) < page_size and examined < max_examined:
+            count = page_size - len(items)
+            doc_ids = collection.scan(cursor, None, count + 1)
+            exhausted = len(doc_ids) < count + 1
+            if cursor is not None and len(doc_ids) > 0 and doc_ids[0] == str(cursor):
+                doc_ids = doc_ids[1:]
+            elif not exhausted:
+                doc_ids = doc_ids[:count]
+
+            for doc_id, data in zip(doc_ids, collection.read_documents(doc_ids)):
+                examined += 1
+                cursor = DocumentId(doc_id)
+                # the document is deleted after the scan
+                if data is None:
                     continue
 
-                result = oper.data
-                _response_bytes = bytearray(result.encode('utf-8'))
-                _response_bytes.extend(b'\x00')
+                if len(predicates) > 0 and not matches_all(predicates, json.loads(data)):
+                    continue
 
-                connection.sendall(_response_bytes)
+                items.append(cursor.to_bytes() + data.encode('utf-8'))
 
-            if DBOperation.UPDATE_DOC.value == oper:
-                oper = self._map_to_update_operation(received)
-                self._db_opers.add_operation(oper)
+            if exhausted:
+                return None, items
 
-            if DBOperation.DELETE_DOC.value == oper:
-                pass
+        return cursor, items
 
-            connection.close()
+    def _query_frames(self, request: Frame):
+        """Frames of the query response, the documents are found by the secondary indexes if they serve the filter"""
+        if request.request_id == 0:
+            return
+
+        try:
+            collection_name, received = self._split_collection_name(request.payload)
+            limit = int.from_bytes(received[:DRIVER_BATCH_COUNT_LENGTH], BYTEORDER, signed=False)
+            predicates = Predicate.parse_all(json.loads(bytes(received[DRIVER_BATCH_COUNT_LENGTH:]).decode('utf-8')))
+
+            collection = self._db_core.get_collection_safely(collection_name)
+            items = itertools.islice(self._query_items(collection, predicates), limit or None)
+
+            # the frame is sent when the next one is started, so the last one is sent without FRAME_FLAG_MORE
+            frame_items = list()
+            for item in items:
+                if len(frame_items) == ClientEndpoint.STREAM_FRAME_ITEMS:
+                    yield Frame(request.opcode, encode_batch_items(frame_items), FRAME_FLAG_MORE, request.request_id)
+                    frame_items = list()
+                frame_items.append(item)
+
+            yield Frame(request.opcode, encode_batch_items(frame_items), request_id=request.request_id)
+        except Exception as e:
+            logging.warning(e)
+            yield self._error_frame(request, e)
+
+    def _query_items(self, collection, predicates: list):
+        doc_ids = collection.query(predicates)
+        chunk_size = ClientEndpoint.STREAM_FRAME_ITEMS
+
+        if doc_ids is None:
+            # no index serves the filter, the collection is scanned page by page
+            cursor = None
+            while True:
+                cursor, items = self._scan_page(collection, cursor, chunk_size, predicates)
+                yield from items
+                if cursor is None:
+                    return
+
+        for i in range(0, len(doc_ids), chunk_size):
+            chunk = doc_ids[i:i + chunk_size]
+            for doc_id, data in zip(chunk, collection.read_documents(chunk)):
+                # the index serves one predicate, the rest of them are checked by the document
+                if data is not None and matches_all(predicates, json.loads(data)):
+                    yield DocumentId(doc_id).to_bytes() + data.encode('utf-8')
+
+    @staticmethod
+    def _response_frame(request: Frame, payload: bytes):
+        if request.request_id == 0:
+            return None
+
+        if payload is None:
+            payload = b''
+
+        return Frame(request.opcode, payload, request_id=request.request_id)
+
+    @staticmethod
+    def _error_frame(request: Frame, error: Exception):
+        if request.request_id == 0:
+            return None
+
+        return Frame(request.opcode, str(error).encode('utf-8'), FRAME_FLAG_ERROR, request.request_id)
+
+    @staticmethod
+    def _build_response(oper: DBOperationBase):
+        if isinstance(oper, CreateOperation):
+            return oper.document_id.to_bytes()
+
+        if isinstance(oper, ReadOperation):
+            return oper.data.encode('utf-8')
+
+        if isinstance(oper, BatchOperation):
+            if oper.operation_type == DBOperationType.CREATE:
+                return encode_batch_items([doc_id.to_bytes() for doc_id in oper.document_ids])
+
+            if oper.operation_type == DBOperationType.READ:
+                return encode_batch_items([read.data.encode('utf-8') for read in oper.operations])
+
+        return None
+
+    @staticmethod
+    def _map_to_operation(frame: Frame):
+        oper = frame.opcode
+        received = frame.payload
+        if DBOperation.CREATE_DOC.value == oper:
+            collection_name_length_bytes = received[:COLLECTION_NAME_LENGTH_BYTES:1]
+            received = received[COLLECTION_NAME_LENGTH_BYTES::]
+
+            collection_name_length = int.from_bytes(collection_name_length_bytes, BYTEORDER, signed=False)
+            collection_name_bytes = received[:collection_name_length:1]
+            collection_name = collection_name_bytes.decode('utf-8')
+
+            received = received[collection_name_length::]
+            doc_str = received.decode('utf-8')
+            return CreateOperation(collection_name, doc_str)
+
+        if DBOperation.READ_DOC.value == oper:
+            collection_name_length_bytes = received[:COLLECTION_NAME_LENGTH_BYTES:1]
+            received = received[COLLECTION_NAME_LENGTH_BYTES::]
+
+            collection_name_length = int.from_bytes(collection_name_length_bytes, BYTEORDER, signed=False)
+            collection_name_bytes = received[:collection_name_length:1]
+            collection_name = collection_name_bytes.decode('utf-8')
+
+            received = received[collection_name_length::]
+            doc_id = DocumentId.from_bytes(bytes(received))
+
+            return ReadOperation(collection_name, doc_id)
+
+        if DBOperation.UPDATE_DOC.value == oper:
+            return ClientEndpoint._map_to_update_operation(received)
+
+        if DBOperation.DELETE_DOC.value == oper:
+            pass
+
+        if DBOperation.CREATE_DOCS.value == oper:
+            collection_name, received = ClientEndpoint._split_collection_name(received)
+            operations = [CreateOperation(collection_name, doc.decode('utf-8')) for doc in decode_batch_items(received)]
+
+            return BatchOperation(DBOperationType.CREATE, collection_name, operations)
+
+        if DBOperation.READ_DOCS.value == oper:
+            collection_name, received = ClientEndpoint._split_collection_name(received)
+            operations = [
+                ReadOperation(collection_name, DocumentId.from_bytes(bytes(doc_id)))
+                for doc_id in decode_batch_items(received)
+            ]
+
+            return BatchOperation(DBOperationType.READ, collection_name, operations)
+
+        if DBOperation.UPDATE_DOCS.value == oper:
+            collection_name, received = ClientEndpoint._split_collection_name(received)
+
+            operations = list()
+            for item in decode_batch_items(received):
+                doc_id = DocumentId.from_bytes(bytes(item[:DRIVER_DOCUMENT_ID_LENGTH:]))
+                doc_str = item[DRIVER_DOCUMENT_ID_LENGTH::].decode('utf-8')
+                operations.append(UpdateOperation(collection_name, doc_id, doc_str))
+
+            return BatchOperation(DBOperationType.UPDATE, collection_name, operations)
+
+        return None
+
+    @staticmethod
+    def _split_collection_name(received: bytes) -> tuple:
+        collection_name_length = int.from_bytes(received[:COLLECTION_NAME_LENGTH_BYTES:1], BYTEORDER, signed=False)
+        received = received[COLLECTION_NAME_LENGTH_BYTES::]
+
+        collection_name = received[:collection_name_length:1].decode('utf-8')
+        received = received[collection_name_length::]
+
+        return collection_name, received
 
     @staticmethod
     def _map_to_update_operation(received: bytes):
         # UPDATE MESSAGE format
         # |OpCode|Collection name length|Collection name|Document ID|   Data   |
-        #  1byte        1byte               1-255bytes     26bytes     Xbytes
+        #  1byte        1byte               1-255bytes     16bytes     Xbytes
 
         collection_name_length_bytes = received[:COLLECTION_NAME_LENGTH_BYTES:1]
         received = received[COLLECTION_NAME_LENGTH_BYTES::]
@@ -132,8 +481,7 @@ class ClientEndpoint:
         received = received[collection_name_length::]
 
         doc_id_bytes = received[:DRIVER_DOCUMENT_ID_LENGTH:]
-        doc_id = doc_id_bytes.decode('utf-8')
-        doc_id = DocumentId(doc_id)
+        doc_id = DocumentId.from_bytes(bytes(doc_id_bytes))
 
         received = received[DRIVER_DOCUMENT_ID_LENGTH::]
         doc_str = received.decode('utf-8')
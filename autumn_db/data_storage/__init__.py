@@ -0,0 +1,11 @@
+import datetime
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_microseconds(_datetime: datetime.datetime) -> int:
+    return (_datetime - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_microseconds(microseconds: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(microseconds=microseconds)
@@ -0,0 +1,81 @@
+import datetime
+import threading
+from collections import OrderedDict
+
+
+class DocumentCache:
+    """LRU cache of the document bodies and their updated_at bounded by the total size of the bodies
+
+    The size of an entry is the length of its UTF-8 encoded body, capacity 0 disables the cache.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def get(self, doc_id: str):
+        """Returns (data, updated_at) or None"""
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(doc_id)
+            self._hits += 1
+
+        data, updated_at, _ = entry
+        return data, updated_at
+
+    def put(self, doc_id: str, data: str, updated_at: datetime.datetime):
+        size = len(data.encode('utf-8'))
+        if size > self._capacity:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(doc_id, None)
+            if previous is not None:
+                self._size -= previous[2]
+
+            self._entries[doc_id] = (data, updated_at, size)
+            self._size += size
+
+            while self._size > self._capacity:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self._evictions += 1
+
+    def invalidate(self, doc_id: str):
+        with self._lock:
+            entry = self._entries.pop(doc_id, None)
+            if entry is not None:
+                self._size -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'capacity': self._capacity,
+                'size': self._size,
+                'count': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,5 +1,6 @@
 import datetime
 
+from algorithms.merkle_tree import MerkleTree
 from algorithms.ph2 import PH2
 from algorithms.spectral_bloom_filter import SpectralBloomFilter
 from autumn_db import DocumentId
@@ -61,6 +62,8 @@ class CollectionOperations(object):
 
     def delete(self): ...
 
+    def close(self): ...
+
     def update_document(self, doc_id: DocumentId, data: str, updated_at: datetime.datetime = None): ...
 
     def get_updated_at(self, doc_id: DocumentId) -> datetime.datetime: ...
@@ -69,8 +72,30 @@ class CollectionOperations(object):
 
     def read_document_with_updated_at(self, doc_id: DocumentId) -> tuple: ...
 
+    def create_documents(self, docs: list, updated_at: datetime.datetime = None): ...
+
+    def update_documents(self, docs: list, updated_at: datetime.datetime = None) -> list: ...
+
+    def read_documents(self, doc_ids: list) -> list: ...
+
     def set_updated_at(self, doc_id: DocumentId, updated_at: datetime.datetime): ...
 
+    def is_frozen(self, doc_id: DocumentId) -> bool: ...
+
+    def set_is_frozen(self, doc_id: DocumentId, is_frozen: bool): ...
+
     def doc_ids(self) -> set: ...
 
-    def get_snapshot(self, doc_id: DocumentId) -> tuple: ...
+    def scan(self, start_id: DocumentId = None, end_id: DocumentId = None, limit: int = None) -> list: ...
+
+    def create_index(self, path: str, kind: str = 'hash'): ...
+
+    def drop_index(self, path: str, kind: str = 'hash'): ...
+
+    def indexes(self) -> list: ...
+
+    def query(self, predicates: list): ...
+
+    def get_snapshot(self, doc_id: DocumentId) -> bytes: ...
+
+    def get_merkle_tree(self) -> MerkleTree: ...
@@ -0,0 +1,47 @@
+from bisect import bisect_left
+
+
+class DocIdIndex:
+    """Sorted array of the document IDs
+
+    The string forms of DocumentId are ordered as the IDs themselves, so the range of the IDs is found by bisect.
+    The generated IDs are growing, so the new documents are appended to the end without moving the array.
+    Is not thread-safe, the collection calls it under its lock.
+    """
+
+    def __init__(self):
+        self._ids = list()
+
+    def add(self, doc_id: str):
+        if len(self._ids) == 0 or self._ids[-1] < doc_id:
+            self._ids.append(doc_id)
+            return
+
+        i = bisect_left(self._ids, doc_id)
+        if i == len(self._ids) or self._ids[i] != doc_id:
+            self._ids.insert(i, doc_id)
+
+    def extend(self, doc_ids):
+        # the bulk loading is sorted once instead of inserting one by one
+        self._ids = sorted(set(self._ids).union(doc_ids))
+
+    def remove(self, doc_id: str):
+        i = bisect_left(self._ids, doc_id)
+        if i != len(self._ids) and self._ids[i] == doc_id:
+            del self._ids[i]
+
+    def range(self, start: str = None, end: str = None, limit: int = None) -> list:
+        """IDs from start inclusive to end exclusive in ascending order, None means no bound"""
+        lo = 0 if start is None else bisect_left(self._ids, start)
+        hi = len(self._ids) if end is None else bisect_left(self._ids, end)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+
+        return self._ids[lo:hi]
+
+    def __contains__(self, doc_id: str):
+        i = bisect_left(self._ids, doc_id)
+        return i != len(self._ids) and self._ids[i] == doc_id
+
+    def __len__(self):
+        return len(self._ids)
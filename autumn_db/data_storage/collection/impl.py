@@ -1,14 +1,22 @@
 import datetime
 import json
+import logging
 import os
 import shutil
 import threading
 
 from algorithms import to_bytearray_from_values
+from algorithms.merkle_tree import MerkleTree
 from algorithms.ph2 import PH2
 from algorithms.spectral_bloom_filter import SpectralBloomFilter
 from autumn_db.autumn_db import DocumentId
+from autumn_db.data_storage import to_microseconds, from_microseconds
+from autumn_db.data_storage.cache import DocumentCache
 from autumn_db.data_storage.collection import DocumentOperations, MetadataOperations, CollectionOperations, file_access
+from autumn_db.data_storage.collection.doc_id_index import DocIdIndex
+from autumn_db.data_storage.collection.manifest import SnapshotManifest
+from autumn_db.data_storage.collection.secondary_index import SecondaryIndexes, HASH_INDEX
+from autumn_db.data_storage.collection.snapshot_table import SnapshotTable
 
 
 def calculate_sbf(_bytearray: bytearray) -> SpectralBloomFilter:
@@ -25,6 +33,27 @@ def calculate_ph2(_bytearray: bytearray):
     return res
 
 
+def calculate_snapshot(data: str) -> bytes:
+    """SBF and PH2 hash of the document values, they are computed once per write"""
+    _bytearray = to_bytearray_from_values(json.loads(data))
+    sbf = calculate_sbf(_bytearray)
+    ph2 = calculate_ph2(_bytearray)
+
+    return bytes(sbf.get()) + bytes(ph2.hashing())
+
+
+# metadata table entry is one integer: updated at in microseconds shifted by one bit and the frozen bit
+METADATA_FROZEN_BIT = 0x01
+
+
+def pack_metadata(updated_at: datetime.datetime, is_frozen: bool) -> int:
+    return (to_microseconds(updated_at) << 1) | (METADATA_FROZEN_BIT if is_frozen else 0)
+
+
+def unpack_metadata(packed: int) -> tuple:
+    return from_microseconds(packed >> 1), bool(packed & METADATA_FROZEN_BIT)
+
+
 class MetadataOperationsImpl(MetadataOperations):
     UPDATED_AT_KEY = 'updated_at'
     IS_FROZEN_KEY = 'is_frozen'
@@ -78,26 +107,123 @@ class DocumentOperationsImpl(DocumentOperations):
 
 
 class CollectionOperationsImpl(CollectionOperations):
+    """Collection stored as the files: data/<doc id> and metadata/<doc id>
+
+    The storage specific work is done by the underscored primitives (_write_document, _read_data, etc.),
+    other storage engines override them and reuse the rest of the collection.
+
+    Metadata is kept by the in-memory table and written through to the metadata files, a file is read only
+    when its document is not in the table yet. Read documents are kept by the LRU cache until they are changed.
+
+    Snapshots and metadata of the documents are persisted by the manifest, so the collection is opened
+    without reading the documents. In memory the snapshots are kept by the compact table of 14 bytes records.
+    The snapshots are also hashed by the Merkle tree to compare the replicas.
+    The sorted index of the document IDs serves the scans of the ID ranges, that is the time windows.
+    The declared secondary indexes of JSON paths serve the queries by the values, see SecondaryIndexes.
+    """
+    CACHE_SIZE = 32 * 1024 * 1024
+    REQUIRED_DIRS = ('data', 'metadata')
 
-    def __init__(self, name: str, data_holder_path: str = None):
+    def __init__(self, name: str, data_holder_path: str = None, cache_size: int = CACHE_SIZE):
         super().__init__(name, data_holder_path)
         self._lock = threading.Lock()
+        self._cache = DocumentCache(cache_size)
 
         # self._doc_ids = set()
-        self._doc_snapshot_mapping = dict()
+        self._snapshots = SnapshotTable()
+        self._doc_id_index = DocIdIndex()
+        self._merkle_tree = MerkleTree()
+        self._metadata = dict()
+        self._manifest = None
+        self._indexes = None
         self._init_initial_doc_ids()
 
     def _init_initial_doc_ids(self):
-        for dirpath, _, filenames in os.walk(os.path.join(self._full_path_to_collection, 'data')):
-            doc_ids = set(filenames)
-            with self._lock:
-                if self.name not in self._doc_snapshot_mapping.keys():
-                    self._doc_snapshot_mapping[self.name] = set()
+        if os.path.isdir(self._full_path_to_collection):
+            self._open_manifest()
 
-                self._doc_snapshot_mapping[self.name].union(doc_ids)
+    def _open_manifest(self):
+        self._manifest = SnapshotManifest(os.path.join(self._full_path_to_collection, SnapshotManifest.FILENAME))
+        entries = self._manifest.load()
+        stored = set(self._stored_doc_ids())
+
+        with self._lock:
+            for doc_id, (metadata, snapshot) in entries.items():
+                if doc_id not in stored:
+                    # the document was removed after its record had been written
+                    self._manifest.remove(doc_id)
+                    continue
+
+                self._snapshots.put(doc_id, snapshot)
+                self._merkle_tree.update(doc_id, snapshot)
+                self._restore_metadata(doc_id, metadata)
+
+            self._doc_id_index.extend(self._snapshots.doc_ids())
+
+            # documents written before the manifest existed are hashed once
+            for doc_id in stored.difference(entries.keys()):
+                try:
+                    self._set_snapshot(doc_id, calculate_snapshot(self._read_data(doc_id)))
+                except Exception as e:
+                    logging.warning(f"Could not load document {doc_id} of {self.name}: {e}")
+
+            self._open_indexes(stored)
+
+    def _open_indexes(self, stored: set):
+        # is called under the lock
+        self._indexes = SecondaryIndexes(os.path.join(self._full_path_to_collection, SecondaryIndexes.DIRNAME))
+        self._indexes.open()
+        if len(self._indexes) == 0:
+            return
+
+        self._indexes.retain(stored)
+
+        # documents written after their index entries had been lost are indexed again
+        for index in self._indexes:
+            missed = [doc_id for doc_id in stored if doc_id not in index]
+            if len(missed) > 0:
+                index.put_all(self._parsed_documents(missed))
+
+    def _parsed_documents(self, doc_ids: list):
+        # is called under the lock, generates (doc ID, parsed document)
+        # the documents are read by the storage, the indexing does not touch the cache of the working set
+        for doc_id in doc_ids:
+            try:
+                yield doc_id, json.loads(self._read_data(doc_id))
+            except Exception as e:
+                logging.warning(f"Could not index document {doc_id} of {self.name}: {e}")
+
+    def _index_document(self, doc_id: str, data: str):
+        # is called under the lock
+        if self._indexes is not None and len(self._indexes) > 0:
+            self._indexes.put_document(doc_id, json.loads(data))
+
+    def _set_snapshot(self, doc_id: str, snapshot: bytes):
+        # is called under the lock
+        self._snapshots.put(doc_id, snapshot)
+        self._doc_id_index.add(doc_id)
+        self._merkle_tree.update(doc_id, snapshot)
+        self._persist_snapshot(doc_id, snapshot)
+
+    def _drop_snapshot(self, doc_id: str):
+        # is called under the lock
+        self._snapshots.remove(doc_id)
+        self._doc_id_index.remove(doc_id)
+        self._merkle_tree.remove(doc_id)
+        if self._manifest is not None:
+            self._manifest.remove(doc_id)
+        if self._indexes is not None:
+            self._indexes.remove_document(doc_id)
+
+    def _persist_snapshot(self, doc_id: str, snapshot: bytes):
+        if self._manifest is None:
+            return
+
+        metadata = pack_metadata(self._read_updated_at(doc_id), self._read_is_frozen(doc_id))
+        self._manifest.put(doc_id, metadata, snapshot)
 
     def __len__(self):
-        return len(self._doc_snapshot_mapping.keys())
+        return len(self._snapshots)
 
     def create(self):
         path_to_data = os.path.join(self._full_path_to_collection, 'data')
@@ -106,122 +232,323 @@ class CollectionOperationsImpl(CollectionOperations):
             os.makedirs(path_to_data)
             os.makedirs(path_to_metadata)
 
+        self._open_manifest()
+
     def delete(self):
+        self.close()
+        self._cache.clear()
         shutil.rmtree(self._full_path_to_collection)
 
-    def create_document(self, filename: str, data: str, updated_at: datetime.datetime = None):
-        if updated_at is None:
-            updated_at = datetime.datetime.utcnow()
+    def close(self):
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
 
-        data_pathname = os.path.join(self._full_path_to_collection, 'data', filename)
-        metadata_pathname = os.path.join(self._full_path_to_collection, 'metadata', filename)
+        if self._indexes is not None:
+            self._indexes.close()
+            self._indexes = None
 
-        file_access.create(data_pathname, data)
+    def create_index(self, path: str, kind: str = HASH_INDEX):
+        """Declares the index of the dot separated JSON path, kind is HASH_INDEX or ORDERED_INDEX
 
-        metadata_content = {
-            MetadataOperationsImpl.UPDATED_AT_KEY: updated_at.strftime(
-                    DocumentId.UTC_FORMAT),
-            MetadataOperationsImpl.IS_FROZEN_KEY: False
-        }
-        metadata_content_str = json.dumps(metadata_content)
-        file_access.create(metadata_pathname, metadata_content_str)
+        The existing documents are indexed at once, the writes to the collection wait for it.
+        """
+        with self._lock:
+            index = self._indexes.create(path, kind)
+            if index is None:
+                return
 
-        #calc Snapshot
-        _bytearray = to_bytearray_from_values(json.loads(data))
-        sbf = calculate_sbf(_bytearray)
-        ph2 = calculate_ph2(_bytearray)
+            index.put_all(self._parsed_documents(list(self._snapshots.doc_ids())))
 
+    def drop_index(self, path: str, kind: str = HASH_INDEX):
         with self._lock:
-            self._doc_snapshot_mapping[filename] = (sbf, ph2)
+            self._indexes.drop(path, kind)
 
-    def delete_document(self, filename: str):
-        data_pathname = os.path.join(self._full_path_to_collection, 'data', filename)
-        metadata_pathname = os.path.join(self._full_path_to_collection, 'metadata', filename)
+    def indexes(self) -> list:
+        with self._lock:
+            res = self._indexes.declarations()
 
-        file_access.delete(data_pathname)
-        file_access.delete(metadata_pathname)
+        return res
 
-    def document_exists(self, filename: str) -> bool:
-        path = os.path.join(self._full_path_to_collection, 'data', filename)
-        return os.path.isfile(path)
+    def query(self, predicates: list):
+        """IDs of the documents which may match the predicates, they are found by the most selective index
 
-    def _get_document_operator(self, filename: str) -> DocumentOperations:
-        pathname = os.path.join(self._full_path_to_collection, 'data', filename)
+        None if no predicate is served by the indexes, the caller checks the documents by all predicates.
+        """
+        with self._lock:
+            res = self._indexes.lookup(predicates) if self._indexes is not None else None
 
-        res = DocumentOperationsImpl(pathname)
         return res
 
-    def _get_metadata_operator(self, filename: str) -> MetadataOperations:
-        pathname = os.path.join(self._full_path_to_collection, 'metadata', filename)
+    def create_document(self, filename: str, data: str, updated_at: datetime.datetime = None):
+        if updated_at is None:
+            updated_at = datetime.datetime.utcnow()
 
-        res = MetadataOperationsImpl(pathname)
-        return res
+        self._write_document(filename, data, updated_at)
+        snapshot = calculate_snapshot(data)
+
+        with self._lock:
+            self._set_snapshot(filename, snapshot)
+            self._index_document(filename, data)
+
+    def create_documents(self, docs: list, updated_at: datetime.datetime = None):
+        # docs is the list of (filename, data) pairs, the snapshots mapping is locked once per batch
+        if updated_at is None:
+            updated_at = datetime.datetime.utcnow()
+
+        snapshots = dict()
+        for filename, data in docs:
+            self._write_document(filename, data, updated_at)
+            snapshots[filename] = calculate_snapshot(data)
+
+        with self._lock:
+            for filename, data in docs:
+                self._set_snapshot(filename, snapshots[filename])
+                self._index_document(filename, data)
+
+    def delete_document(self, filename: str):
+        self._remove_document(filename)
+
+        with self._lock:
+            self._cache.invalidate(filename)
+            self._drop_snapshot(filename)
+
+    def document_exists(self, filename: str) -> bool:
+        return self._has_document(filename)
 
     def update_document(self, doc_id: DocumentId, data: str, updated_at: datetime.datetime = None):
         if updated_at is None:
             updated_at = datetime.datetime.utcnow()
 
         doc_id = str(doc_id)
-        doc_oper = self._get_document_operator(doc_id)
-        metadata_oper = self._get_metadata_operator(doc_id)
 
         # calc Snapshot
-        _bytearray = to_bytearray_from_values(json.loads(data))
-        sbf = calculate_sbf(_bytearray)
-        ph2 = calculate_ph2(_bytearray)
+        snapshot = calculate_snapshot(data)
+
+        with self._lock:
+            self._cache.invalidate(doc_id)
+            self._rewrite_document(doc_id, data, updated_at)
+            self._set_snapshot(doc_id, snapshot)
+            self._index_document(doc_id, data)
+
+    def update_documents(self, docs: list, updated_at: datetime.datetime = None) -> list:
+        # docs is the list of (doc_id, data) pairs, returns IDs of the documents which could not be updated
+        if updated_at is None:
+            updated_at = datetime.datetime.utcnow()
 
+        prepared = list()
+        for doc_id, data in docs:
+            # calc Snapshot
+            prepared.append((str(doc_id), data, calculate_snapshot(data)))
+
+        failed = list()
         with self._lock:
-            doc_oper.update(data)
-            metadata_oper.set_updated_at(updated_at)
-            self._doc_snapshot_mapping[doc_id] = (sbf, ph2)
+            for doc_id, data, snapshot in prepared:
+                self._cache.invalidate(doc_id)
+                try:
+                    self._rewrite_document(doc_id, data, updated_at)
+                except Exception:
+                    failed.append(DocumentId(doc_id))
+                    continue
+
+                self._set_snapshot(doc_id, snapshot)
+                self._index_document(doc_id, data)
+
+        return failed
 
     def get_updated_at(self, doc_id: DocumentId) -> datetime.datetime:
         doc_id = str(doc_id)
-        metadata_oper = self._get_metadata_operator(doc_id)
 
         with self._lock:
-            updated_at = metadata_oper.get_updated_at()
+            updated_at = self._read_updated_at(doc_id)
 
         return updated_at
 
     def set_updated_at(self, doc_id: DocumentId, updated_at: datetime.datetime):
         doc_id = str(doc_id)
-        metadata_oper = self._get_metadata_operator(doc_id)
 
         with self._lock:
-            metadata_oper.set_updated_at(updated_at)
+            self._cache.invalidate(doc_id)
+            self._write_updated_at(doc_id, updated_at)
+            self._persist_metadata(doc_id)
 
-    def read_document(self, doc_id: DocumentId) -> str:
+    def is_frozen(self, doc_id: DocumentId) -> bool:
         doc_id = str(doc_id)
-        doc_oper = self._get_document_operator(doc_id)
 
         with self._lock:
-            data = doc_oper.read()
+            is_frozen = self._read_is_frozen(doc_id)
+
+        return is_frozen
+
+    def set_is_frozen(self, doc_id: DocumentId, is_frozen: bool):
+        doc_id = str(doc_id)
+
+        with self._lock:
+            self._write_is_frozen(doc_id, is_frozen)
+            self._persist_metadata(doc_id)
+
+    def _persist_metadata(self, doc_id: str):
+        snapshot = self._snapshots.get(doc_id)
+        if snapshot is not None:
+            self._persist_snapshot(doc_id, snapshot)
+
+    def read_document(self, doc_id: DocumentId) -> str:
+        data, _ = self.read_document_with_updated_at(doc_id)
 
         return data
 
     def read_document_with_updated_at(self, doc_id: DocumentId) -> tuple:
         doc_id = str(doc_id)
-        doc_oper = self._get_document_operator(doc_id)
-        metadata_oper = self._get_metadata_operator(doc_id)
+
+        cached = self._cache.get(doc_id)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            res = self._read_through_cache(doc_id)
+
+        return res
+
+    def read_documents(self, doc_ids: list) -> list:
+        # absent documents are returned as None
+        res = list()
+        missed = dict()
+        for i, doc_id in enumerate(doc_ids):
+            cached = self._cache.get(str(doc_id))
+            if cached is None:
+                missed[i] = str(doc_id)
+            res.append(cached[0] if cached is not None else None)
+
+        if len(missed) == 0:
+            return res
 
         with self._lock:
-            data = doc_oper.read()
-            updated_at = metadata_oper.get_updated_at()
+            for i, doc_id in missed.items():
+                try:
+                    res[i], _ = self._read_through_cache(doc_id)
+                except Exception:
+                    pass
+
+        return res
+
+    def _read_through_cache(self, doc_id: str) -> tuple:
+        # is called under the lock, so the document could not be changed between the read and the caching
+        data = self._read_data(doc_id)
+        updated_at = self._read_updated_at(doc_id)
+        self._cache.put(doc_id, data, updated_at)
 
         return data, updated_at
 
+    @property
+    def cache(self) -> DocumentCache:
+        return self._cache
+
     def doc_ids(self) -> set:
         with self._lock:
-            ids = self._doc_snapshot_mapping.keys()
+            res = set(self._snapshots.doc_ids())
+
+        return res
+
+    def scan(self, start_id: DocumentId = None, end_id: DocumentId = None, limit: int = None) -> list:
+        """IDs of the documents from start_id inclusive to end_id exclusive in ascending order"""
+        start = str(start_id) if start_id is not None else None
+        end = str(end_id) if end_id is not None else None
+
+        with self._lock:
+            res = self._doc_id_index.range(start, end, limit)
+
+        return res
+
+    def get_snapshot(self, doc_id: DocumentId) -> bytes:
+        # 14 bytes: SBF and PH2 hash, None if there is no such document
+        with self._lock:
+            res = self._snapshots.get(str(doc_id))
+
+        return res
+
+    def get_merkle_tree(self) -> MerkleTree:
+        return self._merkle_tree
+
+    def _get_document_operator(self, filename: str) -> DocumentOperations:
+        pathname = os.path.join(self._full_path_to_collection, 'data', filename)
 
-        res = set(ids)
+        res = DocumentOperationsImpl(pathname)
         return res
 
-    def get_snapshot(self, doc_id: DocumentId) -> tuple:
-        _doc_id = str(doc_id)
-        if _doc_id not in self._doc_snapshot_mapping.keys():
-            return None
+    def _get_metadata_operator(self, filename: str) -> MetadataOperations:
+        pathname = os.path.join(self._full_path_to_collection, 'metadata', filename)
 
-        res = self._doc_snapshot_mapping[_doc_id]
+        res = MetadataOperationsImpl(pathname)
         return res
+
+    def _restore_metadata(self, doc_id: str, packed: int):
+        self._metadata[doc_id] = packed
+
+    def _metadata_of(self, doc_id: str) -> int:
+        packed = self._metadata.get(doc_id)
+        if packed is None:
+            metadata = self._get_metadata_operator(doc_id)
+            packed = pack_metadata(metadata.get_updated_at(), metadata.is_frozen())
+            self._metadata[doc_id] = packed
+
+        return packed
+
+    def _store_metadata(self, doc_id: str, packed: int, is_new: bool = False):
+        updated_at, is_frozen = unpack_metadata(packed)
+        metadata_content = {
+            MetadataOperationsImpl.UPDATED_AT_KEY: updated_at.strftime(DocumentId.UTC_FORMAT),
+            MetadataOperationsImpl.IS_FROZEN_KEY: is_frozen
+        }
+        metadata_content_str = json.dumps(metadata_content)
+
+        pathname = os.path.join(self._full_path_to_collection, 'metadata', doc_id)
+        if is_new:
+            file_access.create(pathname, metadata_content_str)
+        else:
+            file_access.update(pathname, metadata_content_str)
+
+        self._metadata[doc_id] = packed
+
+    def _write_document(self, doc_id: str, data: str, updated_at: datetime.datetime):
+        data_pathname = os.path.join(self._full_path_to_collection, 'data', doc_id)
+
+        file_access.create(data_pathname, data)
+        self._store_metadata(doc_id, pack_metadata(updated_at, False), is_new=True)
+
+    def _rewrite_document(self, doc_id: str, data: str, updated_at: datetime.datetime):
+        self._get_document_operator(doc_id).update(data)
+        self._write_updated_at(doc_id, updated_at)
+
+    def _read_data(self, doc_id: str) -> str:
+        return self._get_document_operator(doc_id).read()
+
+    def _read_updated_at(self, doc_id: str) -> datetime.datetime:
+        updated_at, _ = unpack_metadata(self._metadata_of(doc_id))
+        return updated_at
+
+    def _write_updated_at(self, doc_id: str, updated_at: datetime.datetime):
+        frozen_bit = self._metadata_of(doc_id) & METADATA_FROZEN_BIT
+        self._store_metadata(doc_id, (to_microseconds(updated_at) << 1) | frozen_bit)
+
+    def _read_is_frozen(self, doc_id: str) -> bool:
+        _, is_frozen = unpack_metadata(self._metadata_of(doc_id))
+        return is_frozen
+
+    def _write_is_frozen(self, doc_id: str, is_frozen: bool):
+        updated_at, _ = unpack_metadata(self._metadata_of(doc_id))
+        self._store_metadata(doc_id, pack_metadata(updated_at, is_frozen))
+
+    def _remove_document(self, doc_id: str):
+        data_pathname = os.path.join(self._full_path_to_collection, 'data', doc_id)
+        metadata_pathname = os.path.join(self._full_path_to_collection, 'metadata', doc_id)
+
+        file_access.delete(data_pathname)
+        file_access.delete(metadata_pathname)
+        self._metadata.pop(doc_id, None)
+
+    def _has_document(self, doc_id: str) -> bool:
+        path = os.path.join(self._full_path_to_collection, 'data', doc_id)
+        return os.path.isfile(path)
+
+    def _stored_doc_ids(self) -> list:
+        return os.listdir(os.path.join(self._full_path_to_collection, 'data'))
@@ -0,0 +1,79 @@
+import datetime
+import os
+
+from autumn_db.data_storage.collection.impl import CollectionOperationsImpl
+from autumn_db.data_storage.data_access.log_structured import LogStructuredAccess
+
+
+class LogStructuredCollectionOperations(CollectionOperationsImpl):
+    """Collection stored as the append-only segments under segments/ directory
+
+    Document and its metadata are written by one record, the metadata is kept by the in-memory index.
+    """
+    SEGMENTS_DIR = 'segments'
+    REQUIRED_DIRS = (SEGMENTS_DIR,)
+
+    def __init__(self, name: str, data_holder_path: str = None,
+                 cache_size: int = CollectionOperationsImpl.CACHE_SIZE):
+        self._store = None
+        super().__init__(name, data_holder_path, cache_size)
+
+    def _init_initial_doc_ids(self):
+        if os.path.isdir(self._segments_path):
+            self._store = LogStructuredAccess(self._segments_path)
+            self._open_manifest()
+
+    @property
+    def _segments_path(self) -> str:
+        return os.path.join(self._full_path_to_collection, LogStructuredCollectionOperations.SEGMENTS_DIR)
+
+    @property
+    def store(self) -> LogStructuredAccess:
+        return self._store
+
+    def create(self):
+        with self._lock:
+            os.makedirs(self._segments_path)
+            self._store = LogStructuredAccess(self._segments_path)
+
+        self._open_manifest()
+
+    def close(self):
+        super().close()
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def _write_document(self, doc_id: str, data: str, updated_at: datetime.datetime):
+        self._store.put(doc_id, data, updated_at, must_exist=False)
+
+    def _rewrite_document(self, doc_id: str, data: str, updated_at: datetime.datetime):
+        self._store.put(doc_id, data, updated_at, must_exist=True, is_frozen=self._store.is_frozen(doc_id))
+
+    def _restore_metadata(self, doc_id: str, packed: int):
+        # the metadata is kept by the index of the store
+        pass
+
+    def _read_data(self, doc_id: str) -> str:
+        return self._store.read(doc_id)
+
+    def _read_updated_at(self, doc_id: str) -> datetime.datetime:
+        return self._store.get_updated_at(doc_id)
+
+    def _write_updated_at(self, doc_id: str, updated_at: datetime.datetime):
+        self._store.set_updated_at(doc_id, updated_at)
+
+    def _read_is_frozen(self, doc_id: str) -> bool:
+        return self._store.is_frozen(doc_id)
+
+    def _write_is_frozen(self, doc_id: str, is_frozen: bool):
+        self._store.set_is_frozen(doc_id, is_frozen)
+
+    def _remove_document(self, doc_id: str):
+        self._store.delete(doc_id)
+
+    def _has_document(self, doc_id: str) -> bool:
+        return self._store.contains(doc_id)
+
+    def _stored_doc_ids(self) -> list:
+        return self._store.keys()
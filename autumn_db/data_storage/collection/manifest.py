@@ -0,0 +1,111 @@
+import logging
+import os
+import struct
+import threading
+
+MANIFEST_MAGIC = b'ADBMANI1'
+MANIFEST_DOC_ID_LENGTH = 64
+SNAPSHOT_LENGTH = 14
+
+# RECORD format
+# |Flags|Doc ID length|Doc ID |Metadata|Snapshot|
+#  1byte    1byte     64bytes  8bytes   14bytes
+# Doc ID is padded by zeros, Metadata is the packed updated at and frozen bit, Snapshot is SBF and PH2 hash
+RECORD = struct.Struct(f'!BB{MANIFEST_DOC_ID_LENGTH}sq{SNAPSHOT_LENGTH}s')
+RECORD_FLAG_LIVE = 0x01
+
+
+class SnapshotManifest:
+    """File of the fixed size records: one per document, it is loaded by one read instead of hashing documents
+
+    The record of the document is rewritten in place, the slots of the deleted documents are reused.
+    Documents with longer IDs than MANIFEST_DOC_ID_LENGTH are not kept, they are hashed at the start.
+    """
+    FILENAME = 'MANIFEST'
+
+    def __init__(self, pathname: str):
+        self._pathname = pathname
+        self._lock = threading.Lock()
+        self._slots = dict()
+        self._free_slots = list()
+        self._slots_count = 0
+        self._fd = None
+
+    def load(self) -> dict:
+        """Opens the manifest, returns doc ID -> (metadata, snapshot bytes)"""
+        res = dict()
+
+        with self._lock:
+            src = b''
+            if os.path.exists(self._pathname):
+                with open(self._pathname, 'rb') as f:
+                    src = f.read()
+
+            if src[:len(MANIFEST_MAGIC)] != MANIFEST_MAGIC:
+                if len(src) > 0:
+                    logging.warning(f"Manifest {self._pathname} has unknown format, it is rebuilt")
+                src = MANIFEST_MAGIC
+                with open(self._pathname, 'wb') as f:
+                    f.write(src)
+
+            self._fd = os.open(self._pathname, os.O_RDWR)
+
+            body = memoryview(src)[len(MANIFEST_MAGIC):]
+            self._slots_count = len(body) // RECORD.size
+            for slot in range(self._slots_count):
+                flags, doc_id_length, doc_id, metadata, snapshot = RECORD.unpack_from(body, slot * RECORD.size)
+                if not flags & RECORD_FLAG_LIVE:
+                    self._free_slots.append(slot)
+                    continue
+
+                doc_id = doc_id[:doc_id_length].decode('utf-8')
+                self._slots[doc_id] = slot
+                res[doc_id] = (metadata, snapshot)
+
+        return res
+
+    def put(self, doc_id: str, metadata: int, snapshot: bytes):
+        b_doc_id = doc_id.encode('utf-8')
+        if len(b_doc_id) > MANIFEST_DOC_ID_LENGTH:
+            return
+
+        record = RECORD.pack(RECORD_FLAG_LIVE, len(b_doc_id), b_doc_id, metadata, snapshot)
+
+        with self._lock:
+            slot = self._slots.get(doc_id)
+            if slot is None:
+                slot = self._allocate()
+                self._slots[doc_id] = slot
+
+            os.pwrite(self._fd, record, self._offset_of(slot))
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            slot = self._slots.pop(doc_id, None)
+            if slot is None:
+                return
+
+            # only the flags are cleared, the slot is reused by the next document
+            os.pwrite(self._fd, bytes(1), self._offset_of(slot))
+            self._free_slots.append(slot)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _allocate(self) -> int:
+        if len(self._free_slots) > 0:
+            return self._free_slots.pop()
+
+        slot = self._slots_count
+        self._slots_count += 1
+        return slot
+
+    @staticmethod
+    def _offset_of(slot: int) -> int:
+        return len(MANIFEST_MAGIC) + slot * RECORD.size
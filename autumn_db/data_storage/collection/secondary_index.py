@@ -0,0 +1,498 @@
+import hashlib
+import json
+import logging
+import numbers
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+
+from autumn_db.data_storage.predicate import MISSING, value_at
+
+HASH_INDEX = 'hash'
+ORDERED_INDEX = 'ordered'
+
+# the log is rewritten when it has COMPACTION_RATIO times more entries than the documents
+COMPACTION_RATIO = 2
+MIN_COMPACTION_ENTRIES = 4096
+# entries of the bulk load per write of the log
+BULK_WRITE_ENTRIES = 4096
+
+
+class SecondaryIndex:
+    """Values of one JSON path of the documents, the base of the hash and the ordered index
+
+    Every change is appended to the log file as the JSON line [doc ID, value], or [doc ID] if the document
+    has no indexed value of the path. The log is replayed at the opening. When it grows too long it is rewritten
+    by the live entries in background, the entries appended meanwhile are moved to the new log.
+    Is not thread-safe, the collection calls it under its lock.
+    """
+    KIND = None
+
+    def __init__(self, path: str, pathname: str):
+        self._path = path
+        self._pathname = pathname
+        # doc ID -> key, None if the document has no indexed value
+        self._keys = dict()
+        self._log_entries = 0
+        self._log_size = 0
+        self._fd = None
+        # the appends and the swap of the compacted log
+        self._log_lock = threading.Lock()
+        self._compaction = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def kind(self) -> str:
+        return self.KIND
+
+    @property
+    def pathname(self) -> str:
+        return self._pathname
+
+    @staticmethod
+    def filename(kind: str, path: str) -> str:
+        return f"{kind}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]}.log"
+
+    def open(self):
+        if os.path.exists(self._pathname):
+            with open(self._pathname, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the line is torn by the crash, the document is indexed again at the opening
+                        logging.warning(f"Index {self._pathname} has broken entry, it is skipped")
+                        continue
+
+                    self._keys[entry[0]] = self._key(entry[1]) if len(entry) > 1 else None
+                    self._log_entries += 1
+
+        # the entries are sorted once instead of inserting them one by one
+        self._rebuild()
+        self._fd = os.open(self._pathname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._log_size = os.fstat(self._fd).st_size
+
+    def close(self):
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+        with self._log_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def put(self, doc_id: str, doc):
+        key = self._key(value_at(doc, self._path))
+        if doc_id in self._keys and self._keys[doc_id] == key:
+            return
+
+        self._set(doc_id, key)
+        self._append(doc_id, key)
+
+    def put_all(self, docs):
+        """Bulk form of put for the iterable of (doc ID, doc), the index is rebuilt once"""
+        entries = list()
+        for doc_id, doc in docs:
+            key = self._key(value_at(doc, self._path))
+            self._keys[doc_id] = key
+            entries.append(SecondaryIndex._entry(doc_id, key))
+
+            if len(entries) == BULK_WRITE_ENTRIES:
+                self._write_entries(entries)
+                entries = list()
+
+        self._write_entries(entries)
+        self._rebuild()
+        self._compact()
+
+    def remove(self, doc_id: str):
+        if doc_id not in self._keys:
+            return
+
+        key = self._keys.pop(doc_id)
+        if key is not None:
+            self._remove_entry(doc_id, key)
+        self._append(doc_id, None)
+
+    def retain(self, doc_ids: set):
+        """Drops the entries of the documents removed while the log was not written"""
+        for doc_id in [doc_id for doc_id in self._keys if doc_id not in doc_ids]:
+            key = self._keys.pop(doc_id)
+            if key is not None:
+                self._remove_entry(doc_id, key)
+
+        self._compact()
+
+    def estimate(self, predicate):
+        """Count of the IDs which lookup returns, None if the index does not serve the predicate"""
+        return None
+
+    def lookup(self, predicate):
+        """IDs of the documents which may match the predicate, None if the index does not serve it"""
+        return None
+
+    def __contains__(self, doc_id: str):
+        return doc_id in self._keys
+
+    def _set(self, doc_id: str, key):
+        old = self._keys.get(doc_id)
+        if old is not None:
+            self._remove_entry(doc_id, old)
+
+        self._keys[doc_id] = key
+        if key is not None:
+            self._add_entry(doc_id, key)
+
+    @staticmethod
+    def _entry(doc_id: str, key) -> str:
+        return json.dumps([doc_id, key[1]] if key is not None else [doc_id]) + '\n'
+
+    def _append(self, doc_id: str, key):
+        self._write_entries([SecondaryIndex._entry(doc_id, key)])
+        self._compact()
+
+    def _write_entries(self, entries: list):
+        if len(entries) == 0:
+            return
+
+        data = ''.join(entries).encode('utf-8')
+        with self._log_lock:
+            os.write(self._fd, data)
+            self._log_entries += len(entries)
+            self._log_size += len(data)
+
+    def _compact(self):
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+
+        if self._log_entries <= max(MIN_COMPACTION_ENTRIES, COMPACTION_RATIO * len(self._keys)):
+            return
+
+        with self._log_lock:
+            offset = self._log_size
+
+        # nothing is copied under the collection lock, the thread rewrites the log from the file itself
+        self._compaction = threading.Thread(target=self._rewrite, args=(offset,), daemon=True)
+        self._compaction.start()
+
+    def _rewrite(self, offset: int):
+        tmp_pathname = self._pathname + '.tmp'
+        try:
+            # the last entry of the document wins
+            live = dict()
+            with open(self._pathname, 'rb') as f:
+                while f.tell() < offset:
+                    line = f.readline()
+                    if len(line) == 0:
+                        break
+
+                    try:
+                        live[json.loads(line)[0]] = line
+                    except (ValueError, IndexError):
+                        continue
+
+            # the documents removed since then have the entries after the offset, the rest are dropped here
+            entries = 0
+            with open(tmp_pathname, 'wb') as f:
+                for doc_id, line in live.items():
+                    if doc_id in self._keys:
+                        f.write(line)
+                        entries += 1
+
+            with self._log_lock:
+                # the entries appended since the offset follow the live ones
+                with open(self._pathname, 'rb') as f:
+                    f.seek(offset)
+                    tail = f.read()
+                with open(tmp_pathname, 'ab') as f:
+                    f.write(tail)
+
+                os.replace(tmp_pathname, self._pathname)
+                os.close(self._fd)
+                self._fd = os.open(self._pathname, os.O_WRONLY | os.O_APPEND)
+                self._log_entries = entries + tail.count(b'\n')
+                self._log_size = os.fstat(self._fd).st_size
+        except OSError as e:
+            logging.warning(f"Could not compact index {self._pathname}: {e}")
+
+    def _key(self, value): ...
+
+    def _rebuild(self): ...
+
+    def _add_entry(self, doc_id: str, key): ...
+
+    def _remove_entry(self, doc_id: str, key): ...
+
+
+class HashIndex(SecondaryIndex):
+    """Doc IDs by the value, serves the equality"""
+    KIND = HASH_INDEX
+
+    def __init__(self, path: str, pathname: str):
+        super().__init__(path, pathname)
+        self._buckets = dict()
+
+    def estimate(self, predicate):
+        key = self._eq_key(predicate)
+        if key is None:
+            return None
+
+        return len(self._buckets.get(key, ()))
+
+    def lookup(self, predicate):
+        key = self._eq_key(predicate)
+        if key is None:
+            return None
+
+        return list(self._buckets.get(key, ()))
+
+    def _eq_key(self, predicate):
+        if predicate.eq is MISSING:
+            return None
+
+        return self._key(predicate.eq)
+
+    def _key(self, value):
+        # the type is the part of the key: JSON true is not 1, the lists and the objects are not indexed
+        if isinstance(value, bool):
+            return 'b', value
+        if isinstance(value, numbers.Real):
+            return 'n', value
+        if isinstance(value, str):
+            return 's', value
+        if value is None:
+            return 'z', None
+
+        return None
+
+    def _rebuild(self):
+        self._buckets = dict()
+        for doc_id, key in self._keys.items():
+            if key is not None:
+                self._add_entry(doc_id, key)
+
+    def _add_entry(self, doc_id: str, key):
+        self._buckets.setdefault(key, set()).add(doc_id)
+
+    def _remove_entry(self, doc_id: str, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return
+
+        bucket.discard(doc_id)
+        if len(bucket) == 0:
+            del self._buckets[key]
+
+
+class OrderedIndex(SecondaryIndex):
+    """Sorted (value, doc ID) pairs, serves the ranges and the equality
+
+    Numbers and strings are not comparable, so they are kept by two sorted arrays.
+    """
+    KIND = ORDERED_INDEX
+
+    def __init__(self, path: str, pathname: str):
+        super().__init__(path, pathname)
+        self._entries = {'n': list(), 's': list()}
+
+    def estimate(self, predicate):
+        found = self._range(predicate)
+        if found is None:
+            return None
+
+        _, lo, hi = found
+        return max(hi - lo, 0)
+
+    def lookup(self, predicate):
+        found = self._range(predicate)
+        if found is None:
+            return None
+
+        entries, lo, hi = found
+        return [doc_id for _, doc_id in entries[lo:hi]]
+
+    def _range(self, predicate):
+        """(sorted entries, lo, hi) of the predicate, None if it is not served"""
+        bounds = dict(predicate.bounds)
+        if predicate.eq is not MISSING:
+            bounds.update(gte=predicate.eq, lte=predicate.eq)
+
+        if len(bounds) == 0:
+            return None
+
+        keys = [self._key(bound) for bound in bounds.values()]
+        if any(key is None for key in keys):
+            return None
+
+        # the number is never in the range of the strings
+        if len(set(key[0] for key in keys)) > 1:
+            return list(), 0, 0
+
+        entries = self._entries[keys[0][0]]
+        lo, hi = 0, len(entries)
+        for oper, bound in bounds.items():
+            if oper == 'gt':
+                lo = max(lo, bisect_right(entries, bound, key=itemgetter(0)))
+            elif oper == 'gte':
+                lo = max(lo, bisect_left(entries, bound, key=itemgetter(0)))
+            elif oper == 'lt':
+                hi = min(hi, bisect_left(entries, bound, key=itemgetter(0)))
+            elif oper == 'lte':
+                hi = min(hi, bisect_right(entries, bound, key=itemgetter(0)))
+
+        return entries, lo, hi
+
+    def _key(self, value):
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, numbers.Real):
+            return 'n', value
+        if isinstance(value, str):
+            return 's', value
+
+        return None
+
+    def _rebuild(self):
+        self._entries = {'n': list(), 's': list()}
+        for doc_id, key in self._keys.items():
+            if key is not None:
+                self._entries[key[0]].append((key[1], doc_id))
+
+        for entries in self._entries.values():
+            entries.sort()
+
+    def _add_entry(self, doc_id: str, key):
+        insort(self._entries[key[0]], (key[1], doc_id))
+
+    def _remove_entry(self, doc_id: str, key):
+        entries = self._entries[key[0]]
+        i = bisect_left(entries, (key[1], doc_id))
+        if i != len(entries) and entries[i] == (key[1], doc_id):
+            del entries[i]
+
+
+INDEX_CLASSES = {HASH_INDEX: HashIndex, ORDERED_INDEX: OrderedIndex}
+
+
+class SecondaryIndexes:
+    """Declared indexes of the collection, they are kept under its indexes/ directory
+
+    The declarations are the JSON file of [kind, path] pairs, each index has its own log.
+    Is not thread-safe, the collection calls it under its lock.
+    """
+    DIRNAME = 'indexes'
+    FILENAME = 'INDEXES'
+
+    def __init__(self, dirname: str):
+        self._dirname = dirname
+        self._indexes = list()
+
+    def open(self):
+        pathname = os.path.join(self._dirname, SecondaryIndexes.FILENAME)
+        if not os.path.exists(pathname):
+            return
+
+        with open(pathname, 'r', encoding='utf-8') as f:
+            declarations = json.load(f)
+
+        for kind, path in declarations:
+            index = self._new_index(kind, path)
+            index.open()
+            self._indexes.append(index)
+
+    def close(self):
+        for index in self._indexes:
+            index.close()
+
+    def create(self, path: str, kind: str):
+        """Declares the index and returns it, None if it is declared already"""
+        if kind not in INDEX_CLASSES:
+            raise Exception(f"Index kind should be one of {sorted(INDEX_CLASSES)}")
+
+        if self._find(path, kind) is not None:
+            return None
+
+        os.makedirs(self._dirname, exist_ok=True)
+        index = self._new_index(kind, path)
+        # the log of the previously dropped index is not valid anymore
+        if os.path.exists(index.pathname):
+            os.remove(index.pathname)
+        index.open()
+
+        self._indexes.append(index)
+        self._write_declarations()
+
+        return index
+
+    def drop(self, path: str, kind: str):
+        index = self._find(path, kind)
+        if index is None:
+            return
+
+        self._indexes.remove(index)
+        self._write_declarations()
+        index.close()
+        os.remove(index.pathname)
+
+    def declarations(self) -> list:
+        return [(index.path, index.kind) for index in self._indexes]
+
+    def put_document(self, doc_id: str, doc):
+        for index in self._indexes:
+            index.put(doc_id, doc)
+
+    def remove_document(self, doc_id: str):
+        for index in self._indexes:
+            index.remove(doc_id)
+
+    def lookup(self, predicates: list):
+        """Candidates of the most selective index, None if no predicate is served by the indexes
+
+        The index is chosen by the bucket size or the range width, only its candidates are listed.
+        """
+        best, best_predicate, best_count = None, None, None
+        for predicate in predicates:
+            for index in self._indexes:
+                if index.path != predicate.path:
+                    continue
+
+                count = index.estimate(predicate)
+                if count is not None and (best_count is None or count < best_count):
+                    best, best_predicate, best_count = index, predicate, count
+
+        if best is None:
+            return None
+
+        return best.lookup(best_predicate)
+
+    def retain(self, doc_ids: set):
+        for index in self._indexes:
+            index.retain(doc_ids)
+
+    def __iter__(self):
+        return iter(self._indexes)
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def _find(self, path: str, kind: str):
+        for index in self._indexes:
+            if index.path == path and index.kind == kind:
+                return index
+
+        return None
+
+    def _new_index(self, kind: str, path: str) -> SecondaryIndex:
+        return INDEX_CLASSES[kind](path, os.path.join(self._dirname, SecondaryIndex.filename(kind, path)))
+
+    def _write_declarations(self):
+        pathname = os.path.join(self._dirname, SecondaryIndexes.FILENAME)
+        with open(pathname + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump([[index.kind, index.path] for index in self._indexes], f)
+
+        os.replace(pathname + '.tmp', pathname)
@@ -0,0 +1,56 @@
+from autumn_db.data_storage.collection.manifest import SNAPSHOT_LENGTH
+
+
+class SnapshotTable:
+    """Snapshots of the documents as one bytearray of the fixed size records and the doc ID -> slot index
+
+    The snapshot of the document is the slice of its record, the slots of the removed documents are reused.
+    Is not thread-safe, the collection calls it under its lock.
+    """
+
+    def __init__(self):
+        self._records = bytearray()
+        self._slots = dict()
+        self._free_slots = list()
+
+    def put(self, doc_id: str, snapshot: bytes):
+        if len(snapshot) != SNAPSHOT_LENGTH:
+            raise Exception(f"Snapshot has {len(snapshot)} bytes instead of {SNAPSHOT_LENGTH}")
+
+        slot = self._slots.get(doc_id)
+        if slot is None:
+            slot = self._allocate()
+            self._slots[doc_id] = slot
+
+        offset = slot * SNAPSHOT_LENGTH
+        self._records[offset:offset + SNAPSHOT_LENGTH] = snapshot
+
+    def get(self, doc_id: str):
+        """Returns the snapshot bytes or None"""
+        slot = self._slots.get(doc_id)
+        if slot is None:
+            return None
+
+        offset = slot * SNAPSHOT_LENGTH
+        return bytes(self._records[offset:offset + SNAPSHOT_LENGTH])
+
+    def remove(self, doc_id: str):
+        slot = self._slots.pop(doc_id, None)
+        if slot is not None:
+            self._free_slots.append(slot)
+
+    def doc_ids(self):
+        return self._slots.keys()
+
+    def __contains__(self, doc_id: str):
+        return doc_id in self._slots
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _allocate(self) -> int:
+        if len(self._free_slots) > 0:
+            return self._free_slots.pop()
+
+        self._records.extend(bytes(SNAPSHOT_LENGTH))
+        return len(self._records) // SNAPSHOT_LENGTH - 1
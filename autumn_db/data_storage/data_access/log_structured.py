@@ -0,0 +1,439 @@
+import datetime
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from autumn_db.data_storage import to_microseconds, from_microseconds
+from autumn_db.data_storage.data_access import DataAccess
+
+
+# RECORD format
+# | CRC32 |Flags|Updated at|Key length|Value length| Key  | Value |
+#  4bytes 1byte   8bytes      2bytes      4bytes    Xbytes  Ybytes
+# CRC32 covers everything after itself
+RECORD_CRC = struct.Struct('!I')
+RECORD_HEADER = struct.Struct('!BqHI')
+RECORD_HEADER_LENGTH = RECORD_CRC.size + RECORD_HEADER.size
+
+RECORD_FLAG_DELETED = 0x01
+RECORD_FLAG_FROZEN = 0x02
+
+
+def encode_record(key: bytes, value: bytes, updated_at: int, flags: int = 0) -> bytes:
+    body = bytearray(RECORD_HEADER.pack(flags, updated_at, len(key), len(value)))
+    body.extend(key)
+    body.extend(value)
+
+    res = bytearray(RECORD_CRC.pack(zlib.crc32(body)))
+    res.extend(body)
+
+    return bytes(res)
+
+
+def decode_record(src, offset: int = 0):
+    """Returns (flags, updated_at, key, value, record length) or None if the record is truncated or corrupted"""
+    if len(src) - offset < RECORD_HEADER_LENGTH:
+        return None
+
+    crc, = RECORD_CRC.unpack_from(src, offset)
+    flags, updated_at, key_length, value_length = RECORD_HEADER.unpack_from(src, offset + RECORD_CRC.size)
+
+    length = RECORD_HEADER_LENGTH + key_length + value_length
+    if len(src) - offset < length:
+        return None
+
+    body = src[offset + RECORD_CRC.size:offset + length]
+    if zlib.crc32(body) != crc:
+        return None
+
+    key_start = offset + RECORD_HEADER_LENGTH
+    key = bytes(src[key_start:key_start + key_length])
+    value = bytes(src[key_start + key_length:offset + length])
+
+    return flags, updated_at, key, value, length
+
+
+class LogStructuredAccess(DataAccess):
+    """Bitcask-like storage: records are appended to the segment files, in-memory index points to the latest ones
+
+    The index maps the key to (segment ID, offset, record length, updated at, flags), so a read takes one pread.
+    The order of the segments is kept by the SEGMENTS file; the compaction rewrites live records of the immutable
+    segments into the new ones and replaces them in the SEGMENTS file atomically.
+    """
+    SEGMENTS_FILENAME = 'SEGMENTS'
+    SEGMENT_EXTENSION = '.log'
+    SEGMENT_MAX_SIZE = 64 * 1024 * 1024
+    COMPACTION_INTERVAL = 30.0
+    COMPACTION_MIN_DEAD_RATIO = 0.5
+    COMPACTION_MIN_DEAD_BYTES = 1024 * 1024
+
+    def __init__(self, path: str, segment_max_size: int = SEGMENT_MAX_SIZE,
+                 compaction_interval: float = COMPACTION_INTERVAL):
+        self._path = path
+        self._segment_max_size = segment_max_size
+
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+
+        self._index = dict()
+        self._segments = list()
+        self._segment_sizes = dict()
+        self._dead_bytes = dict()
+        self._read_fds = dict()
+
+        self._active_id = None
+        self._active_fd = None
+        self._next_id = 0
+
+        os.makedirs(self._path, exist_ok=True)
+        self._load()
+
+        self._is_closed = threading.Event()
+        self._compactor = None
+        if compaction_interval is not None:
+            self._compactor = threading.Thread(target=self._compaction_processing, args=(compaction_interval,),
+                                               daemon=True)
+            self._compactor.start()
+
+    def create(self, pathname: str, data: str):
+        self.put(pathname, data, datetime.datetime.utcnow(), must_exist=False)
+
+    def read(self, pathname: str) -> str:
+        data, _ = self.get(pathname)
+        return data
+
+    def update(self, pathname: str, data: str):
+        self.put(pathname, data, datetime.datetime.utcnow(), must_exist=True)
+
+    def delete(self, pathname: str):
+        key = pathname.encode('utf-8')
+
+        with self._lock:
+            if key not in self._index:
+                raise RuntimeError(f"Could not delete {pathname}. Record does not exist")
+
+            self._append(key, b'', 0, RECORD_FLAG_DELETED)
+
+    def put(self, key: str, data: str, updated_at: datetime.datetime, must_exist: bool = None,
+            is_frozen: bool = False):
+        # must_exist is True for update, False for create and None for upsert
+        _key = key.encode('utf-8')
+        value = data.encode('utf-8')
+        flags = RECORD_FLAG_FROZEN if is_frozen else 0
+
+        with self._lock:
+            exists = _key in self._index
+            if must_exist is True and not exists:
+                raise RuntimeError(f"Could not update {key}. Record does not exist")
+
+            if must_exist is False and exists:
+                raise RuntimeError(f"Record {key} already exists")
+
+            self._append(_key, value, to_microseconds(updated_at), flags)
+
+    def get(self, key: str) -> tuple:
+        _key = key.encode('utf-8')
+
+        with self._lock:
+            entry = self._index.get(_key)
+            if entry is None:
+                raise RuntimeError(f"Could not read {key}. Record does not exist")
+
+            segment_id, offset, length, updated_at, flags = entry
+            src = os.pread(self._read_fd(segment_id), length, offset)
+
+        record = decode_record(src)
+        if record is None:
+            raise RuntimeError(f"Record {key} is corrupted in segment {segment_id} at {offset}")
+
+        _, _, _, value, _ = record
+        return value.decode('utf-8'), from_microseconds(updated_at)
+
+    def get_updated_at(self, key: str) -> datetime.datetime:
+        with self._lock:
+            entry = self._index.get(key.encode('utf-8'))
+
+        if entry is None:
+            raise RuntimeError(f"Could not read {key}. Record does not exist")
+
+        return from_microseconds(entry[3])
+
+    def set_updated_at(self, key: str, updated_at: datetime.datetime):
+        data, _ = self.get(key)
+        self.put(key, data, updated_at, must_exist=True, is_frozen=self.is_frozen(key))
+
+    def is_frozen(self, key: str) -> bool:
+        with self._lock:
+            entry = self._index.get(key.encode('utf-8'))
+
+        if entry is None:
+            raise RuntimeError(f"Could not read {key}. Record does not exist")
+
+        return bool(entry[4] & RECORD_FLAG_FROZEN)
+
+    def set_is_frozen(self, key: str, is_frozen: bool):
+        data, updated_at = self.get(key)
+        self.put(key, data, updated_at, must_exist=True, is_frozen=is_frozen)
+
+    def contains(self, key: str) -> bool:
+        return key.encode('utf-8') in self._index
+
+    def keys(self) -> list:
+        with self._lock:
+            keys = list(self._index.keys())
+
+        return [key.decode('utf-8') for key in keys]
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        self._is_closed.set()
+        if self._compactor is not None and self._compactor is not threading.current_thread():
+            self._compactor.join()
+
+        with self._lock:
+            os.close(self._active_fd)
+            for fd in self._read_fds.values():
+                os.close(fd)
+            self._read_fds = dict()
+
+    def compact(self):
+        with self._compaction_lock:
+            with self._lock:
+                if self._active_size > 0:
+                    self._rotate()
+
+                immutable = [segment_id for segment_id in self._segments if segment_id != self._active_id]
+                if len(immutable) == 0:
+                    return
+
+                immutable_set = set(immutable)
+                live = [(key, entry) for key, entry in self._index.items() if entry[0] in immutable_set]
+
+            live.sort(key=lambda item: (item[1][0], item[1][1]))
+            outputs, moved = self._write_compacted(live)
+
+            with self._lock:
+                for key, old_entry, new_entry in moved:
+                    if self._index.get(key) == old_entry:
+                        self._index[key] = new_entry
+                    else:
+                        self._dead_bytes[new_entry[0]] += new_entry[2]
+
+                self._segments = outputs + [segment_id for segment_id in self._segments if segment_id not in immutable_set]
+                self._write_segments_list()
+
+                for segment_id in immutable:
+                    fd = self._read_fds.pop(segment_id, None)
+                    if fd is not None:
+                        os.close(fd)
+
+                    os.remove(self._segment_path(segment_id))
+                    del self._segment_sizes[segment_id]
+                    del self._dead_bytes[segment_id]
+
+    def should_compact(self) -> bool:
+        with self._lock:
+            immutable = [segment_id for segment_id in self._segments if segment_id != self._active_id]
+            total = sum(self._segment_sizes[segment_id] for segment_id in immutable)
+            dead = sum(self._dead_bytes[segment_id] for segment_id in immutable)
+
+        if dead < LogStructuredAccess.COMPACTION_MIN_DEAD_BYTES:
+            return False
+
+        return dead / total >= LogStructuredAccess.COMPACTION_MIN_DEAD_RATIO
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'records': len(self._index),
+                'segments': len(self._segments),
+                'total_bytes': sum(self._segment_sizes.values()),
+                'dead_bytes': sum(self._dead_bytes.values()),
+            }
+
+    def _compaction_processing(self, interval: float):
+        while not self._is_closed.wait(interval):
+            try:
+                if self.should_compact():
+                    self.compact()
+            except Exception as e:
+                logging.warning(f"Compaction of {self._path} failed: {e}")
+
+    def _write_compacted(self, live: list) -> tuple:
+        outputs = list()
+        moved = list()
+
+        fd = None
+        segment_id = None
+        size = 0
+        try:
+            for key, entry in live:
+                old_segment_id, offset, length, updated_at, flags = entry
+                with self._lock:
+                    src = os.pread(self._read_fd(old_segment_id), length, offset)
+
+                if fd is None or size + length > self._segment_max_size:
+                    if fd is not None:
+                        self._finish_compacted(fd, segment_id, size)
+
+                    with self._lock:
+                        segment_id = self._allocate_id()
+                    fd = os.open(self._segment_path(segment_id), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                    outputs.append(segment_id)
+                    size = 0
+
+                self._write_all(fd, src)
+                moved.append((key, entry, (segment_id, size, length, updated_at, flags)))
+                size += length
+
+            if fd is not None:
+                self._finish_compacted(fd, segment_id, size)
+                fd = None
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+        return outputs, moved
+
+    def _finish_compacted(self, fd: int, segment_id: int, size: int):
+        os.fsync(fd)
+        os.close(fd)
+
+        with self._lock:
+            self._segment_sizes[segment_id] = size
+            self._dead_bytes[segment_id] = 0
+
+    def _append(self, key: bytes, value: bytes, updated_at: int, flags: int):
+        record = encode_record(key, value, updated_at, flags)
+        if self._active_size > 0 and self._active_size + len(record) > self._segment_max_size:
+            self._rotate()
+
+        self._write_all(self._active_fd, record)
+
+        offset = self._active_size
+        self._active_size += len(record)
+        self._segment_sizes[self._active_id] += len(record)
+
+        self._on_record(key, (self._active_id, offset, len(record), updated_at, flags))
+
+    def _on_record(self, key: bytes, entry: tuple):
+        segment_id, _, length, _, flags = entry
+
+        previous = self._index.get(key)
+        if previous is not None:
+            self._dead_bytes[previous[0]] += previous[2]
+
+        if flags & RECORD_FLAG_DELETED:
+            self._index.pop(key, None)
+            self._dead_bytes[segment_id] += length
+            return
+
+        self._index[key] = entry
+
+    @staticmethod
+    def _write_all(fd: int, src: bytes):
+        view = memoryview(src)
+        while len(view) > 0:
+            written = os.write(fd, view)
+            view = view[written:]
+
+    def _read_fd(self, segment_id: int) -> int:
+        fd = self._read_fds.get(segment_id)
+        if fd is None:
+            fd = os.open(self._segment_path(segment_id), os.O_RDONLY)
+            self._read_fds[segment_id] = fd
+
+        return fd
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self._path, f"{segment_id:08d}{LogStructuredAccess.SEGMENT_EXTENSION}")
+
+    def _allocate_id(self) -> int:
+        res = self._next_id
+        self._next_id += 1
+
+        return res
+
+    def _rotate(self):
+        if self._active_fd is not None:
+            os.close(self._active_fd)
+
+        self._open_active(self._allocate_id(), 0)
+        self._segments.append(self._active_id)
+        self._write_segments_list()
+
+    def _open_active(self, segment_id: int, size: int):
+        self._active_id = segment_id
+        self._active_fd = os.open(self._segment_path(segment_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._active_size = size
+        self._segment_sizes.setdefault(segment_id, size)
+        self._dead_bytes.setdefault(segment_id, 0)
+
+    def _write_segments_list(self):
+        pathname = os.path.join(self._path, LogStructuredAccess.SEGMENTS_FILENAME)
+        tmp_pathname = pathname + '.tmp'
+
+        with open(tmp_pathname, 'w') as f:
+            f.write('\n'.join(str(segment_id) for segment_id in self._segments))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_pathname, pathname)
+
+    def _read_segments_list(self) -> list:
+        pathname = os.path.join(self._path, LogStructuredAccess.SEGMENTS_FILENAME)
+        if not os.path.exists(pathname):
+            return list()
+
+        with open(pathname, 'r') as f:
+            content = f.read()
+
+        return [int(line) for line in content.split('\n') if line.strip()]
+
+    def _load(self):
+        self._segments = self._read_segments_list()
+
+        # segments which are not listed are the leftovers of interrupted compaction
+        listed = set(self._segment_path(segment_id) for segment_id in self._segments)
+        for entry in os.scandir(self._path):
+            if entry.name.endswith(LogStructuredAccess.SEGMENT_EXTENSION) and entry.path not in listed:
+                os.remove(entry.path)
+
+        self._next_id = max(self._segments, default=-1) + 1
+        for i, segment_id in enumerate(self._segments):
+            self._load_segment(segment_id, is_last=i == len(self._segments) - 1)
+
+        if len(self._segments) > 0 and self._segment_sizes[self._segments[-1]] < self._segment_max_size:
+            last = self._segments[-1]
+            self._open_active(last, self._segment_sizes[last])
+        else:
+            self._rotate()
+
+    def _load_segment(self, segment_id: int, is_last: bool):
+        pathname = self._segment_path(segment_id)
+        with open(pathname, 'rb') as f:
+            src = f.read()
+
+        self._segment_sizes[segment_id] = 0
+        self._dead_bytes[segment_id] = 0
+
+        view = memoryview(src)
+        offset = 0
+        while offset < len(src):
+            record = decode_record(view, offset)
+            if record is None:
+                break
+
+            flags, updated_at, key, _, length = record
+            self._on_record(key, (segment_id, offset, length, updated_at, flags))
+            offset += length
+
+        self._segment_sizes[segment_id] = offset
+        if offset < len(src):
+            logging.warning(f"Segment {pathname} is truncated at {offset} of {len(src)} bytes")
+            if is_last:
+                os.truncate(pathname, offset)
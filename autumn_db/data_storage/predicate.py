@@ -0,0 +1,119 @@
+import numbers
+
+# the value of the absent path, None is the JSON null
+MISSING = object()
+
+RANGE_OPERATORS = ('gt', 'gte', 'lt', 'lte')
+
+
+def value_at(doc, path: str):
+    """Value of the dot separated path, the digits are the indexes of the lists, MISSING if there is no such path"""
+    value = doc
+    for key in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(key, MISSING)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return MISSING
+
+        if value is MISSING:
+            return MISSING
+
+    return value
+
+
+def comparable(left, right) -> bool:
+    # numbers are compared with numbers and strings with strings, booleans are not numbers here
+    if isinstance(left, bool) or isinstance(right, bool):
+        return False
+
+    if isinstance(left, numbers.Real) and isinstance(right, numbers.Real):
+        return True
+
+    return isinstance(left, str) and isinstance(right, str)
+
+
+class Predicate:
+    """Condition on one JSON path, it is parsed from the dict like
+
+    {"path": "age", "gte": 18, "lt": 65}, {"path": "name", "eq": "Valerii"} or {"path": "email", "exists": true}
+    All the conditions of the dict must hold.
+    """
+
+    def __init__(self, path: str, eq=MISSING, exists: bool = None, bounds: dict = None):
+        self._path = path
+        self._eq = eq
+        self._exists = exists
+        self._bounds = bounds if bounds is not None else dict()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def eq(self):
+        return self._eq
+
+    @property
+    def bounds(self) -> dict:
+        return self._bounds
+
+    @staticmethod
+    def parse(src: dict):
+        if not isinstance(src, dict) or not isinstance(src.get('path'), str):
+            raise Exception(f"Predicate {src} has no path")
+
+        unknown = set(src.keys()).difference(('path', 'eq', 'exists') + RANGE_OPERATORS)
+        if len(unknown) > 0:
+            raise Exception(f"Predicate {src} has unknown operators {sorted(unknown)}")
+
+        bounds = {oper: src[oper] for oper in RANGE_OPERATORS if oper in src}
+        return Predicate(src['path'], src.get('eq', MISSING), src.get('exists'), bounds)
+
+    @staticmethod
+    def parse_all(src: list) -> list:
+        if not isinstance(src, list):
+            raise Exception('Filter must be the list of the predicates')
+
+        return [Predicate.parse(entry) for entry in src]
+
+    def matches(self, doc) -> bool:
+        value = value_at(doc, self._path)
+
+        if self._exists is not None and (value is not MISSING) != self._exists:
+            return False
+
+        if self._eq is not MISSING and (value is MISSING or not Predicate._equal(value, self._eq)):
+            return False
+
+        for oper, bound in self._bounds.items():
+            if value is MISSING or not comparable(value, bound):
+                return False
+
+            if oper == 'gt' and not value > bound:
+                return False
+            if oper == 'gte' and not value >= bound:
+                return False
+            if oper == 'lt' and not value < bound:
+                return False
+            if oper == 'lte' and not value <= bound:
+                return False
+
+        return True
+
+    @staticmethod
+    def _equal(left, right) -> bool:
+        # JSON true is not 1
+        if isinstance(left, bool) != isinstance(right, bool):
+            return False
+
+        return left == right
+
+
+def matches_all(predicates: list, doc) -> bool:
+    for predicate in predicates:
+        if not predicate.matches(doc):
+            return False
+
+    return True
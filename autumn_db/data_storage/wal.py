@@ -0,0 +1,355 @@
+import contextlib
+import datetime
+import logging
+import os
+import struct
+import threading
+import zlib
+from concurrent import futures
+from enum import Enum
+
+from autumn_db.data_storage import to_microseconds, from_microseconds
+
+
+class FsyncPolicy(Enum):
+    ALWAYS = 'always'
+    INTERVAL = 'interval'
+    NEVER = 'never'
+
+
+class WALRecordType(Enum):
+    CREATE = 1
+    UPDATE = 2
+    DELETE = 3
+    # cancels the preceding record of the same collection, document and updated at, the write was not applied
+    ABORT = 4
+
+
+# RECORD format
+# | CRC32 |Length|Type|Updated at|Collection name length|Doc ID length|Collection name|Doc ID| Data |
+#  4bytes 4bytes 1byte  8bytes          1byte               1byte         Xbytes     Ybytes Zbytes
+# Length is the length of everything after itself, CRC32 covers the same bytes
+RECORD_PREFIX = struct.Struct('!II')
+RECORD_HEADER = struct.Struct('!BqBB')
+
+
+class WALRecord:
+
+    def __init__(self, record_type: WALRecordType, collection: str, doc_id: str, updated_at: datetime.datetime,
+                 data: str = ''):
+        self._record_type = record_type
+        self._collection = collection
+        self._doc_id = doc_id
+        self._updated_at = updated_at
+        self._data = data
+
+    @property
+    def record_type(self) -> WALRecordType:
+        return self._record_type
+
+    @property
+    def collection(self) -> str:
+        return self._collection
+
+    @property
+    def doc_id(self) -> str:
+        return self._doc_id
+
+    @property
+    def updated_at(self) -> datetime.datetime:
+        return self._updated_at
+
+    @property
+    def data(self) -> str:
+        return self._data
+
+    def encode(self) -> bytes:
+        collection = self._collection.encode('utf-8')
+        doc_id = self._doc_id.encode('utf-8')
+
+        body = bytearray(RECORD_HEADER.pack(self._record_type.value, to_microseconds(self._updated_at),
+                                            len(collection), len(doc_id)))
+        body.extend(collection)
+        body.extend(doc_id)
+        body.extend(self._data.encode('utf-8'))
+
+        res = bytearray(RECORD_PREFIX.pack(zlib.crc32(body), len(body)))
+        res.extend(body)
+
+        return bytes(res)
+
+    @staticmethod
+    def decode(src, offset: int = 0):
+        """Returns (record, record length) or None if the record is truncated or corrupted"""
+        if len(src) - offset < RECORD_PREFIX.size:
+            return None
+
+        crc, length = RECORD_PREFIX.unpack_from(src, offset)
+        start = offset + RECORD_PREFIX.size
+        if len(src) - start < length or length < RECORD_HEADER.size:
+            return None
+
+        body = bytes(src[start:start + length])
+        if zlib.crc32(body) != crc:
+            return None
+
+        record_type, updated_at, collection_length, doc_id_length = RECORD_HEADER.unpack_from(body)
+        pos = RECORD_HEADER.size
+        collection = body[pos:pos + collection_length].decode('utf-8')
+        pos += collection_length
+        doc_id = body[pos:pos + doc_id_length].decode('utf-8')
+        pos += doc_id_length
+        data = body[pos:].decode('utf-8')
+
+        record = WALRecord(WALRecordType(record_type), collection, doc_id, from_microseconds(updated_at), data)
+        return record, RECORD_PREFIX.size + length
+
+
+class WriteAheadLog:
+    """Log of the document operations, the operation is acknowledged once its records are durable
+
+    The records are written before the operation is applied to the collection (see logged), so the operation
+    interrupted by the crash is redone by the replay. The records of the operation which failed are cancelled
+    by the abort records, the replay skips them.
+
+    The records are written by append() and made durable by the flusher thread: one fsync covers every record
+    appended since the previous one (group commit). The policy decides when the flusher runs: ALWAYS - as soon as
+    there are records waiting, INTERVAL - every interval_ms, NEVER - the records are acknowledged right away.
+
+    The collections are not synced by themselves. The checkpoint starts a new log file, waits for the operations
+    of the previous files to be applied, syncs the file system and removes the previous log files, so after a crash
+    only the records since the last checkpoint are replayed.
+    """
+    LOG_EXTENSION = '.log'
+    DEFAULT_INTERVAL_MS = 10
+    CHECKPOINT_SIZE = 64 * 1024 * 1024
+    CHECKPOINT_CHECK_INTERVAL = 1.0
+
+    def __init__(self, path: str, policy: FsyncPolicy = FsyncPolicy.ALWAYS,
+                 interval_ms: int = DEFAULT_INTERVAL_MS, checkpoint_size: int = CHECKPOINT_SIZE):
+        self._path = path
+        self._policy = policy
+        self._interval = interval_ms / 1000
+        self._checkpoint_size = checkpoint_size
+
+        os.makedirs(self._path, exist_ok=True)
+
+        self._lock = threading.Condition()
+        # the flusher and the checkpoint must not use the file descriptor at the same time
+        self._flush_lock = threading.Lock()
+        self._waiting = list()
+        # generation -> count of the logged operations which are being applied
+        self._applying = dict()
+        self._is_closed = False
+
+        generations = self._generations()
+        self._generation = generations[-1] + 1 if len(generations) > 0 else 0
+        self._fd = self._open(self._generation)
+        self._size = 0
+
+        self._flusher = threading.Thread(target=self._flushing, daemon=True)
+        self._flusher.start()
+
+    @property
+    def policy(self) -> FsyncPolicy:
+        return self._policy
+
+    def append(self, records: list) -> futures.Future:
+        """Writes the records at once, the future is resolved when they are durable"""
+        durable, _ = self._append(records)
+        return durable
+
+    def abort(self, records: list) -> futures.Future:
+        """Cancels the logged records which were not applied, the future is resolved when the cancel is durable"""
+        return self.append([
+            WALRecord(WALRecordType.ABORT, record.collection, record.doc_id, record.updated_at)
+            for record in records
+        ])
+
+    @contextlib.contextmanager
+    def logged(self, records: list):
+        """Writes the records and yields the durability future, the body applies them to the collections
+
+        The checkpoint does not drop the records until the body is left, so the write interrupted by the crash
+        is always redone by the replay. The records are aborted if the body raises, the error is propagated
+        once the abort is durable.
+        """
+        durable, generation = self._append(records, applying=True)
+        aborted = None
+        try:
+            yield durable
+        except Exception:
+            try:
+                aborted = self.abort(records)
+            except Exception as e:
+                logging.error(f"Could not abort the records in write-ahead log {self._path}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._applying[generation] -= 1
+                if self._applying[generation] == 0:
+                    del self._applying[generation]
+                    self._lock.notify_all()
+
+            # the checkpoint holds the flusher until the operation is left, so the abort is waited for after it
+            if aborted is not None:
+                futures.wait([aborted])
+
+    def _append(self, records: list, applying: bool = False) -> tuple:
+        data = b''.join(record.encode() for record in records)
+        durable = futures.Future()
+
+        with self._lock:
+            if self._is_closed:
+                raise RuntimeError(f"Write-ahead log {self._path} is closed")
+
+            os.write(self._fd, data)
+            self._size += len(data)
+            generation = self._generation
+            if applying:
+                self._applying[generation] = self._applying.get(generation, 0) + 1
+
+            if self._policy != FsyncPolicy.NEVER:
+                self._waiting.append(durable)
+                if self._policy == FsyncPolicy.ALWAYS:
+                    self._lock.notify()
+
+        if self._policy == FsyncPolicy.NEVER:
+            durable.set_result(None)
+
+        return durable, generation
+
+    def replay(self):
+        """Yields the records left by the previous runs, the log files are read up to the first broken record
+
+        The aborted records are skipped, the abort could be logged by the later file than the record.
+        """
+        records = list()
+        # (collection, doc ID, updated at) -> indexes of the records which are not aborted
+        abortable = dict()
+        for generation in self._generations():
+            if generation >= self._generation:
+                break
+
+            with open(self._pathname(generation), 'rb') as f:
+                src = f.read()
+
+            offset = 0
+            while offset < len(src):
+                decoded = WALRecord.decode(src, offset)
+                if decoded is None:
+                    logging.warning(f"Write-ahead log {self._pathname(generation)} is truncated at {offset}")
+                    break
+
+                record, length = decoded
+                offset += length
+
+                key = (record.collection, record.doc_id, record.updated_at)
+                if record.record_type != WALRecordType.ABORT:
+                    abortable.setdefault(key, list()).append(len(records))
+                    records.append(record)
+                    continue
+
+                indexes = abortable.get(key)
+                if indexes:
+                    records[indexes.pop()] = None
+
+        for record in records:
+            if record is not None:
+                yield record
+
+    def checkpoint(self):
+        with self._flush_lock:
+            with self._lock:
+                waiting, self._waiting = self._waiting, list()
+                old_fd = self._fd
+                old_generation = self._generation
+
+                self._generation += 1
+                self._fd = self._open(self._generation)
+                self._size = 0
+
+                # the new operations are logged by the new file, the logged ones must be applied before the sync
+                while any(generation <= old_generation for generation in self._applying.keys()):
+                    self._lock.wait()
+
+            # one sync makes the documents and their records durable
+            os.sync()
+            os.close(old_fd)
+
+            for generation in self._generations():
+                if generation <= old_generation:
+                    os.remove(self._pathname(generation))
+
+        for durable in waiting:
+            durable.set_result(None)
+
+    def close(self):
+        with self._lock:
+            self._is_closed = True
+            self._lock.notify()
+
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
+
+        with self._flush_lock:
+            os.close(self._fd)
+
+    def _flushing(self):
+        while True:
+            with self._lock:
+                if self._policy == FsyncPolicy.ALWAYS:
+                    if len(self._waiting) == 0 and not self._is_closed:
+                        self._lock.wait(WriteAheadLog.CHECKPOINT_CHECK_INTERVAL)
+                elif not self._is_closed:
+                    timeout = self._interval if self._policy == FsyncPolicy.INTERVAL \
+                        else WriteAheadLog.CHECKPOINT_CHECK_INTERVAL
+                    self._lock.wait(timeout)
+
+                is_closed = self._is_closed
+                needs_checkpoint = self._size >= self._checkpoint_size
+
+            self._flush()
+
+            if needs_checkpoint and not is_closed:
+                self.checkpoint()
+
+            if is_closed:
+                return
+
+    def _flush(self):
+        with self._flush_lock:
+            with self._lock:
+                waiting, self._waiting = self._waiting, list()
+                fd = self._fd
+
+            if len(waiting) == 0:
+                return
+
+            error = None
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logging.error(f"Could not sync write-ahead log {self._path}: {e}")
+                error = e
+
+        for durable in waiting:
+            if error is not None:
+                durable.set_exception(error)
+            else:
+                durable.set_result(None)
+
+    def _open(self, generation: int) -> int:
+        return os.open(self._pathname(generation), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _pathname(self, generation: int) -> str:
+        return os.path.join(self._path, f'{generation:010d}{WriteAheadLog.LOG_EXTENSION}')
+
+    def _generations(self) -> list:
+        res = list()
+        for name in os.listdir(self._path):
+            stem, extension = os.path.splitext(name)
+            if extension == WriteAheadLog.LOG_EXTENSION and stem.isdigit():
+                res.append(int(stem))
+
+        return sorted(res)
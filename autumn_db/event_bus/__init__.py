@@ -53,6 +53,25 @@ class DocumentOrientedEvent(Event):
         return f"DocumentOrientedEvent, {self.document_id},{self.collection}"
 
 
+class DocumentsBatchOrientedEvent(Event):
+
+    def __init__(self, collection: CollectionName, operation: DocumentOperation, doc_ids: list):
+        super().__init__(collection)
+        self._operation = operation
+        self._doc_ids = doc_ids
+
+    @property
+    def event_code(self) -> int:
+        return self._operation.value
+
+    @property
+    def document_ids(self) -> list:
+        return self._doc_ids
+
+    def __str__(self):
+        return f"DocumentsBatchOrientedEvent, {len(self.document_ids)} documents,{self.collection}"
+
+
 class EventBus:
 
     def __init__(self):
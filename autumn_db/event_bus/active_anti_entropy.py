@@ -1,25 +1,69 @@
-import json
+import itertools
 import logging
+import lzma
 import socket
 import threading
+import time
+import zlib
 from dataclasses import dataclass
-from datetime import datetime, timezone
+from datetime import datetime
 from enum import Enum
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
 
 from typing import List
 
-from algorithms.ph2 import PH2
-from algorithms.spectral_bloom_filter import SpectralBloomFilter
+from algorithms.merkle_tree import MerkleTree, HASH_LENGTH as MERKLE_HASH_LENGTH
+from algorithms.phi_accrual import PhiAccrualFailureDetector
 from autumn_db import DocumentId
 from autumn_db.autumn_db import DBCoreEngine, DBOperationEngine
+from autumn_db.data_storage import to_microseconds, from_microseconds
 from autumn_db.data_storage.collection import CollectionOperations
-from autumn_db.event_bus import Event, Subscriber, DocumentOrientedEvent
+from autumn_db.event_bus import Event, Subscriber, DocumentsBatchOrientedEvent
 from db_driver import CollectionName, Document, DRIVER_COLLECTION_NAME_LENGTH_BYTES, DRIVER_BYTEORDER, \
-    DRIVER_DOCUMENT_ID_LENGTH, CollectionOperation, DocumentOperation, send_message_to
+    DRIVER_DOCUMENT_ID_LENGTH, CollectionOperation, DocumentOperation, FrameReader, Frame, encode_document_id, \
+    FRAME_FLAG_ZLIB, FRAME_FLAG_LZMA, FRAME_MAX_PAYLOAD_LENGTH
 
 
 _timeout = 0.2
+# enough for any datagram
+_datagram_size = 65507
+
+
+class Compression(Enum):
+    NONE = 'none'
+    ZLIB = 'zlib'
+    LZMA = 'lzma'
+
+    @property
+    def frame_flag(self) -> int:
+        return {Compression.NONE: 0, Compression.ZLIB: FRAME_FLAG_ZLIB, Compression.LZMA: FRAME_FLAG_LZMA}[self]
+
+    def compress(self, src: bytes) -> bytes:
+        if self == Compression.ZLIB:
+            return zlib.compress(src)
+
+        if self == Compression.LZMA:
+            return lzma.compress(src)
+
+        return src
+
+    @staticmethod
+    def decompress(flags: int, src: bytes) -> bytes:
+        if flags & FRAME_FLAG_ZLIB:
+            decompressor = zlib.decompressobj()
+        elif flags & FRAME_FLAG_LZMA:
+            decompressor = lzma.LZMADecompressor()
+        else:
+            return src
+
+        # the size is limited as the one of the uncompressed frame
+        res = decompressor.decompress(src, FRAME_MAX_PAYLOAD_LENGTH)
+        if not decompressor.eof:
+            raise Exception(f"Compressed payload is truncated or exceeds {FRAME_MAX_PAYLOAD_LENGTH} bytes")
+
+        return res
+
 
 @dataclass
 class Endpoint:
@@ -31,10 +75,14 @@ class Endpoint:
 class NodeConfig:
     snapshot_receiver: Endpoint
     document_receiver: Endpoint
+    # the documents sent to the neighbor are compressed if they are not shorter than the threshold
+    compression: Compression = Compression.NONE
+    compression_threshold: int = 1024
 
     def __post_init__(self):
         self.snapshot_receiver = Endpoint(**self.snapshot_receiver)
         self.document_receiver = Endpoint(**self.document_receiver)
+        self.compression = Compression(self.compression)
 
 
 @dataclass
@@ -48,9 +96,18 @@ class AAEConfig:
 
 
 class DocumentReceiver:
-    BUFFER_SIZE = 1
-
-    def __init__(self, port: int):
+    """Accepts the document streams of the neighbors
+
+    Every connection carries SENDING_DOCUMENT frames, the request ID is the sequence number of the document
+    in the stream. The documents are applied in batches by the pool of appliers and the sender is acked
+    by the last sequence number which is applied together with all previous ones. Request ID 0 means
+    the sender does not wait for the ack. The batch which could not be applied is not acked and the connection
+    is closed, so the sender sends the documents again.
+    """
+    BATCH_SIZE = 256
+    APPLIERS = 4
+
+    def __init__(self, port: int, apply_documents):
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._port = port
         self._socket.bind(
@@ -59,27 +116,234 @@ class DocumentReceiver:
         self._socket.settimeout(_timeout)
         self._socket.listen()
 
-    def get_document_and_metadata(self) -> bytearray:
+        # gets the list of the decompressed payloads
+        self._apply_documents = apply_documents
+        self._appliers = ThreadPoolExecutor(max_workers=DocumentReceiver.APPLIERS)
+
+    def accept_stream(self):
         try:
             connection, client_address = self._socket.accept()
         except socket.timeout:
-            return None
+            return
 
-        data = bytearray()
-        while True:
-            part = connection.recv(DocumentReceiver.BUFFER_SIZE)
-            if not part:
-                break
+        connection.settimeout(None)
+        threading.Thread(target=self._serve_stream, args=(connection,), daemon=True).start()
+
+    def _serve_stream(self, connection: socket.socket):
+        reader = FrameReader(connection)
+        acks = _StreamAcks(connection)
+
+        try:
+            batch = list()
+            last_sequence = 0
+            while True:
+                frame = reader.read_frame()
+                if frame is None:
+                    break
+
+                if frame.opcode != AAEOperationType.SENDING_DOCUMENT.value:
+                    continue
+
+                batch.append(Compression.decompress(frame.flags, frame.payload))
+                last_sequence = max(last_sequence, frame.request_id)
+
+                # the batch is closed when the received frames are over, so the single documents are not delayed
+                if len(batch) >= DocumentReceiver.BATCH_SIZE or reader.buffered == 0:
+                    acks.submit(self._appliers.submit(self._apply_documents, batch), last_sequence)
+                    batch = list()
+                    last_sequence = 0
+        except Exception as e:
+            logging.warning(f"Document stream is broken: {e}")
+        finally:
+            acks.close()
+
+
+class _StreamAcks:
+    """Acks the batches of the stream in the order they are received, though they are applied concurrently"""
+
+    def __init__(self, connection: socket.socket):
+        self._connection = connection
+        self._lock = threading.Lock()
+        # [last sequence, is applied, is failed] of the batches which are not acked
+        self._batches = list()
+        self._closed = False
+        self._broken = False
+
+    def submit(self, applied, last_sequence: int):
+        entry = [last_sequence, False, False]
+        with self._lock:
+            self._batches.append(entry)
+
+        applied.add_done_callback(lambda future: self._on_applied(entry, future))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._close_when_applied()
+
+    def _on_applied(self, entry: list, future):
+        with self._lock:
+            entry[1] = True
+            if future.exception() is not None:
+                logging.warning(f"Documents are not applied, the stream is broken: {future.exception()}")
+                entry[2] = True
+                self._break()
+
+            # the failed batch stops the acks, the later ones are sent again together with it
+            ack = 0
+            while len(self._batches) > 0 and self._batches[0][1] and not self._batches[0][2]:
+                ack = max(ack, self._batches.pop(0)[0])
+
+            try:
+                if ack > 0 and not self._closed and not self._broken:
+                    self._connection.sendall(Frame(AAEOperationType.ACK_DOCUMENTS.value, request_id=ack).encode())
+            except OSError as e:
+                logging.warning(f"Documents are not acked: {e}")
+
+            self._close_when_applied()
+
+    def _break(self):
+        # the sender sees the closed connection and sends the documents which are not acked by the new one
+        if self._broken:
+            return
+
+        self._broken = True
+        try:
+            self._connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _close_when_applied(self):
+        if self._closed and all(entry[1] for entry in self._batches):
+            self._connection.close()
+
+
+class DocumentStream:
+    """Persistent connection which sends the documents to the neighbor
+
+    At most WINDOW documents are not acked, the sender waits for the acks beyond that. The documents which
+    are not acked are kept: the broken connection is reopened by the next document or by resend(), and they are
+    sent again before it.
+    """
+    WINDOW = 1024
+    ACK_TIMEOUT = 5.0
+    MAX_SEQUENCE = 0xFFFFFFFF
+
+    def __init__(self, addr_port: tuple):
+        self._addr_port = addr_port
+        self._condition = threading.Condition()
+        self._socket = None
+        self._sent = 0
+        self._acked = 0
+        # sequence -> (payload, flags) of the documents which are not acked, in the order they are sent
+        self._window = dict()
+
+    @property
+    def in_flight(self) -> int:
+        with self._condition:
+            return len(self._window)
+
+    def send(self, payload: bytes, flags: int = 0):
+        self.resend()
+
+        with self._condition:
+            sock = self._socket
+            if not self._condition.wait_for(lambda: self._sent - self._acked < DocumentStream.WINDOW
+                                            or self._socket is not sock, DocumentStream.ACK_TIMEOUT):
+                self._reset()
+                raise Exception(f"Neighbor {self._addr_port} does not ack the documents")
+
+            self._sent += 1
+            sequence = self._sent
+            self._window[sequence] = (payload, flags)
+
+            if sock is None or self._socket is not sock:
+                # the document is sent by the next connection
+                return
+
+        self._send_frames(sock, [Frame(AAEOperationType.SENDING_DOCUMENT.value, payload, flags, sequence)])
+
+    def resend(self):
+        """Reopens the broken connection and sends the documents which are not acked by it"""
+        with self._condition:
+            if self._socket is not None and self._sent < DocumentStream.MAX_SEQUENCE:
+                return
 
-            data.extend(part)
+            self._connect()
+            sock = self._socket
+            frames = [
+                Frame(AAEOperationType.SENDING_DOCUMENT.value, payload, flags, sequence)
+                for sequence, (payload, flags) in self._window.items()
+            ]
 
-        return data
+        self._send_frames(sock, frames)
+
+    def close(self):
+        with self._condition:
+            self._reset()
+
+    def _send_frames(self, sock: socket.socket, frames: list):
+        try:
+            for frame in frames:
+                sock.sendall(frame.encode())
+        except OSError:
+            with self._condition:
+                if self._socket is sock:
+                    self._reset()
+            raise
+
+    def _connect(self):
+        self._reset()
+        self._socket = socket.create_connection(self._addr_port, timeout=_timeout)
+        self._socket.settimeout(None)
+
+        threading.Thread(target=self._reading_acks, args=(self._socket,), daemon=True).start()
+
+    def _reset(self):
+        if self._socket is not None:
+            self._socket.close()
+
+        self._socket = None
+        # the documents which are not acked are kept and numbered for the next connection
+        self._window = {sequence: doc for sequence, doc in enumerate(self._window.values(), 1)}
+        self._sent = len(self._window)
+        self._acked = 0
+        self._condition.notify_all()
+
+    def _reading_acks(self, sock: socket.socket):
+        reader = FrameReader(sock)
+        try:
+            while True:
+                frame = reader.read_frame()
+                if frame is None:
+                    break
+
+                with self._condition:
+                    if self._socket is not sock:
+                        return
+
+                    self._acked = max(self._acked, frame.request_id)
+                    # the window is ordered by the sequence numbers
+                    while len(self._window) > 0 and next(iter(self._window)) <= self._acked:
+                        del self._window[next(iter(self._window))]
+                    self._condition.notify_all()
+        except Exception:
+            pass
+
+        with self._condition:
+            if self._socket is sock:
+                self._reset()
 
 
 class AAEOperationType(Enum):
-    TERMINATE_SESSION: int = 0
-    SENDING_SNAPSHOT: int = 1
-    SENDING_TIMESTAMP: int = 2
+    SENDING_DOCUMENT: int = 3
+    REQUEST_MERKLE_NODE: int = 4
+    SENDING_MERKLE_NODE: int = 5
+    CHECK_SNAPSHOTS: int = 6
+    SENDING_DIFFERING: int = 7
+    HEARTBEAT: int = 8
+    HEARTBEAT_ACK: int = 9
+    ACK_DOCUMENTS: int = 10
 
     @staticmethod
     def get_by_value(value: int):
@@ -107,16 +371,25 @@ class AAECommunication(AAESnapshot):
     def get(self) -> bytearray: ...
 
 
-class Snapshot:
+class AAERequestMerkleNode(AAECommunication):
+    # FORMAT
+    # |Opcode|Collection name length|Collection name|Level|Index |
+    #  1byte         1byte             1-255bytes    1byte 2bytes
 
-    def __init__(self, sbf: SpectralBloomFilter, hash: PH2):
-        b_sbf = sbf.get()
-        b_hash = hash.hashing()
+    def __init__(self, collection_name: str, level: int, index: int):
+        super().__init__(AAEOperationType.REQUEST_MERKLE_NODE)
+        b_collection_name = collection_name.encode('utf-8')
+        collection_name_len = len(b_collection_name)
+        collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES,
+                                                                   DRIVER_BYTEORDER, signed=False)
 
         self._bytearray = bytearray()
         parts = [
-            b_sbf,
-            b_hash,
+            self.get_opcode(),
+            collection_name_len_encoded,
+            b_collection_name,
+            level.to_bytes(1, DRIVER_BYTEORDER, signed=False),
+            index.to_bytes(2, DRIVER_BYTEORDER, signed=False),
         ]
         for part in parts:
             self._bytearray.extend(part)
@@ -124,55 +397,191 @@ class Snapshot:
     def get(self) -> bytearray:
         return self._bytearray
 
-    def __str__(self):
-        return str(self._bytearray)
 
-    def __repr__(self):
-        return self.__str__()
+class AAEMerkleNode(AAECommunication):
+    # FORMAT
+    # |Opcode|Level|Index |Node hash|Children hashes |
+    #  1byte 1byte 2bytes  16bytes   16bytes per child, the leaves have no children
+    HEADER_LENGTH = 4
 
+    def __init__(self, level: int, index: int, node_hash: bytes, children: list):
+        super().__init__(AAEOperationType.SENDING_MERKLE_NODE)
+        self._level = level
+        self._index = index
+        self._node_hash = node_hash
+        self._children = children
 
-class AAECheckSnapshot(AAECommunication):
+    @property
+    def level(self) -> int:
+        return self._level
 
-    def __init__(self, collection_name: str, doc_id: str, snapshot: Snapshot):
-        super().__init__(AAEOperationType.SENDING_SNAPSHOT)
-        b_collection_name = collection_name.encode('utf-8')
-        collection_name_len = len(b_collection_name)
-        collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES,
-                                                                   DRIVER_BYTEORDER, signed=False)
-        b_doc_id = doc_id.encode()
+    @property
+    def index(self) -> int:
+        return self._index
 
-        self._bytearray = bytearray()
-        parts = [
-            self.get_opcode(),
-            collection_name_len_encoded,
-            b_collection_name,
-            b_doc_id,
-            snapshot.get(),
-        ]
-        for part in parts:
-            self._bytearray.extend(part)
+    @property
+    def node_hash(self) -> bytes:
+        return self._node_hash
+
+    @property
+    def children(self) -> list:
+        return self._children
 
     def get(self) -> bytearray:
-        return self._bytearray
+        res = bytearray(self.get_opcode())
+        res.extend(self._level.to_bytes(1, DRIVER_BYTEORDER, signed=False))
+        res.extend(self._index.to_bytes(2, DRIVER_BYTEORDER, signed=False))
+        res.extend(self._node_hash)
+        for child in self._children:
+            res.extend(child)
 
+        return res
 
-class AAERequestSnapshot(AAECommunication):
+    @staticmethod
+    def parse(src: bytes):
+        level = src[1]
+        index = int.from_bytes(src[2:AAEMerkleNode.HEADER_LENGTH], DRIVER_BYTEORDER, signed=False)
 
-    def __init__(self, collection_name: str, doc_id: str):
-        super().__init__(AAEOperationType.SENDING_TIMESTAMP)
-        b_collection_name = collection_name.encode('utf-8')
-        collection_name_len = len(b_collection_name)
-        collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES,
-                                                                   DRIVER_BYTEORDER, signed=False)
+        hashes = src[AAEMerkleNode.HEADER_LENGTH:]
+        hashes = [bytes(hashes[i:i + MERKLE_HASH_LENGTH]) for i in range(0, len(hashes), MERKLE_HASH_LENGTH)]
+
+        return AAEMerkleNode(level, index, hashes[0], hashes[1:])
+
+
+class AAECheckSnapshots(AAECommunication):
+    # FORMAT
+    # |Opcode|Request ID|Collection name length|Collection name|Count |Doc ID length|Doc ID|Snapshot|...
+    #  1byte   4bytes           1byte             1-255bytes   2bytes    1byte     Xbytes 14bytes
+    MAX_COUNT = 256
+    SNAPSHOT_LENGTH = 14
 
-        b_doc_id = doc_id.encode()
+    def __init__(self, request_id: int, collection_name: str, snapshots: list):
+        # snapshots is the list of (doc ID, snapshot bytes) pairs
+        super().__init__(AAEOperationType.CHECK_SNAPSHOTS)
+        self._request_id = request_id
+        self._collection_name = collection_name
+        self._snapshots = snapshots
+
+    @property
+    def request_id(self) -> int:
+        return self._request_id
+
+    @property
+    def collection_name(self) -> str:
+        return self._collection_name
+
+    @property
+    def snapshots(self) -> list:
+        return self._snapshots
+
+    def get(self) -> bytearray:
+        b_collection_name = self._collection_name.encode('utf-8')
+
+        res = bytearray(self.get_opcode())
+        res.extend(self._request_id.to_bytes(4, DRIVER_BYTEORDER, signed=False))
+        res.extend(len(b_collection_name).to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES, DRIVER_BYTEORDER,
+                                                   signed=False))
+        res.extend(b_collection_name)
+        res.extend(len(self._snapshots).to_bytes(2, DRIVER_BYTEORDER, signed=False))
+        for doc_id, snapshot in self._snapshots:
+            b_doc_id = doc_id.encode('utf-8')
+            res.extend(len(b_doc_id).to_bytes(1, DRIVER_BYTEORDER, signed=False))
+            res.extend(b_doc_id)
+            res.extend(snapshot)
+
+        return res
+
+    @staticmethod
+    def parse(src: bytes):
+        request_id = int.from_bytes(src[1:5], DRIVER_BYTEORDER, signed=False)
+        pos = 5
+        collection_name_length = int.from_bytes(src[pos:pos + DRIVER_COLLECTION_NAME_LENGTH_BYTES], DRIVER_BYTEORDER,
+                                                signed=False)
+        pos += DRIVER_COLLECTION_NAME_LENGTH_BYTES
+        collection_name = bytes(src[pos:pos + collection_name_length]).decode('utf-8')
+        pos += collection_name_length
+
+        count = int.from_bytes(src[pos:pos + 2], DRIVER_BYTEORDER, signed=False)
+        pos += 2
+
+        snapshots = list()
+        for _ in range(count):
+            doc_id_length = src[pos]
+            doc_id = bytes(src[pos + 1:pos + 1 + doc_id_length]).decode('utf-8')
+            pos += 1 + doc_id_length
+            snapshots.append((doc_id, bytes(src[pos:pos + AAECheckSnapshots.SNAPSHOT_LENGTH])))
+            pos += AAECheckSnapshots.SNAPSHOT_LENGTH
+
+        return AAECheckSnapshots(request_id, collection_name, snapshots)
+
+
+class AAEDifferingSnapshots(AAECommunication):
+    # FORMAT
+    # |Opcode|Request ID|Count |Doc ID length|Doc ID|Updated at|...
+    #  1byte   4bytes   2bytes    1byte     Xbytes   8bytes
+    # Updated at is in microseconds, 0 if the document is absent
+
+    def __init__(self, request_id: int, timestamps: list):
+        # timestamps is the list of (doc ID, updated at) pairs, updated at is None for the absent documents
+        super().__init__(AAEOperationType.SENDING_DIFFERING)
+        self._request_id = request_id
+        self._timestamps = timestamps
+
+    @property
+    def request_id(self) -> int:
+        return self._request_id
+
+    @property
+    def timestamps(self) -> list:
+        return self._timestamps
+
+    def get(self) -> bytearray:
+        res = bytearray(self.get_opcode())
+        res.extend(self._request_id.to_bytes(4, DRIVER_BYTEORDER, signed=False))
+        res.extend(len(self._timestamps).to_bytes(2, DRIVER_BYTEORDER, signed=False))
+        for doc_id, updated_at in self._timestamps:
+            b_doc_id = doc_id.encode('utf-8')
+            res.extend(len(b_doc_id).to_bytes(1, DRIVER_BYTEORDER, signed=False))
+            res.extend(b_doc_id)
+            microseconds = to_microseconds(updated_at) if updated_at is not None else 0
+            res.extend(microseconds.to_bytes(8, DRIVER_BYTEORDER, signed=True))
+
+        return res
+
+    @staticmethod
+    def parse(src: bytes):
+        request_id = int.from_bytes(src[1:5], DRIVER_BYTEORDER, signed=False)
+        count = int.from_bytes(src[5:7], DRIVER_BYTEORDER, signed=False)
+        pos = 7
+
+        timestamps = list()
+        for _ in range(count):
+            doc_id_length = src[pos]
+            doc_id = bytes(src[pos + 1:pos + 1 + doc_id_length]).decode('utf-8')
+            pos += 1 + doc_id_length
+            microseconds = int.from_bytes(src[pos:pos + 8], DRIVER_BYTEORDER, signed=True)
+            pos += 8
+            timestamps.append((doc_id, from_microseconds(microseconds) if microseconds != 0 else None))
+
+        return AAEDifferingSnapshots(request_id, timestamps)
+
+
+class AAEHeartbeat(AAECommunication):
+    # FORMAT
+    # |Opcode|Sequence|
+    #  1byte  4bytes
+    # the answer is HEARTBEAT_ACK with the same sequence
+    LENGTH = 5
+
+    def __init__(self, _type: AAEOperationType, sequence: int):
+        super().__init__(_type)
+        self.operation_type = _type
+        self.sequence = sequence
 
         self._bytearray = bytearray()
         parts = [
             self.get_opcode(),
-            collection_name_len_encoded,
-            b_collection_name,
-            b_doc_id
+            sequence.to_bytes(4, DRIVER_BYTEORDER, signed=False),
         ]
         for part in parts:
             self._bytearray.extend(part)
@@ -180,11 +589,16 @@ class AAERequestSnapshot(AAECommunication):
     def get(self) -> bytearray:
         return self._bytearray
 
+    @staticmethod
+    def parse(src: bytes):
+        if len(src) != AAEHeartbeat.LENGTH:
+            raise Exception(f"Heartbeat has wrong length {len(src)}")
+
+        return AAEHeartbeat(AAEOperationType.get_by_value(src[0]), int.from_bytes(src[1:5], DRIVER_BYTEORDER))
+
 
 class AAEAnswererWorker:
-    BUFFER_SIZE = 46
-    SENDING_TIMESTAMP_PAYLOAD_PART = bytes([AAEOperationType.SENDING_TIMESTAMP.value])
-    TERMINATION_PAYLOAD = bytes([AAEOperationType.TERMINATE_SESSION.value])
+    BUFFER_SIZE = _datagram_size
 
     def __init__(self, addr: str, port: int, db_core: DBCoreEngine, receivers: List[NodeConfig]):
         super().__init__()
@@ -210,62 +624,326 @@ class AAEAnswererWorker:
         payload = payload[1::1]
         operation_type = AAEOperationType.get_by_value(oper_code)
 
-        def send_timestamp(timestamp: datetime):
-            s_timestamp = datetime.strftime(timestamp, DocumentId.UTC_FORMAT)
-            b_timestamp = s_timestamp.encode('utf-8')
+        if operation_type == AAEOperationType.HEARTBEAT:
+            heartbeat = AAEHeartbeat.parse(bytes([oper_code]) + payload)
+            self._socket.sendto(AAEHeartbeat(AAEOperationType.HEARTBEAT_ACK, heartbeat.sequence).get(), addr_port)
+            return None
+
+        if operation_type == AAEOperationType.REQUEST_MERKLE_NODE:
+            collection_name_length = int.from_bytes(payload[:DRIVER_COLLECTION_NAME_LENGTH_BYTES], DRIVER_BYTEORDER,
+                                                    signed=False)
+            payload = payload[DRIVER_COLLECTION_NAME_LENGTH_BYTES::]
+            collection_name_str = payload[:collection_name_length].decode('utf-8')
+            payload = payload[collection_name_length::]
 
-            _bytearray = bytearray()
-            parts = [
-                AAEAnswererWorker.SENDING_TIMESTAMP_PAYLOAD_PART,
-                b_timestamp,
-            ]
-            for part in parts:
-                _bytearray.extend(part)
+            level = payload[0]
+            index = int.from_bytes(payload[1:3], DRIVER_BYTEORDER, signed=False)
 
-            self._socket.sendto(_bytearray, addr_port)
+            collection: CollectionOperations = self._db_core.get_collection_safely(collection_name_str)
+            tree: MerkleTree = collection.get_merkle_tree()
+            if level > tree.depth:
+                return None
 
-        if operation_type == AAEOperationType.SENDING_SNAPSHOT:
-            collection_name_length_bytes = payload[:DRIVER_COLLECTION_NAME_LENGTH_BYTES:1]
-            payload = payload[DRIVER_COLLECTION_NAME_LENGTH_BYTES::]
+            answer = AAEMerkleNode(level, index, tree.node(level, index), tree.children(level, index))
+            self._socket.sendto(answer.get(), addr_port)
+            return None
 
-            collection_name_length = int.from_bytes(collection_name_length_bytes, DRIVER_BYTEORDER, signed=False)
-            collection_name_bytes = payload[:collection_name_length:1]
-            collection_name_str = collection_name_bytes.decode('utf-8')
+        if operation_type == AAEOperationType.CHECK_SNAPSHOTS:
+            request = AAECheckSnapshots.parse(bytes([oper_code]) + payload)
+            collection: CollectionOperations = self._db_core.get_collection_safely(request.collection_name)
 
-            payload = payload[collection_name_length::1]
+            differing = list()
+            for doc_id, snapshot in request.snapshots:
+                local_snapshot = collection.get_snapshot(doc_id)
+                if local_snapshot is None:
+                    differing.append((doc_id, None))
+                    continue
 
-            doc_id = payload[:DRIVER_DOCUMENT_ID_LENGTH:1]
-            doc_id = doc_id.decode('utf-8')
-            payload = payload[DRIVER_DOCUMENT_ID_LENGTH::]
+                if local_snapshot != snapshot:
+                    differing.append((doc_id, collection.get_updated_at(doc_id)))
 
-            snapshot = payload[::]
+            self._socket.sendto(AAEDifferingSnapshots(request.request_id, differing).get(), addr_port)
+            return None
 
-            collection: CollectionOperations = self._db_core.get_collection_safely(collection_name_str)
 
-            if doc_id not in collection.doc_ids():
-                fake_timestamp = datetime(1970, 1, 1, 0, 0, 0, 0, tzinfo=timezone.utc)
-                send_timestamp(fake_timestamp)
-                return
+class NeighborReplicator:
+    """Replicates the documents to one neighbor by own thread, queue and socket
+
+    A slow or dead neighbor delays its own queue only. The queued documents and collections are deduplicated,
+    so the queue of the lagging neighbor does not grow with the number of the changes. The tasks for the suspected
+    neighbor are dropped, the collections are synced by Merkle trees when it answers the heartbeats again.
+    """
+    PUSH_DOCUMENT = 'document'
+    SYNC_COLLECTION = 'collection'
+    RESEND_INTERVAL = 1.0
+
+    def __init__(self, neigh: NodeConfig, db_core: DBCoreEngine, heartbeat_interval: float):
+        self._neigh = neigh
+        self._db_core = db_core
+        self._detector = PhiAccrualFailureDetector(heartbeat_interval)
 
-            _doc_id = DocumentId(doc_id)
-            sbf_and_ph2 = collection.get_snapshot(_doc_id)
-            if sbf_and_ph2 is None:
-                fake_timestamp = datetime(1970, 1, 1, 0, 0, 0, 0, tzinfo=timezone.utc)
-                send_timestamp(fake_timestamp)
+        self._queue = Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+        # the snapshots are checked by one socket, the answers are matched by the request ID
+        self._socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self._socket.settimeout(_timeout)
+        self._request_ids = itertools.count(1)
+
+        self._stream = DocumentStream((neigh.document_receiver.addr, neigh.document_receiver.port))
+
+        self._sent_documents = 0
+        self._synced_collections = 0
+        self._skipped_tasks = 0
+
+        self._raw_bytes = 0
+        self._sent_bytes = 0
+        self._compression_cpu_time = 0.0
+
+        self._worker = threading.Thread(target=self._processing, daemon=True)
+
+    @property
+    def neighbor(self) -> NodeConfig:
+        return self._neigh
+
+    def start(self):
+        self._worker.start()
+
+    def push_document(self, collection_name: str, doc_id: str):
+        self._enqueue((NeighborReplicator.PUSH_DOCUMENT, collection_name, doc_id))
+
+    def sync_collection(self, collection_name: str):
+        self._enqueue((NeighborReplicator.SYNC_COLLECTION, collection_name))
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'in_flight': self._stream.in_flight,
+            'sent_documents': self._sent_documents,
+            'synced_collections': self._synced_collections,
+            'skipped_tasks': self._skipped_tasks,
+            'compression': self._neigh.compression.value,
+            'raw_bytes': self._raw_bytes,
+            'sent_bytes': self._sent_bytes,
+            'compression_ratio': self._raw_bytes / self._sent_bytes if self._sent_bytes > 0 else 1.0,
+            'compression_cpu_time': self._compression_cpu_time,
+        }
+
+    def is_available(self) -> bool:
+        return self._detector.is_available()
+
+    def liveness(self) -> dict:
+        return {
+            'available': self._detector.is_available(),
+            'phi': self._detector.phi(),
+            'since_last_heartbeat': self._detector.since_last_heartbeat(),
+        }
+
+    def on_heartbeat(self):
+        was_available = self._detector.is_available()
+        self._detector.heartbeat()
+        if was_available:
+            return
+
+        logging.info(f"Neighbor {self._neigh.snapshot_receiver} is available again")
+        for collection_name in list(self._db_core.collections.keys()):
+            self.sync_collection(collection_name)
+
+    def _enqueue(self, task: tuple):
+        with self._pending_lock:
+            if task in self._pending:
                 return
+            self._pending.add(task)
+
+        self._queue.put(task)
 
-            sbf, ph2 = sbf_and_ph2
-            local_snapshot = Snapshot(sbf, ph2)
+    def _processing(self):
+        while True:
+            try:
+                task = self._queue.get(timeout=NeighborReplicator.RESEND_INTERVAL)
+            except Empty:
+                self._resend_documents()
+                continue
+
+            with self._pending_lock:
+                self._pending.discard(task)
+
+            if not self._detector.is_available():
+                self._skipped_tasks += 1
+                continue
+
+            try:
+                if task[0] == NeighborReplicator.PUSH_DOCUMENT:
+                    _, collection_name, doc_id = task
+                    self._push_document(self._db_core.get_collection_safely(collection_name), doc_id)
+                else:
+                    _, collection_name = task
+                    self._sync_collection(self._db_core.get_collection_safely(collection_name))
+            except Exception as e:
+                logging.warning(f"Replication of {task} to {self._neigh.document_receiver} failed: {e}")
+
+    def _resend_documents(self):
+        # the documents which the neighbor did not ack are sent again when no new ones come
+        if self._stream.in_flight == 0 or not self._detector.is_available():
+            return
+
+        try:
+            self._stream.resend()
+        except Exception as e:
+            logging.warning(f"Documents are not sent again to {self._neigh.document_receiver}: {e}")
+
+    def _push_document(self, collection: CollectionOperations, doc_id: str):
+        data, updated_at = collection.read_document_with_updated_at(doc_id)
+        self._send_document(CollectionName(collection.name), doc_id, Document(data), updated_at)
 
-            if bytes(local_snapshot.get()) == snapshot:
-                self._socket.sendto(AAEAnswererWorker.TERMINATION_PAYLOAD, addr_port)
+    def _sync_collection(self, collection: CollectionOperations):
+        tree = collection.get_merkle_tree()
+        leaves = self._differing_leaves(collection)
+        if leaves is None:
+            return
+
+        doc_ids = list()
+        for leaf in leaves:
+            doc_ids.extend(tree.doc_ids(leaf))
+
+        for i in range(0, len(doc_ids), AAECheckSnapshots.MAX_COUNT):
+            self._check_documents(doc_ids[i:i + AAECheckSnapshots.MAX_COUNT], collection)
+
+        self._synced_collections += 1
+
+    def _differing_leaves(self, collection: CollectionOperations):
+        """Leaves of the Merkle tree which differ from the neighbor's ones, None if the neighbor does not answer"""
+        tree = collection.get_merkle_tree()
+
+        differing = [0]
+        for level in range(tree.depth):
+            next_differing = list()
+            for index in differing:
+                node = self._request_merkle_node(collection.name, level, index)
+                if node is None:
+                    return None
+
+                # the equal replicas are compared by one message
+                if level == 0 and node.node_hash == tree.root():
+                    return list()
+
+                local_children = tree.children(level, index)
+                for i, (local_child, remote_child) in enumerate(zip(local_children, node.children)):
+                    if local_child != remote_child:
+                        next_differing.append(index * tree.fanout + i)
+
+            differing = next_differing
+
+        return differing
+
+    @property
+    def snapshot_receiver(self) -> tuple:
+        return self._neigh.snapshot_receiver.addr, self._neigh.snapshot_receiver.port
+
+    def _request_merkle_node(self, collection_name: str, level: int, index: int):
+        self._socket.sendto(AAERequestMerkleNode(collection_name, level, index).get(), self.snapshot_receiver)
+
+        while True:
+            try:
+                payload, _ = self._socket.recvfrom(_datagram_size)
+            except socket.timeout:
                 return None
 
-            local_timestamp = collection.get_updated_at(DocumentId(doc_id))
-            send_timestamp(local_timestamp)
+            if payload[0] != AAEOperationType.SENDING_MERKLE_NODE.value:
+                continue
+
+            # late answers to the previous requests are skipped
+            node = AAEMerkleNode.parse(payload)
+            if node.level == level and node.index == index:
+                return node
+
+    def _check_documents(self, doc_ids: list, collection: CollectionOperations):
+        """Sends the snapshots of the documents by one message, the documents which are newer here are pushed"""
+        snapshots = list()
+        for doc_id in doc_ids:
+            snapshot = collection.get_snapshot(doc_id)
+            if snapshot is not None:
+                snapshots.append((doc_id, snapshot))
+
+        if len(snapshots) == 0:
+            return
+
+        request = AAECheckSnapshots(next(self._request_ids) % (1 << 32), collection.name, snapshots)
+        self._socket.sendto(request.get(), self.snapshot_receiver)
+
+        answer = None
+        while answer is None:
+            try:
+                payload, _ = self._socket.recvfrom(_datagram_size)
+            except socket.timeout:
+                return
+
+            # late answers to the previous requests are skipped
+            if payload[0] != AAEOperationType.SENDING_DIFFERING.value:
+                continue
+
+            differing = AAEDifferingSnapshots.parse(payload)
+            if differing.request_id == request.request_id:
+                answer = differing
+
+        for doc_id, timestamp in answer.timestamps:
+            local_timestamp = collection.get_updated_at(doc_id)
+            if timestamp is None or local_timestamp > timestamp:
+                self._push_document(collection, doc_id)
+
+    def _send_document(self, collection: CollectionName, doc_id: DocumentId, doc: Document, updated_at: datetime):
+        bytes_to_send = bytearray()
+        collection_name_encoded = collection.name.encode('utf-8')
+        collection_name_len = len(collection_name_encoded)
+        collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES,
+                                                                   DRIVER_BYTEORDER, signed=False)
+        doc_id_encoded = encode_document_id(doc_id)
+        updated_at_encoded = datetime.strftime(updated_at, DocumentId.UTC_FORMAT).encode('utf-8')
+
+        bytes_to_send.extend(collection_name_len_encoded)
+        bytes_to_send.extend(collection_name_encoded)
+        bytes_to_send.extend(doc_id_encoded)
+        bytes_to_send.extend(updated_at_encoded)
+        bytes_to_send.extend(doc.document.encode('utf-8'))
+
+        payload, flags = self._compress(bytes(bytes_to_send))
+        self._stream.send(payload, flags)
+        self._sent_documents += 1
+        self._raw_bytes += len(bytes_to_send)
+        self._sent_bytes += len(payload)
+
+    def _compress(self, payload: bytes) -> tuple:
+        """Returns the payload to send and its frame flags"""
+        compression = self._neigh.compression
+        if compression == Compression.NONE or len(payload) < self._neigh.compression_threshold:
+            return payload, 0
+
+        started_at = time.thread_time()
+        compressed = compression.compress(payload)
+        self._compression_cpu_time += time.thread_time() - started_at
+
+        # the incompressible documents are sent as is
+        if len(compressed) >= len(payload):
+            return payload, 0
+
+        return compressed, compression.frame_flag
 
 
 class ActiveAntiEntropy(Subscriber):
+    """Replicates the documents to the neighbors
+
+    Every neighbor is served by own NeighborReplicator. The changed documents are pushed to all of them right away,
+    besides, the Merkle trees of the collections are compared with every neighbor once per PASS_INTERVAL.
+    The neighbors are probed by the heartbeats on the snapshot port, the suspected ones are probed
+    with the exponential backoff up to MAX_HEARTBEAT_INTERVAL.
+    """
+    PASS_INTERVAL = 1.0
+    HEARTBEAT_INTERVAL = 0.5
+    MAX_HEARTBEAT_INTERVAL = 8.0
+    # the heartbeats are matched with the acks by the sequence, the lost ones are forgotten
+    MAX_OUTSTANDING_HEARTBEATS = 1024
+    APPLY_LOCKS = 64
 
     def __init__(self, config: AAEConfig, db_engine: DBOperationEngine):
         self._conf = config
@@ -273,7 +951,9 @@ class ActiveAntiEntropy(Subscriber):
         self._db_engine = db_engine
         self._db_core = db_engine.db_core
 
-        self._doc_receiver = DocumentReceiver(self._conf.current.document_receiver.port)
+        self._doc_receiver = DocumentReceiver(self._conf.current.document_receiver.port, self._on_received_documents)
+        # the same document is not applied by two appliers at once
+        self._apply_locks = [threading.Lock() for _ in range(ActiveAntiEntropy.APPLY_LOCKS)]
         self._snapshot_receiver = AAEAnswererWorker(
             self._conf.current.snapshot_receiver.addr, self._conf.current.snapshot_receiver.port,
             self._db_core, self._conf.neighbors
@@ -282,6 +962,11 @@ class ActiveAntiEntropy(Subscriber):
         self._document_event_queue = Queue()
         self._collection_event_queue = Queue()
 
+        self._replicators = [
+            NeighborReplicator(neigh, self._db_core, ActiveAntiEntropy.HEARTBEAT_INTERVAL)
+            for neigh in self._conf.neighbors
+        ]
+
         def snapshot_receiver_handler():
             while True:
                 try:
@@ -295,10 +980,10 @@ class ActiveAntiEntropy(Subscriber):
 
         def document_receiver_handler():
             while True:
-                doc_and_metadata = self._doc_receiver.get_document_and_metadata()
-                if doc_and_metadata is not None:
-                    collection, doc_id, doc, updated_at = self._parse_document_and_metadata(doc_and_metadata)
-                    self._on_received_doc(collection, doc_id, doc, updated_at)
+                try:
+                    self._doc_receiver.accept_stream()
+                except Exception as e:
+                    logging.warning(e)
 
         doc_receiver = threading.Thread(target=document_receiver_handler, args=())
         doc_receiver.start()
@@ -315,118 +1000,110 @@ class ActiveAntiEntropy(Subscriber):
             # self._collection_event_queue.put(event)
             return
 
-    def processing(self):
-        def process_queue():
-            if self._document_event_queue.qsize() == 0:
-                return False
+    def stats(self) -> dict:
+        """Replication state per neighbor, the neighbors are named by their document receivers"""
+        res = dict()
+        for replicator in self._replicators:
+            receiver = replicator.neighbor.document_receiver
+            res[f'{receiver.addr}:{receiver.port}'] = replicator.stats()
 
-            by_doc_id = dict()
-            while self._document_event_queue.qsize() > 0:
-                ev: DocumentOrientedEvent = self._document_event_queue.get()
-                doc_id = str(ev.document_id)
-                by_doc_id[doc_id] = ev
-
-            for doc_id, ev in by_doc_id.items():
-                collection = self._db_core.collections[ev.collection.name]
-                self._broadcast_document(ev.document_id, collection)
-
-            return True
+        return res
 
-        def iteration():
-            process_queue()
+    def liveness(self) -> dict:
+        """Failure detector state per neighbor, the neighbors are named by their document receivers"""
+        res = dict()
+        for replicator in self._replicators:
+            receiver = replicator.neighbor.document_receiver
+            res[f'{receiver.addr}:{receiver.port}'] = replicator.liveness()
 
-            for collection in self._db_core.collections.values():
-                doc_ids = collection.doc_ids()
+        return res
 
-                while len(doc_ids) > 0:
-                    if process_queue():
-                        continue
+    def processing(self):
+        for replicator in self._replicators:
+            replicator.start()
 
-                    doc_id: DocumentId = doc_ids.pop()
-                    self._broadcast(doc_id, collection)
+        heartbeats = threading.Thread(target=self._heartbeating, daemon=True)
+        heartbeats.start()
 
+        next_pass = time.monotonic()
         while True:
             try:
-                iteration()
-            except Exception as e:
-                logging.warning(e)
+                try:
+                    ev = self._document_event_queue.get(timeout=max(0.0, next_pass - time.monotonic()))
+                    self._dispatch(ev)
+                except Empty:
+                    pass
 
-    def _send_document(self, receiver_addr_port: tuple, collection: CollectionName, doc_id: DocumentId, doc: Document, updated_at: datetime):
-        bytes_to_send = bytearray()
-        collection_name_encoded = collection.name.encode('utf-8')
-        collection_name_len = len(collection_name_encoded)
-        collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES,
-                                                                   DRIVER_BYTEORDER, signed=False)
-        doc_id_encoded = str(doc_id).encode('utf-8')
-        updated_at_encoded = datetime.strftime(updated_at, DocumentId.UTC_FORMAT).encode('utf-8')
+                if time.monotonic() >= next_pass:
+                    for collection_name in list(self._db_core.collections.keys()):
+                        for replicator in self._replicators:
+                            replicator.sync_collection(collection_name)
 
-        bytes_to_send.extend(collection_name_len_encoded)
-        bytes_to_send.extend(collection_name_encoded)
-        bytes_to_send.extend(doc_id_encoded)
-        bytes_to_send.extend(updated_at_encoded)
-        bytes_to_send.extend(doc.document.encode('utf-8'))
+                    next_pass = time.monotonic() + ActiveAntiEntropy.PASS_INTERVAL
+            except Exception as e:
+                logging.warning(e)
 
-        send_message_to(
-            receiver_addr_port,
-            bytes_to_send
-        )
+    def _heartbeating(self):
+        sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        sequences = itertools.count(1)
+        outstanding = dict()
 
-    def _broadcast_document(self, doc_id: DocumentId, collection: CollectionOperations):
-        data, updated_at = collection.read_document_with_updated_at(doc_id)
-        _json = json.loads(data)
-
-        for neigh in self._conf.neighbors:
-            self._send_document(
-                (neigh.document_receiver.addr, neigh.document_receiver.port),
-                CollectionName(collection.name),
-                doc_id,
-                Document(data),
-                updated_at
-            )
+        intervals = {replicator: ActiveAntiEntropy.HEARTBEAT_INTERVAL for replicator in self._replicators}
+        next_heartbeats = {replicator: time.monotonic() for replicator in self._replicators}
 
-    def _broadcast(self, doc_id: DocumentId, collection: CollectionOperations):
-        sbf_and_ph2 = collection.get_snapshot(doc_id)
-        sbf, ph2 = sbf_and_ph2
-        snapshot = Snapshot(sbf, ph2)
-        check_snapshot = AAECheckSnapshot(collection.name, str(doc_id), snapshot)
-        b_check_snapshot = check_snapshot.get()
+        while True:
+            try:
+                now = time.monotonic()
+                for replicator in self._replicators:
+                    if next_heartbeats[replicator] > now:
+                        continue
 
-        for neigh in self._conf.neighbors:
-            receiver_addr_port = (neigh.snapshot_receiver.addr, neigh.snapshot_receiver.port)
+                    sequence = next(sequences) % (1 << 32)
+                    outstanding[sequence] = replicator
+                    if len(outstanding) > ActiveAntiEntropy.MAX_OUTSTANDING_HEARTBEATS:
+                        del outstanding[next(iter(outstanding))]
 
-            sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+                    heartbeat = AAEHeartbeat(AAEOperationType.HEARTBEAT, sequence)
+                    sock.sendto(heartbeat.get(), replicator.snapshot_receiver)
 
-            sock.settimeout(_timeout)
+                    if replicator.is_available():
+                        intervals[replicator] = ActiveAntiEntropy.HEARTBEAT_INTERVAL
+                    else:
+                        intervals[replicator] = min(intervals[replicator] * 2, ActiveAntiEntropy.MAX_HEARTBEAT_INTERVAL)
+                    next_heartbeats[replicator] = now + intervals[replicator]
 
-            sock.sendto(b_check_snapshot,
-                        receiver_addr_port
-                        )
+                if len(self._replicators) == 0:
+                    return
 
-            try:
-                payload, server_addr_port = sock.recvfrom(48)
-            except socket.timeout:
-                continue
-            resp_type = AAEOperationType.get_by_value(payload[0])
+                sock.settimeout(max(min(next_heartbeats.values()) - time.monotonic(), 0.001))
+                try:
+                    payload, _ = sock.recvfrom(_datagram_size)
+                except (socket.timeout, ConnectionRefusedError):
+                    # the refusal of the dead neighbor is reported by the next receiving
+                    continue
 
-            if resp_type == AAEOperationType.TERMINATE_SESSION:
-                continue
+                ack = AAEHeartbeat.parse(payload)
+                replicator = outstanding.pop(ack.sequence, None)
+                if ack.operation_type == AAEOperationType.HEARTBEAT_ACK and replicator is not None:
+                    replicator.on_heartbeat()
+            except Exception as e:
+                logging.warning(e)
 
-            if resp_type == AAEOperationType.SENDING_TIMESTAMP:
-                b_timestamp = payload[1:]
-                s_timestamp = b_timestamp.decode()
-                timestamp = datetime.strptime(s_timestamp, DocumentId.UTC_FORMAT)
+    def _dispatch(self, ev: Event):
+        if isinstance(ev, DocumentsBatchOrientedEvent):
+            doc_ids = ev.document_ids
+        else:
+            doc_ids = [ev.document_id]
 
-                local_timestamp = collection.get_updated_at(doc_id)
-                if local_timestamp > timestamp:
-                    recv_doc_addr_port = (neigh.document_receiver.addr, neigh.document_receiver.port)
-                    data, updated_at = collection.read_document_with_updated_at(doc_id)
-                    self._send_document(recv_doc_addr_port, CollectionName(collection.name), doc_id, Document(data), updated_at)
+        for doc_id in doc_ids:
+            for replicator in self._replicators:
+                replicator.push_document(ev.collection.name, str(doc_id))
 
     @staticmethod
     def _parse_document_and_metadata(src: bytearray):
         # FORMAT
         # |COLLECTION_NAME_LENGTH|COLLECTION_NAME|  DOC_ID  |UPDATED_AT| DOCUMENT |
-        #           1byte             1-255bytes   26bytes      26bytes    Xbytes
+        #           1byte             1-255bytes   16bytes      26bytes    Xbytes
         collection_name_length_bytes = src[:DRIVER_COLLECTION_NAME_LENGTH_BYTES:1]
         src = src[DRIVER_COLLECTION_NAME_LENGTH_BYTES::]
 
@@ -437,9 +1114,7 @@ class ActiveAntiEntropy(Subscriber):
 
         src = src[collection_name_length::]
 
-        doc_id_bytes = src[:DRIVER_DOCUMENT_ID_LENGTH:]
-        doc_id = doc_id_bytes.decode('utf-8')
-        doc_id = DocumentId(doc_id)
+        doc_id = DocumentId.from_bytes(bytes(src[:DRIVER_DOCUMENT_ID_LENGTH:]))
 
         src = src[DRIVER_DOCUMENT_ID_LENGTH::]
 
@@ -455,6 +1130,27 @@ class ActiveAntiEntropy(Subscriber):
 
         return collection_name, doc_id, doc, updated_at
 
+    def _on_received_documents(self, payloads: list):
+        # the batch is not acked if a document is not applied, the sender sends it again
+        failed = list()
+        for payload in payloads:
+            try:
+                collection, doc_id, doc, updated_at = self._parse_document_and_metadata(payload)
+            except Exception as e:
+                # the broken document is not applied by any attempt
+                logging.warning(f"Received document is skipped: {e}")
+                continue
+
+            try:
+                with self._apply_locks[hash((collection.name, str(doc_id))) % len(self._apply_locks)]:
+                    self._on_received_doc(collection, doc_id, doc, updated_at)
+            except Exception as e:
+                logging.warning(f"Received document {collection.name}/{doc_id} is not applied: {e}")
+                failed.append(e)
+
+        if len(failed) > 0:
+            raise Exception(f"{len(failed)} of {len(payloads)} received documents are not applied: {failed[0]}")
+
     def _on_received_doc(self, collection: CollectionName, doc_id: DocumentId, doc: Document, updated_at: datetime):
         db_collection: CollectionOperations = self._db_core.get_collection_safely(collection.name)
         filename = str(doc_id)
@@ -0,0 +1,55 @@
+"""Measures the snapshot hashing of the documents: python -m benchmark.snapshot"""
+import random
+import timeit
+
+from algorithms import ph2, spectral_bloom_filter
+from algorithms.ph2 import hashing_python, hashing_numpy
+from algorithms.spectral_bloom_filter import SpectralBloomFilter
+
+SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+
+
+def measure(func, src: bytes) -> float:
+    runs = max(1, min(100, (1024 * 1024) // len(src)))
+    return min(timeit.repeat(lambda: func(src), number=runs, repeat=3)) / runs
+
+
+def add_to_sbf(src: bytes):
+    SpectralBloomFilter().add(src)
+
+
+def add_to_sbf_without_numpy(src: bytes):
+    numpy = spectral_bloom_filter.numpy
+    spectral_bloom_filter.numpy = None
+    try:
+        add_to_sbf(src)
+    finally:
+        spectral_bloom_filter.numpy = numpy
+
+
+def main():
+    rnd = random.Random(7)
+    print('PH2')
+    print(f'{"size":>10} {"python, ms":>12} {"numpy, ms":>12} {"speedup":>8}')
+    for size in SIZES:
+        src = rnd.randbytes(size)
+        python_time = measure(hashing_python, src)
+        if ph2.numpy is None:
+            print(f'{size:>10} {python_time * 1000:>12.3f} {"-":>12} {"-":>8}')
+            continue
+
+        numpy_time = measure(hashing_numpy, src)
+        print(f'{size:>10} {python_time * 1000:>12.3f} {numpy_time * 1000:>12.3f} {python_time / numpy_time:>7.0f}x')
+
+    print('SBF')
+    print(f'{"size":>10} {"counter, ms":>12} {"numpy, ms":>12}')
+    for size in SIZES:
+        src = rnd.randbytes(size)
+        counter_time = measure(add_to_sbf_without_numpy, src)
+        numpy_time = measure(add_to_sbf, src) if spectral_bloom_filter.numpy is not None else None
+        numpy_column = f'{numpy_time * 1000:>12.3f}' if numpy_time is not None else f'{"-":>12}'
+        print(f'{size:>10} {counter_time * 1000:>12.3f} {numpy_column}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,12 @@
+import asyncio
+import itertools
 import json
 import math
 import socket
+import struct
+import threading
+from concurrent.futures import Future
+from queue import Queue, Full, Empty
 from enum import Enum
 
 from autumn_db import DocumentId
@@ -9,7 +15,27 @@ DRIVER_OPERATION_LENGTH = 1
 DRIVER_COLLECTION_NAME_LENGTH_BYTES = 1
 DRIVER_COLLECTION_NAME_LENGTH_BYTES_MAX = 255
 DRIVER_BYTEORDER = 'big'
-DRIVER_DOCUMENT_ID_LENGTH = 26
+DRIVER_DOCUMENT_ID_LENGTH = DocumentId.LENGTH
+DRIVER_BATCH_COUNT_LENGTH = 4
+DRIVER_BATCH_ITEM_LENGTH = 4
+
+# FRAME format
+# |Version|OpCode|Flags|Request ID|Payload length|Payload|
+#   1byte  1byte 1byte   4bytes       4bytes      Xbytes
+# Request ID 0 means the sender does not expect the response
+# Version 3 sends the document IDs as DRIVER_DOCUMENT_ID_LENGTH bytes
+FRAME_VERSION = 3
+FRAME_HEADER = struct.Struct('!BBBII')
+FRAME_HEADER_LENGTH = FRAME_HEADER.size
+FRAME_MAX_PAYLOAD_LENGTH = 256 * 1024 * 1024
+FRAME_READ_CHUNK_SIZE = 64 * 1024
+
+FRAME_FLAG_ERROR = 0x01
+# the payload is compressed, the flag names the codec
+FRAME_FLAG_ZLIB = 0x02
+FRAME_FLAG_LZMA = 0x04
+# the response is streamed, more frames with the same request ID follow
+FRAME_FLAG_MORE = 0x08
 
 
 class DocumentOperation(Enum):
@@ -17,6 +43,12 @@ class DocumentOperation(Enum):
     UPDATE_DOC = 2
     DELETE_DOC = 3
     READ_DOC = 4
+    CREATE_DOCS = 5
+    READ_DOCS = 6
+    UPDATE_DOCS = 7
+    RANGE_SCAN = 8
+    SCAN = 9
+    QUERY = 10
 
 
 class CollectionOperation(Enum):
@@ -59,116 +91,616 @@ class Document:
         return self._doc
 
 
-def send_message_to(addr_port: tuple, message: bytes, expect_response: bool = False) -> bytearray:
+class Frame:
+
+    def __init__(self, opcode: int, payload: bytes = b'', flags: int = 0, request_id: int = 0):
+        self._opcode = opcode
+        self._payload = payload
+        self._flags = flags
+        self._request_id = request_id
+
+    @property
+    def opcode(self) -> int:
+        return self._opcode
+
+    @property
+    def flags(self) -> int:
+        return self._flags
+
+    @property
+    def payload(self) -> bytes:
+        return self._payload
+
+    @property
+    def request_id(self) -> int:
+        return self._request_id
+
+    def has_flag(self, flag: int) -> bool:
+        return self._flags & flag == flag
+
+    def encode(self) -> bytearray:
+        res = bytearray(
+            FRAME_HEADER.pack(FRAME_VERSION, self._opcode, self._flags, self._request_id, len(self._payload))
+        )
+        res.extend(self._payload)
+
+        return res
+
+    @staticmethod
+    def decode_header(header: bytes) -> tuple:
+        version, opcode, flags, request_id, payload_length = FRAME_HEADER.unpack(header)
+        if version != FRAME_VERSION:
+            raise Exception(f"Frame version {version} is not supported")
+
+        if payload_length > FRAME_MAX_PAYLOAD_LENGTH:
+            raise Exception(f"Frame payload length {payload_length} exceeds {FRAME_MAX_PAYLOAD_LENGTH} bytes")
+
+        return opcode, flags, request_id, payload_length
+
+
+class FrameReader:
+    """Reads whole frames from the socket with a few large recv_into calls"""
+
+    def __init__(self, sock: socket.socket, chunk_size: int = FRAME_READ_CHUNK_SIZE):
+        self._socket = sock
+        self._chunk = bytearray(chunk_size)
+        self._chunk_view = memoryview(self._chunk)
+        self._pending = bytearray()
+
+    @property
+    def buffered(self) -> int:
+        """Number of the received bytes which are not read yet"""
+        return len(self._pending)
+
+    def read_frame(self):
+        header = self._read_exactly(FRAME_HEADER_LENGTH)
+        if header is None:
+            return None
+
+        opcode, flags, request_id, payload_length = Frame.decode_header(header)
+
+        payload = self._read_exactly(payload_length)
+        if payload is None:
+            raise Exception('Connection is closed in the middle of the frame')
+
+        return Frame(opcode, payload, flags, request_id)
+
+    def _read_exactly(self, size: int):
+        res = bytearray(size)
+        view = memoryview(res)
+
+        received = min(size, len(self._pending))
+        view[:received] = self._pending[:received]
+        del self._pending[:received]
+
+        while received < size:
+            left = size - received
+            if left >= len(self._chunk):
+                # large payload is received directly to the result without extra copying
+                count = self._socket.recv_into(view[received:])
+                if count == 0:
+                    return self._on_closed(received)
+
+                received += count
+                continue
+
+            count = self._socket.recv_into(self._chunk_view)
+            if count == 0:
+                return self._on_closed(received)
+
+            used = min(left, count)
+            view[received:received + used] = self._chunk_view[:used]
+            self._pending.extend(self._chunk_view[used:count])
+            received += used
+
+        return res
+
+    @staticmethod
+    def _on_closed(received: int):
+        if received == 0:
+            return None
+
+        raise Exception('Connection is closed in the middle of the frame')
+
+
+async def read_frame_async(reader):
+    """The same as FrameReader.read_frame but for asyncio.StreamReader"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER_LENGTH)
+    except asyncio.IncompleteReadError as e:
+        if len(e.partial) == 0:
+            return None
+        raise
+
+    opcode, flags, request_id, payload_length = Frame.decode_header(header)
+    payload = await reader.readexactly(payload_length)
+
+    return Frame(opcode, payload, flags, request_id)
+
+
+def encode_collection_name(collection: CollectionName) -> bytearray:
+    collection_name_bytes = collection.name.encode('utf-8')
+
+    collection_name_len = len(collection_name_bytes)
+    collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES, DRIVER_BYTEORDER,
+                                                               signed=False)
+
+    res = bytearray(collection_name_len_encoded)
+    res.extend(collection_name_bytes)
+
+    return res
+
+
+# BATCH format
+# |Items count|Item length|Item  |...|Item length|Item  |
+#    4bytes      4bytes    Xbytes        4bytes   Xbytes
+def encode_batch_items(items: list) -> bytearray:
+    res = bytearray(len(items).to_bytes(DRIVER_BATCH_COUNT_LENGTH, DRIVER_BYTEORDER, signed=False))
+    for item in items:
+        res.extend(len(item).to_bytes(DRIVER_BATCH_ITEM_LENGTH, DRIVER_BYTEORDER, signed=False))
+        res.extend(item)
+
+    return res
+
+
+def decode_batch_items(src: bytes) -> list:
+    src = memoryview(src)
+
+    count = int.from_bytes(src[:DRIVER_BATCH_COUNT_LENGTH], DRIVER_BYTEORDER, signed=False)
+    offset = DRIVER_BATCH_COUNT_LENGTH
+
+    res = list()
+    for _ in range(count):
+        item_length = int.from_bytes(src[offset:offset + DRIVER_BATCH_ITEM_LENGTH], DRIVER_BYTEORDER, signed=False)
+        offset += DRIVER_BATCH_ITEM_LENGTH
+
+        if offset + item_length > len(src):
+            raise Exception('Batch item exceeds the message')
+
+        res.append(bytes(src[offset:offset + item_length]))
+        offset += item_length
+
+    return res
+
+
+def encode_document_id(doc_id) -> bytes:
+    """The document ID could be DocumentId or its string form"""
+    if not isinstance(doc_id, DocumentId):
+        doc_id = DocumentId(str(doc_id))
+
+    return doc_id.to_bytes()
+
+
+def decode_document_id(src: bytes) -> str:
+    return str(DocumentId.from_bytes(bytes(src)))
+
+
+def send_message_to(addr_port: tuple, opcode: int, payload: bytes, expect_response: bool = False,
+                    flags: int = 0) -> bytes:
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect(addr_port)
-    s.sendall(message)
+    s.sendall(Frame(opcode, payload, flags, request_id=1 if expect_response else 0).encode())
 
     resp = None
     if expect_response:
-        resp = bytearray()
-        while True:
-            part = s.recv(1)
-            if not part or part == b'\x00':
-                break
+        frame = FrameReader(s).read_frame()
+        if frame is None:
+            raise Exception(f"Connection to {addr_port} is closed without response")
+
+        if frame.has_flag(FRAME_FLAG_ERROR):
+            raise Exception(frame.payload.decode('utf-8'))
 
-            resp.extend(part)
+        resp = frame.payload
 
     s.close()
     return resp
 
 
-class DBDriver:
+class FrameStream:
+    """Payloads of the streamed response, get() returns None at the end of the stream and the exception which breaks it
 
-    def __init__(self, addr: str, port: int = 50000):
-        self._addr = addr
-        self._port = port
+    The buffer is bounded: while it is full the connection is not read, so the server is slowed down by TCP
+    instead of the client buffering the whole response.
+    """
+    BUFFER_FRAMES = 4
+    PUT_CHECK_INTERVAL = 0.5
 
-    def create_collection(self, name: CollectionName):
-        pass
+    def __init__(self, connection):
+        self._connection = connection
+        self._frames = Queue(maxsize=FrameStream.BUFFER_FRAMES)
+        self._is_finished = False
 
-    def create_document(self, collection: CollectionName, doc: Document):
+    def get(self, timeout: float = None):
+        res = self._frames.get(timeout=timeout)
+        if res is None or isinstance(res, Exception):
+            self._is_finished = True
+
+        return res
 
-        oper_bytes = DocumentOperation.CREATE_DOC.value.to_bytes(DRIVER_OPERATION_LENGTH, DRIVER_BYTEORDER, signed=False)
+    def close(self):
+        """Cancels the stream which is not read to the end, its connection is closed so the server stops sending"""
+        if not self._is_finished:
+            self._is_finished = True
+            self._connection.close()
+
+    def _put(self, payload):
+        # the reader waits for the consumer, but not after the connection is closed
+        while not self._connection.is_closed:
+            try:
+                self._frames.put(payload, timeout=FrameStream.PUT_CHECK_INTERVAL)
+                return
+            except Full:
+                continue
+
+    def _break(self, reason: Exception):
+        # the buffered frames are dropped, the consumer gets the reason right away
+        while True:
+            try:
+                self._frames.put_nowait(reason)
+                return
+            except Full:
+                try:
+                    self._frames.get_nowait()
+                except Empty:
+                    pass
+
+
+class PooledConnection:
+    """Keep-alive connection which pipelines the requests and matches the responses by request ID
+
+    The streamed response is read frame by frame by FrameStream. The full stream buffer stops the reading
+    of the connection, so the pool does not send other requests by the connection with the stream.
+    """
+
+    def __init__(self, addr_port: tuple, timeout: float = None):
+        self._socket = socket.create_connection(addr_port, timeout=timeout)
+        self._socket.settimeout(None)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        self._lock = threading.Lock()
+        self._pending = dict()
+        self._streams = 0
+        # requests which the pool routed to the connection but which are not sent yet
+        self._reserved = 0
+        self._request_ids = itertools.count(1)
+        self._is_closed = False
+
+        self._reader = threading.Thread(target=self._receiving, args=(), daemon=True)
+        self._reader.start()
 
-        collection_name_bytes = collection.name.encode('utf-8')
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending) + self._reserved
 
-        collection_name_len = len(collection_name_bytes)
-        collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES, DRIVER_BYTEORDER, signed=False)
+    @property
+    def is_closed(self) -> bool:
+        return self._is_closed
 
-        doc_bytes = doc.document.encode('utf-8')
+    @property
+    def has_streams(self) -> bool:
+        return self._streams > 0
+
+    def submit(self, opcode: int, payload: bytes, reserved: bool = False) -> Future:
+        future = Future()
+        self._send(opcode, payload, future, reserved)
+
+        return future
+
+    def submit_stream(self, opcode: int, payload: bytes, reserved: bool = False) -> FrameStream:
+        frames = FrameStream(self)
+        self._send(opcode, payload, frames, reserved)
+
+        return frames
+
+    def _reserve(self, for_stream: bool):
+        # the pool reserves the connection while it chooses it, so the stream does not share it with the request
+        with self._lock:
+            self._reserved += 1
+            if for_stream:
+                self._streams += 1
+
+    def _send(self, opcode: int, payload: bytes, waiter, reserved: bool = False):
+        with self._lock:
+            if reserved:
+                self._reserved -= 1
+            if self._is_closed:
+                raise Exception('Connection is closed')
+
+            # request ID is 4 bytes long and 0 is reserved for the requests without response, it is skipped on wrap
+            request_id = 0
+            while request_id == 0:
+                request_id = next(self._request_ids) % (1 << 32)
+            self._pending[request_id] = waiter
+            if isinstance(waiter, FrameStream) and not reserved:
+                self._streams += 1
+
+            try:
+                self._socket.sendall(Frame(opcode, payload, request_id=request_id).encode())
+            except Exception as e:
+                self._close(e)
+                raise
+
+    def close(self):
+        with self._lock:
+            self._close(Exception('Connection is closed'))
+
+    def _close(self, reason: Exception):
+        if self._is_closed:
+            return
 
-        _bytes = list()
-        for b in oper_bytes:
-            _bytes.append(b)
+        self._is_closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+        pending = self._pending
+        self._pending = dict()
+        self._streams = 0
+        for waiter in pending.values():
+            if isinstance(waiter, FrameStream):
+                waiter._break(reason)
+            elif not waiter.done():
+                waiter.set_exception(reason)
+
+    def _receiving(self):
+        reader = FrameReader(self._socket)
+        try:
+            while True:
+                frame = reader.read_frame()
+                if frame is None:
+                    raise Exception('Connection is closed by the server')
+
+                # the error frame ends the stream as well
+                is_last = not frame.has_flag(FRAME_FLAG_MORE) or frame.has_flag(FRAME_FLAG_ERROR)
+                with self._lock:
+                    if is_last:
+                        waiter = self._pending.pop(frame.request_id, None)
+                        if isinstance(waiter, FrameStream):
+                            self._streams -= 1
+                    else:
+                        waiter = self._pending.get(frame.request_id)
+
+                if waiter is None:
+                    continue
+
+                if isinstance(waiter, FrameStream):
+                    if frame.has_flag(FRAME_FLAG_ERROR):
+                        waiter._put(Exception(frame.payload.decode('utf-8')))
+                        continue
+
+                    waiter._put(frame.payload)
+                    if is_last:
+                        waiter._put(None)
+                elif frame.has_flag(FRAME_FLAG_ERROR):
+                    waiter.set_exception(Exception(frame.payload.decode('utf-8')))
+                else:
+                    waiter.set_result(frame.payload)
+        except Exception as e:
+            with self._lock:
+                self._close(e)
+
+
+class ConnectionPool:
+
+    def __init__(self, addr_port: tuple, max_connections: int = 4, connect_timeout: float = 5.0):
+        self._addr_port = addr_port
+        self._max_connections = max_connections
+        self._connect_timeout = connect_timeout
+
+        self._lock = threading.Lock()
+        self._connections = list()
+
+    def submit(self, opcode: int, payload: bytes) -> Future:
+        return self._acquire().submit(opcode, payload, reserved=True)
+
+    def submit_stream(self, opcode: int, payload: bytes) -> FrameStream:
+        return self._acquire(for_stream=True).submit_stream(opcode, payload, reserved=True)
+
+    def _acquire(self, for_stream: bool = False) -> PooledConnection:
+        with self._lock:
+            self._connections = [conn for conn in self._connections if not conn.is_closed]
+            # the connection with the stream is read as fast as its consumer reads, it is not shared
+            shared = [conn for conn in self._connections if not conn.has_streams]
+
+            least_loaded = min(shared, key=lambda conn: conn.in_flight, default=None)
+            if least_loaded is not None:
+                if least_loaded.in_flight == 0 or (not for_stream and len(shared) >= self._max_connections):
+                    least_loaded._reserve(for_stream)
+                    return least_loaded
+
+            conn = PooledConnection(self._addr_port, self._connect_timeout)
+            conn._reserve(for_stream)
+            self._connections.append(conn)
+
+            return conn
+
+    def close(self):
+        with self._lock:
+            connections = self._connections
+            self._connections = list()
+
+        for conn in connections:
+            conn.close()
 
-        for b in collection_name_len_encoded:
-            _bytes.append(b)
 
-        for b in collection_name_bytes:
-            _bytes.append(b)
+class DBDriver:
 
-        for b in doc_bytes:
-            _bytes.append(b)
+    def __init__(self, addr: str, port: int = 50000, max_connections: int = 4, timeout: float = None):
+        self._addr = addr
+        self._port = port
+        self._timeout = timeout
+        self._pool = ConnectionPool((addr, port), max_connections)
 
-        _bytes = bytearray(_bytes)
-        _bytes.extend(b'\x00')
+    def __enter__(self):
+        return self
 
-        doc_id_bytes = send_message_to(
-            (self._addr, self._port), _bytes, expect_response=True
-        )
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-        doc_id = doc_id_bytes.decode('utf-8')
-        return doc_id
+    def close(self):
+        self._pool.close()
 
-    def read_document(self, collection: CollectionName, doc_id: DocumentId):
-        oper_bytes = DocumentOperation.READ_DOC.value.to_bytes(DRIVER_OPERATION_LENGTH, DRIVER_BYTEORDER,
-                                                               signed=False)
+    def _request(self, opcode: DocumentOperation, payload: bytes) -> bytes:
+        # the driver is thread-safe, requests of several threads are pipelined on the pooled connections
+        future = self._pool.submit(opcode.value, payload)
+        return future.result(self._timeout)
 
-        collection_name_bytes = collection.name.encode('utf-8')
+    def create_collection(self, name: CollectionName):
+        pass
 
-        collection_name_len = len(collection_name_bytes)
-        collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES,
-                                                                   DRIVER_BYTEORDER, signed=False)
+    def create_document(self, collection: CollectionName, doc: Document):
+        # CREATE MESSAGE payload
+        # |Collection name length|Collection name|   Data   |
+        #          1byte             1-255bytes     Xbytes
+        _bytes = encode_collection_name(collection)
+        _bytes.extend(doc.document.encode('utf-8'))
 
-        doc_id_bytes = str(doc_id).encode('utf-8')
+        doc_id_bytes = self._request(DocumentOperation.CREATE_DOC, _bytes)
 
-        _bytes = bytearray()
+        doc_id = decode_document_id(doc_id_bytes)
+        return doc_id
 
-        _bytes.extend(oper_bytes)
-        _bytes.extend(collection_name_len_encoded)
-        _bytes.extend(collection_name_bytes)
-        _bytes.extend(doc_id_bytes)
-        _bytes.extend(b'\x00')
+    def read_document(self, collection: CollectionName, doc_id: DocumentId):
+        # READ MESSAGE payload
+        # |Collection name length|Collection name|Document ID|
+        #          1byte             1-255bytes     16bytes
+        _bytes = encode_collection_name(collection)
+        _bytes.extend(encode_document_id(doc_id))
 
-        doc_bytes = send_message_to(
-            (self._addr, self._port), _bytes, expect_response=True
-        )
+        doc_bytes = self._request(DocumentOperation.READ_DOC, _bytes)
 
         doc = doc_bytes.decode('utf-8')
         res = Document(doc)
         return res
 
     def update_document(self, collection: CollectionName, doc_id: DocumentId, doc: Document):
-        oper_bytes = DocumentOperation.UPDATE_DOC.value.to_bytes(DRIVER_OPERATION_LENGTH, DRIVER_BYTEORDER,
-                                                                 signed=False)
+        # UPDATE MESSAGE payload
+        # |Collection name length|Collection name|Document ID|   Data   |
+        #          1byte             1-255bytes     16bytes     Xbytes
+        _bytes = encode_collection_name(collection)
+        _bytes.extend(encode_document_id(doc_id))
+        _bytes.extend(doc.document.encode('utf-8'))
+
+        self._request(DocumentOperation.UPDATE_DOC, _bytes)
 
-        collection_name_bytes = collection.name.encode('utf-8')
+    def create_documents(self, collection: CollectionName, docs: list) -> list:
+        # CREATE DOCS MESSAGE payload
+        # |Collection name length|Collection name|Batch of documents|
+        #          1byte             1-255bytes         Xbytes
+        _bytes = encode_collection_name(collection)
+        _bytes.extend(encode_batch_items([doc.document.encode('utf-8') for doc in docs]))
 
-        collection_name_len = len(collection_name_bytes)
-        collection_name_len_encoded = collection_name_len.to_bytes(DRIVER_COLLECTION_NAME_LENGTH_BYTES,
-                                                                   DRIVER_BYTEORDER, signed=False)
+        response = self._request(DocumentOperation.CREATE_DOCS, _bytes)
 
-        doc_id_bytes = str(doc_id).encode('utf-8')
+        res = [decode_document_id(doc_id) for doc_id in decode_batch_items(response)]
+        return res
 
-        _bytes = bytearray()
+    def read_documents(self, collection: CollectionName, doc_ids: list) -> list:
+        # READ DOCS MESSAGE payload
+        # |Collection name length|Collection name|Batch of document IDs|
+        #          1byte             1-255bytes          Xbytes
+        _bytes = encode_collection_name(collection)
+        _bytes.extend(encode_batch_items([encode_document_id(doc_id) for doc_id in doc_ids]))
 
-        _bytes.extend(oper_bytes)
-        _bytes.extend(collection_name_len_encoded)
-        _bytes.extend(collection_name_bytes)
-        _bytes.extend(doc_id_bytes)
-        _bytes.extend(doc.document.encode('utf-8'))
+        response = self._request(DocumentOperation.READ_DOCS, _bytes)
 
-        send_message_to(
-            (self._addr, self._port), _bytes
-        )
+        res = [Document(doc.decode('utf-8')) for doc in decode_batch_items(response)]
+        return res
+
+    def scan_range(self, collection: CollectionName, start_id: DocumentId = None, end_id: DocumentId = None,
+                   limit: int = None):
+        """Generates (document ID, Document) from start_id inclusive to end_id exclusive in ascending order"""
+        # RANGE SCAN MESSAGE payload, zero IDs and zero limit mean no bound
+        # |Collection name length|Collection name|Start ID|End ID |Limit |
+        #          1byte             1-255bytes    16bytes 16bytes 4bytes
+        # the response is the frames with FRAME_FLAG_MORE but the last, each one is a batch of (Document ID + Data)
+        _bytes = encode_collection_name(collection)
+        for doc_id in (start_id, end_id):
+            _bytes.extend(encode_document_id(doc_id) if doc_id is not None else bytes(DRIVER_DOCUMENT_ID_LENGTH))
+        _bytes.extend((limit or 0).to_bytes(DRIVER_BATCH_COUNT_LENGTH, DRIVER_BYTEORDER, signed=False))
+
+        return self._receive_documents(DocumentOperation.RANGE_SCAN, _bytes)
+
+    def query(self, collection: CollectionName, filter: list, limit: int = None):
+        """Generates (document ID, Document) of the documents which match all predicates of the filter
+
+        The predicates are the same as of scan. The documents are found by the secondary index of the collection
+        if one serves the filter, otherwise the server scans the collection.
+        """
+        # QUERY MESSAGE payload, zero limit means no limit, the filter is the JSON list
+        # |Collection name length|Collection name|Limit |Filter|
+        #          1byte             1-255bytes   4bytes Xbytes
+        # the response is the frames with FRAME_FLAG_MORE but the last, each one is a batch of (Document ID + Data)
+        _bytes = encode_collection_name(collection)
+        _bytes.extend((limit or 0).to_bytes(DRIVER_BATCH_COUNT_LENGTH, DRIVER_BYTEORDER, signed=False))
+        _bytes.extend(json.dumps(filter).encode('utf-8'))
+
+        return self._receive_documents(DocumentOperation.QUERY, _bytes)
+
+    def _receive_documents(self, opcode: DocumentOperation, payload: bytes):
+        frames = self._pool.submit_stream(opcode.value, payload)
+        try:
+            while True:
+                payload = frames.get(timeout=self._timeout)
+                if payload is None:
+                    return
+
+                if isinstance(payload, Exception):
+                    raise payload
+
+                for item in decode_batch_items(payload):
+                    yield (decode_document_id(item[:DRIVER_DOCUMENT_ID_LENGTH]),
+                           Document(item[DRIVER_DOCUMENT_ID_LENGTH:].decode('utf-8')))
+        finally:
+            # the generator which is closed before the end of the stream cancels it
+            frames.close()
+
+    def scan(self, collection: CollectionName, filter: list = None, batch_size: int = 100):
+        """Generates (document ID, Document) of the documents which match all predicates of the filter
+
+        The predicate is the dict like {"path": "age", "gte": 18, "lt": 65}, {"path": "name", "eq": "Valerii"}
+        or {"path": "email", "exists": true}, the path is dot separated. The documents are evaluated by the server
+        and are received by the pages of batch_size documents at most, each page is requested by the cursor
+        returned with the previous one.
+        """
+        # SCAN MESSAGE payload, zero cursor is the start of the collection, the filter is the JSON list
+        # |Collection name length|Collection name|Cursor |Page size|Filter|
+        #          1byte             1-255bytes   16bytes  4bytes  Xbytes
+        # the response is the next cursor followed by the batch of (Document ID + Data), zero cursor ends the scan
+        header = encode_collection_name(collection)
+        b_filter = json.dumps(filter).encode('utf-8') if filter else b''
+
+        cursor = bytes(DRIVER_DOCUMENT_ID_LENGTH)
+        while True:
+            _bytes = bytearray(header)
+            _bytes.extend(cursor)
+            _bytes.extend(batch_size.to_bytes(DRIVER_BATCH_COUNT_LENGTH, DRIVER_BYTEORDER, signed=False))
+            _bytes.extend(b_filter)
+
+            response = self._request(DocumentOperation.SCAN, _bytes)
+
+            cursor = bytes(response[:DRIVER_DOCUMENT_ID_LENGTH])
+            for item in decode_batch_items(response[DRIVER_DOCUMENT_ID_LENGTH:]):
+                yield (decode_document_id(item[:DRIVER_DOCUMENT_ID_LENGTH]),
+                       Document(item[DRIVER_DOCUMENT_ID_LENGTH:].decode('utf-8')))
+
+            if not any(cursor):
+                return
+
+    def update_documents(self, collection: CollectionName, docs: list):
+        # UPDATE DOCS MESSAGE payload, each item of the batch is the document ID followed by the document
+        # |Collection name length|Collection name|Batch of (Document ID + Data)|
+        #          1byte             1-255bytes               Xbytes
+        items = list()
+        for doc_id, doc in docs:
+            item = bytearray(encode_document_id(doc_id))
+            item.extend(doc.document.encode('utf-8'))
+            items.append(item)
+
+        _bytes = encode_collection_name(collection)
+        _bytes.extend(encode_batch_items(items))
+
+        self._request(DocumentOperation.UPDATE_DOCS, _bytes)
@@ -0,0 +1,157 @@
+import datetime
+import threading
+import time
+import unittest
+
+# TODO we need this import to avoid circular import
+from autumn_db.autumn_db import DBCoreEngine
+
+from autumn_db.event_bus.active_anti_entropy import AAECheckSnapshots, AAEDifferingSnapshots, AAEMerkleNode, \
+    AAEHeartbeat, AAEOperationType, NeighborReplicator, NodeConfig, Compression, \
+    DocumentReceiver, DocumentStream
+
+doc_id = '2024_02_07_08_32_20_594746'
+updated_at = datetime.datetime(2024, 2, 7, 8, 32, 20, 594746)
+
+
+class TestAAEMessages(unittest.TestCase):
+
+    def test_check_snapshots_encoding(self):
+        snapshots = [(doc_id, bytes(range(14))), ('doc2', bytes(14))] * (AAECheckSnapshots.MAX_COUNT // 2)
+        message = AAECheckSnapshots(7, 'users', snapshots)
+
+        parsed = AAECheckSnapshots.parse(message.get())
+        self.assertEqual((parsed.request_id, parsed.collection_name, parsed.snapshots), (7, 'users', snapshots))
+
+    def test_differing_snapshots_encoding(self):
+        message = AAEDifferingSnapshots(7, [(doc_id, updated_at), ('doc2', None)])
+
+        parsed = AAEDifferingSnapshots.parse(message.get())
+        self.assertEqual((parsed.request_id, parsed.timestamps), (7, [(doc_id, updated_at), ('doc2', None)]))
+
+    def test_heartbeat_encoding(self):
+        parsed = AAEHeartbeat.parse(AAEHeartbeat(AAEOperationType.HEARTBEAT_ACK, 7).get())
+        self.assertEqual((parsed.operation_type, parsed.sequence), (AAEOperationType.HEARTBEAT_ACK, 7))
+
+    def test_merkle_node_encoding(self):
+        children = [bytes([i]) * 16 for i in range(16)]
+        parsed = AAEMerkleNode.parse(AAEMerkleNode(1, 15, bytes(16), children).get())
+
+        self.assertEqual((parsed.level, parsed.index, parsed.node_hash, parsed.children), (1, 15, bytes(16), children))
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_round_trip(self):
+        payload = b'{"name": "autumn", "leaves": "yellow"}' * 50
+        for compression in Compression:
+            self.assertEqual(Compression.decompress(compression.frame_flag, compression.compress(payload)), payload)
+
+    def test_truncated_payload_is_rejected(self):
+        compressed = Compression.LZMA.compress(b'{"a": 1}' * 50)
+        with self.assertRaises(Exception):
+            Compression.decompress(Compression.LZMA.frame_flag, compressed[:-4])
+
+
+class TestNeighborReplicator(unittest.TestCase):
+
+    def test_queued_tasks_are_deduplicated(self):
+        neigh = NodeConfig({'addr': '127.0.0.1', 'port': 1}, {'addr': '127.0.0.1', 'port': 2})
+        replicator = NeighborReplicator(neigh, None, 0.5)
+
+        for _ in range(3):
+            replicator.push_document('users', doc_id)
+            replicator.sync_collection('users')
+        replicator.push_document('users', 'doc2')
+
+        self.assertEqual(replicator.stats()['queue_depth'], 3)
+
+    def test_documents_are_compressed_above_threshold(self):
+        neigh = NodeConfig({'addr': '127.0.0.1', 'port': 1}, {'addr': '127.0.0.1', 'port': 2}, 'zlib', 64)
+        replicator = NeighborReplicator(neigh, None, 0.5)
+
+        short = b'{"a": 1}'
+        self.assertEqual(replicator._compress(short), (short, 0))
+
+        payload = b'{"a": 1}' * 100
+        compressed, flags = replicator._compress(payload)
+        self.assertLess(len(compressed), len(payload))
+        self.assertEqual(Compression.decompress(flags, compressed), payload)
+
+
+class TestDocumentStream(unittest.TestCase):
+
+    def _start_receiver(self, apply_documents) -> DocumentStream:
+        receiver = DocumentReceiver(0, apply_documents)
+        stop = threading.Event()
+
+        def accepting():
+            while not stop.is_set():
+                receiver.accept_stream()
+
+        threading.Thread(target=accepting, daemon=True).start()
+        self.addCleanup(stop.set)
+
+        return DocumentStream(('127.0.0.1', receiver._socket.getsockname()[1]))
+
+    def test_documents_are_applied_and_acked(self):
+        applied = list()
+        lock = threading.Lock()
+
+        def apply_documents(payloads: list):
+            with lock:
+                applied.extend(payloads)
+
+        stream = self._start_receiver(apply_documents)
+        payloads = [f'{i}'.encode('utf-8') for i in range(DocumentStream.WINDOW * 3)]
+        for payload in payloads:
+            stream.send(payload)
+
+        deadline = time.monotonic() + 10
+        while stream.in_flight > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(stream.in_flight, 0)
+        self.assertEqual(sorted(applied), sorted(payloads))
+
+        stream.close()
+
+    def test_failed_batch_is_not_acked_and_sent_again(self):
+        applied = list()
+        failing = [b'5']
+        lock = threading.Lock()
+
+        def apply_documents(payloads: list):
+            with lock:
+                if len(failing) > 0 and failing[0] in payloads:
+                    failing.pop()
+                    raise Exception('disk is full')
+                applied.extend(payloads)
+
+        stream = self._start_receiver(apply_documents)
+        payloads = [f'{i}'.encode('utf-8') for i in range(10)]
+        for payload in payloads:
+            try:
+                stream.send(payload)
+            except OSError:
+                # the connection is broken by the receiver, the document is kept for the next one
+                pass
+
+        deadline = time.monotonic() + 10
+        while stream.in_flight > 0 and time.monotonic() < deadline:
+            try:
+                stream.resend()
+            except OSError:
+                pass
+            time.sleep(0.01)
+
+        self.assertEqual(stream.in_flight, 0)
+        self.assertEqual(failing, [])
+        # the documents of the failed batch are applied by the new connection
+        self.assertEqual(sorted(set(bytes(payload) for payload in applied)), sorted(payloads))
+
+        stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import datetime
+import unittest
+
+from autumn_db.data_storage.cache import DocumentCache
+
+updated_at = datetime.datetime(2024, 2, 7, 8, 32, 20, 594746)
+
+
+class TestDocumentCache(unittest.TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = DocumentCache(10)
+        cache.put('doc1', 'aaaa', updated_at)
+        cache.put('doc2', 'bbbb', updated_at)
+
+        # doc1 becomes the most recently used one
+        self.assertEqual(cache.get('doc1'), ('aaaa', updated_at))
+        cache.put('doc3', 'cccc', updated_at)
+
+        self.assertIsNone(cache.get('doc2'))
+        self.assertEqual(cache.get('doc3'), ('cccc', updated_at))
+        self.assertEqual(cache.stats(), {
+            'capacity': 10,
+            'size': 8,
+            'count': 2,
+            'hits': 2,
+            'misses': 1,
+            'evictions': 1,
+        })
+
+    def test_replaced_and_invalidated_entries_release_size(self):
+        cache = DocumentCache(10)
+        cache.put('doc1', 'aaaa', updated_at)
+        cache.put('doc1', 'aaaaaaaa', updated_at)
+        self.assertEqual(cache.stats()['size'], 8)
+
+        cache.invalidate('doc1')
+        self.assertIsNone(cache.get('doc1'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+        # the documents larger than the cache are not cached
+        cache.put('doc2', 'b' * 11, updated_at)
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,7 @@
 import json
+import os
+import shutil
+import tempfile
 import unittest
 
 # TODO we need this import to avoid circular import
@@ -6,6 +9,11 @@ from autumn_db.autumn_db import DocumentId
 
 from autumn_db.data_storage.collection import CollectionOperations
 from autumn_db.data_storage.collection.impl import CollectionOperationsImpl
+from autumn_db.data_storage.collection.doc_id_index import DocIdIndex
+from autumn_db.data_storage.collection.manifest import SnapshotManifest
+from autumn_db.data_storage.collection.secondary_index import ORDERED_INDEX, MIN_COMPACTION_ENTRIES, HashIndex
+from autumn_db.data_storage.collection.snapshot_table import SnapshotTable
+from autumn_db.data_storage.predicate import Predicate
 
 collection_name = 'users'
 filename = 'test1'
@@ -28,6 +36,10 @@ class TestCollection(unittest.TestCase):
     def tearDown(self) -> None:
         self._collection.delete()
 
+    def _reopen(self):
+        self._collection.close()
+        self._collection = CollectionOperationsImpl(collection_name)
+
     def test_read_success(self):
         data_operator = self._collection.get_document_operator(filename)
 
@@ -48,11 +60,187 @@ class TestCollection(unittest.TestCase):
 
         self.assertEqual(read_data, new_data_str)
 
+    def test_cached_document_is_invalidated_by_update(self):
+        self.assertEqual(self._collection.read_document(filename), data_str)
+        self.assertEqual(self._collection.read_document(filename), data_str)
+        self.assertEqual(self._collection.cache.stats()['hits'], 1)
+
+        new_data_str = json.dumps({'firstname': 'Marine'})
+        self._collection.update_document(filename, new_data_str)
+
+        self.assertEqual(self._collection.read_document(filename), new_data_str)
+
     #def test_delete_document_success(self):
         # TODO delete document and check files are absent under data & metadata dirs
 
-    #def test_metadata_updated_success(self):
-        # TODO get the value of 'updated_at', do update of file and take the 'updated_at' again; check that value AFTER is later
+    def test_metadata_updated_success(self):
+        before = self._collection.get_updated_at(filename)
+        self._collection.update_document(filename, data_str)
+        after = self._collection.get_updated_at(filename)
+
+        self.assertGreater(after, before)
+
+        # the metadata table is written through to the metadata file
+        self._reopen()
+        self.assertEqual(self._collection.get_updated_at(filename), after)
+
+    def test_metadata_is_frozen_success(self):
+        self.assertFalse(self._collection.is_frozen(filename))
+
+        self._collection.set_is_frozen(filename, True)
+        self._collection.update_document(filename, data_str)
+
+        self.assertTrue(self._collection.is_frozen(filename))
+        self._reopen()
+        self.assertTrue(self._collection.is_frozen(filename))
+
+
+class TestSnapshotManifest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._path = tempfile.mkdtemp()
+        self._collection = CollectionOperationsImpl(collection_name, self._path)
+        self._collection.create()
+
+    def tearDown(self) -> None:
+        self._collection.close()
+        shutil.rmtree(self._path)
+
+    def _reopen(self):
+        self._collection.close()
+        self._collection = CollectionOperationsImpl(collection_name, self._path)
+
+    def test_snapshots_are_loaded_without_reading_documents(self):
+        self._collection.create_document('doc1', data_str)
+        self._collection.create_document('doc2', data_str)
+        self._collection.delete_document('doc2')
+        self._collection.set_is_frozen('doc1', True)
+        expected = self._collection.get_snapshot('doc1')
+        updated_at = self._collection.get_updated_at('doc1')
+
+        # the document is not parsed on the start, otherwise it fails
+        with open(os.path.join(self._path, collection_name, 'data', 'doc1'), 'w') as f:
+            f.write('not a json')
+        os.remove(os.path.join(self._path, collection_name, 'metadata', 'doc1'))
+
+        self._reopen()
+
+        self.assertEqual(self._collection.doc_ids(), {'doc1'})
+        self.assertEqual(self._collection.get_snapshot('doc1'), expected)
+        self.assertEqual(self._collection.get_updated_at('doc1'), updated_at)
+        self.assertTrue(self._collection.is_frozen('doc1'))
+
+    def test_documents_without_manifest_are_hashed(self):
+        self._collection.create_document('doc1', data_str)
+        expected = self._collection.get_snapshot('doc1')
+        self._collection.close()
+        os.remove(os.path.join(self._path, collection_name, SnapshotManifest.FILENAME))
+
+        self._collection = CollectionOperationsImpl(collection_name, self._path)
+
+        self.assertEqual(self._collection.get_snapshot('doc1'), expected)
+        self.assertEqual(len(SnapshotManifest(os.path.join(self._path, collection_name,
+                                                           SnapshotManifest.FILENAME)).load()), 1)
+
+
+class TestSnapshotTable(unittest.TestCase):
+
+    def test_slots_are_reused(self):
+        table = SnapshotTable()
+        table.put('doc1', bytes(range(14)))
+        table.put('doc2', bytes([1] * 14))
+        table.remove('doc1')
+        table.put('doc3', bytes([3] * 14))
+        table.put('doc2', bytes([2] * 14))
+
+        self.assertIsNone(table.get('doc1'))
+        self.assertEqual((table.get('doc2'), table.get('doc3')), (bytes([2] * 14), bytes([3] * 14)))
+        self.assertEqual(len(table._records), 2 * 14)
+        self.assertEqual(set(table.doc_ids()), {'doc2', 'doc3'})
+
+
+class TestDocIdIndex(unittest.TestCase):
+
+    def test_range(self):
+        ids = [str(DocumentId()) for _ in range(100)]
+        index = DocIdIndex()
+        for doc_id in reversed(ids):
+            index.add(doc_id)
+        index.add(ids[5])
+        index.remove(ids[10])
+
+        self.assertEqual(len(index), 99)
+        self.assertEqual(index.range(ids[5], ids[12]), ids[5:10] + ids[11:12])
+        self.assertEqual(index.range(ids[90], None, 3), ids[90:93])
+        self.assertEqual(index.range(None, ids[2]), ids[:2])
+
+
+class TestSecondaryIndexes(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._path = tempfile.mkdtemp()
+        self._collection = CollectionOperationsImpl(collection_name, self._path)
+        self._collection.create()
+
+    def tearDown(self) -> None:
+        self._collection.close()
+        shutil.rmtree(self._path)
+
+    def _query(self, *src):
+        res = self._collection.query(Predicate.parse_all(list(src)))
+        return sorted(res) if res is not None else None
+
+    def test_indexes_are_maintained_and_persisted(self):
+        self._collection.create_document('doc0', json.dumps({'name': 'a', 'age': 20}))
+        self._collection.create_index('name')
+        self._collection.create_index('age', ORDERED_INDEX)
+        self._collection.create_documents([(f'doc{i}', json.dumps({'name': 'b', 'age': 20 + i})) for i in range(1, 5)])
+        self._collection.update_document('doc1', json.dumps({'name': 'a', 'age': 'old'}))
+        self._collection.delete_document('doc2')
+
+        self.assertEqual(self._query({'path': 'name', 'eq': 'a'}), ['doc0', 'doc1'])
+        self.assertEqual(self._query({'path': 'age', 'gt': 20, 'lte': 24}), ['doc3', 'doc4'])
+        self.assertIsNone(self._query({'path': 'lastname', 'eq': 'a'}))
+
+        # the document written while the index log was lost is indexed at the opening
+        self._collection.close()
+        for entry in os.scandir(os.path.join(self._path, collection_name, 'indexes')):
+            if entry.name.startswith('hash'):
+                os.remove(entry.path)
+        self._collection = CollectionOperationsImpl(collection_name, self._path)
+
+        self.assertEqual(self._collection.indexes(), [('name', 'hash'), ('age', ORDERED_INDEX)])
+        self.assertEqual(self._query({'path': 'name', 'eq': 'b'}), ['doc3', 'doc4'])
+        self.assertEqual(self._query({'path': 'age', 'eq': 'old'}), ['doc1'])
+        # the candidates are found by the most selective index
+        self.assertEqual(self._query({'path': 'name', 'eq': 'b'}, {'path': 'age', 'gte': 24}), ['doc4'])
+
+    def test_indexing_does_not_touch_cache(self):
+        self._collection.create_documents([(f'doc{i}', json.dumps({'name': 'a'})) for i in range(10)])
+        self._collection.read_document('doc0')
+        stats = self._collection.cache.stats()
+
+        self._collection.create_index('name')
+
+        self.assertEqual(self._collection.cache.stats(), stats)
+        self.assertEqual(self._query({'path': 'name', 'eq': 'a'}), sorted(f'doc{i}' for i in range(10)))
+
+    def test_index_log_is_compacted(self):
+        pathname = os.path.join(self._path, 'name.log')
+        index = HashIndex('name', pathname)
+        index.open()
+        for i in range(2 * MIN_COMPACTION_ENTRIES):
+            index.put('doc1', {'name': i})
+        index.put('doc2', {'name': 'b'})
+        index.close()
+
+        with open(pathname) as f:
+            self.assertLess(len(f.readlines()), 2 * MIN_COMPACTION_ENTRIES)
+
+        index = HashIndex('name', pathname)
+        index.open()
+        self.addCleanup(index.close)
+        self.assertEqual(index.lookup(Predicate.parse({'path': 'name', 'eq': 2 * MIN_COMPACTION_ENTRIES - 1})),
+                         ['doc1'])
+        self.assertEqual(index.lookup(Predicate.parse({'path': 'name', 'eq': 'b'})), ['doc2'])
 
-    #def test_metadata_is_frozen_success(self):
-        # TODO change value of 'is_frozen' and check that value has been changed
@@ -1,11 +1,15 @@
+import asyncio
 import json
 import os
 import shutil
+import tempfile
 import threading
 import unittest
-from time import sleep
 
-from autumn_db.autumn_db import DBCoreEngine, DBOperationEngine, CreateOperation, ReadOperation
+from autumn_db import DocumentId
+from autumn_db.autumn_db import DBCoreEngine, DBOperationEngine, CreateOperation, ReadOperation, UpdateOperation, \
+    BatchOperation, DBOperationType
+from autumn_db.data_storage.collection.manifest import SnapshotManifest
 
 
 user_data = {
@@ -29,26 +33,134 @@ db_operation = DBOperationEngine(db_core)
 
 class TestCollection(unittest.TestCase):
 
-    def setUp(self) -> None:
+    @classmethod
+    def setUpClass(cls) -> None:
         th = threading.Thread(target=db_operation.processing, args=())
         th.start()
 
-    def tearDown(self) -> None:
-        db_operation._is_stopped = True
+    @classmethod
+    def tearDownClass(cls) -> None:
+        db_operation.stop()
 
     def test_create_read_success(self):
         create = CreateOperation(collection_name, data_str)
         db_operation.add_operation(create)
 
-        # we give some delay before read operation
-        sleep(1)
+        # the read is issued after the document is persisted
+        self.assertEqual(str(create.result(10)), str(create.document_id))
 
         read = ReadOperation(collection_name, create.document_id)
         db_operation.add_operation(read)
 
-        while not read.is_finished():
-            sleep(1)
-
-        read_data = read.data
+        read_data = read.result(10)
         self.assertEqual(read_data, data_str)
+        self.assertEqual(read.data, data_str)
+
+    def test_failed_operation_carries_exception(self):
+        update = UpdateOperation(collection_name, DocumentId(), data_str)
+        db_operation.add_operation(update)
+
+        with self.assertRaises(Exception):
+            update.result(10)
+
+    def test_operation_is_awaitable(self):
+        create = CreateOperation(collection_name, data_str)
+
+        async def create_and_read():
+            db_operation.add_operation(create)
+            await create
+
+            read = ReadOperation(collection_name, create.document_id)
+            db_operation.add_operation(read)
+            return await read
+
+        self.assertEqual(asyncio.run(asyncio.wait_for(create_and_read(), 10)), data_str)
+
+
+class TestOperationsOrder(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._engine = DBOperationEngine(db_core, workers=4)
+        th = threading.Thread(target=self._engine.processing, args=())
+        th.start()
+
+    def tearDown(self) -> None:
+        self._engine.stop()
+
+    def test_operations_on_document_are_ordered(self):
+        create = CreateOperation(collection_name, data_str)
+        self._engine.add_operation(create)
+
+        for i in range(50):
+            data = json.dumps({'counter': i})
+            self._engine.add_operation(UpdateOperation(collection_name, create.document_id, data))
+
+        read = ReadOperation(collection_name, create.document_id)
+        self._engine.add_operation(read)
+
+        self.assertTrue(read.wait(10))
+        self.assertEqual(json.loads(read.data), {'counter': 49})
+
+    def test_batch_fails_when_part_fails_before_last_one(self):
+        batch = BatchOperation(DBOperationType.CREATE, collection_name,
+                               [CreateOperation(collection_name, data_str) for _ in range(64)])
+        parts = list(self._engine._split_batch(batch).values())
+        self.assertGreater(len(parts), 1)
+
+        error = Exception('disk is full')
+        with self.assertNoLogs('concurrent.futures'):
+            parts[0].failed(error)
+            # the last part finishes after the failure
+            for part in parts[1:]:
+                for oper in part.operations:
+                    oper.finished(oper.document_id)
+                part.finished(part.document_ids)
+
+        self.assertIs(batch.future.exception(10), error)
+
+
+class TestCollectionsDiscovery(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._path = tempfile.mkdtemp()
+
+        core = DBCoreEngine(self._path)
+        for name in ['users', 'orders', 'items']:
+            core.create_collection(name)
+            core.collections[name].create_document('doc1', data_str)
+        core.close()
+
+        # not a collection of the filesystem engine
+        os.mkdir(os.path.join(self._path, 'backup'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self._path)
+
+    def test_collections_are_opened_in_background(self):
+        core = DBCoreEngine(self._path)
+
+        # the requested collection is available before the rest are opened
+        self.assertEqual(core.get_collection_safely('orders').read_document('doc1'), data_str)
+        self.assertTrue(core.wait_until_ready(timeout=10))
+        self.assertTrue(core.is_ready('users'))
+
+        self.assertEqual(set(core.collections.keys()), {'users', 'orders', 'items'})
+        self.assertEqual(core.collections['items'].doc_ids(), {'doc1'})
+        core.close()
+
+    def test_collection_which_could_not_be_opened_is_skipped(self):
+        # the manifest could not be read
+        manifest = os.path.join(self._path, 'orders', SnapshotManifest.FILENAME)
+        os.remove(manifest)
+        os.mkdir(manifest)
+
+        core = DBCoreEngine(self._path)
+        with self.assertRaises(Exception):
+            core.wait_until_ready(timeout=10)
+        self.assertTrue(core.wait_until_ready(['users', 'items'], timeout=10))
 
+        self.assertEqual(set(core.collections.keys()), {'users', 'items'})
+        self.assertEqual(set(core.failed_collections.keys()), {'orders'})
+        with self.assertRaises(Exception):
+            core.get_collection_safely('orders')
+        core.close()
@@ -0,0 +1,33 @@
+import unittest
+
+from autumn_db import DocumentId
+
+
+class TestDocumentId(unittest.TestCase):
+
+    def test_legacy_id_is_parsed(self):
+        doc_id = DocumentId('2024_02_07_08_32_20_594746')
+
+        self.assertEqual(str(doc_id), '2024_02_07_08_32_20_594746')
+        self.assertEqual((doc_id.node_id, doc_id.sequence), (0, 0))
+        self.assertEqual(DocumentId.from_bytes(doc_id.to_bytes()), doc_id)
+        self.assertEqual(str(DocumentId.from_bytes(doc_id.to_bytes())), '2024_02_07_08_32_20_594746')
+
+        with self.assertRaises(Exception):
+            DocumentId('2024_02_07_08_32_20')
+
+    def test_generated_ids_are_unique_and_growing(self):
+        ids = [DocumentId() for _ in range(10000)]
+
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertNotEqual(ids[0].node_id, 0)
+
+        for doc_id in ids[:100]:
+            self.assertEqual(len(doc_id.to_bytes()), DocumentId.LENGTH)
+            self.assertEqual(DocumentId(str(doc_id)), doc_id)
+            self.assertEqual(DocumentId.from_bytes(doc_id.to_bytes()), doc_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+import itertools
+import socket
+import threading
+import unittest
+from unittest import mock
+
+# TODO we need this import to avoid circular import
+from autumn_db.autumn_db import DocumentId
+
+from db_driver import Frame, FrameReader, FRAME_HEADER_LENGTH, FRAME_FLAG_ERROR, FRAME_FLAG_MORE, PooledConnection, \
+    ConnectionPool
+
+
+class CountingSocket:
+
+    def __init__(self, sock: socket.socket):
+        self._socket = sock
+        self.calls = 0
+
+    def recv_into(self, buffer):
+        self.calls += 1
+        return self._socket.recv_into(buffer)
+
+
+class TestFraming(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._sender, self._receiver = socket.socketpair()
+
+    def tearDown(self) -> None:
+        self._sender.close()
+        self._receiver.close()
+
+    def test_frames_roundtrip(self):
+        frames = [
+            Frame(1, b'{"firstname": "Valerii"}'),
+            Frame(4, b'with\x00nul\x00bytes', FRAME_FLAG_ERROR),
+            Frame(2, b''),
+        ]
+        for frame in frames:
+            self._sender.sendall(frame.encode())
+        self._sender.close()
+
+        reader = FrameReader(self._receiver)
+        for expected in frames:
+            frame = reader.read_frame()
+            self.assertEqual(frame.opcode, expected.opcode)
+            self.assertEqual(frame.flags, expected.flags)
+            self.assertEqual(bytes(frame.payload), expected.payload)
+
+        self.assertIsNone(reader.read_frame())
+
+    def test_large_payload_takes_few_syscalls(self):
+        payload = bytes(range(256)) * 4096
+        encoded = Frame(4, payload).encode()
+
+        sending = threading.Thread(target=self._sender.sendall, args=(encoded,))
+        sending.start()
+
+        counting = CountingSocket(self._receiver)
+        frame = FrameReader(counting).read_frame()
+        sending.join()
+
+        self.assertEqual(bytes(frame.payload), payload)
+        self.assertLess(counting.calls, 256)
+
+    def test_truncated_frame_fails(self):
+        encoded = Frame(1, b'abcdef').encode()
+        self._sender.sendall(encoded[:FRAME_HEADER_LENGTH + 2])
+        self._sender.close()
+
+        with self.assertRaises(Exception):
+            FrameReader(self._receiver).read_frame()
+
+
+class TestPooledConnection(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen()
+
+    def tearDown(self) -> None:
+        self._server.close()
+
+    def _reply_in_reverse_order(self, count: int):
+        connection, _ = self._server.accept()
+        reader = FrameReader(connection)
+
+        frames = [reader.read_frame() for _ in range(count)]
+        for frame in reversed(frames):
+            connection.sendall(Frame(frame.opcode, frame.payload.upper(), request_id=frame.request_id).encode())
+
+        connection.close()
+
+    def test_pipelined_responses_are_matched_out_of_order(self):
+        count = 10
+        server = threading.Thread(target=self._reply_in_reverse_order, args=(count,))
+        server.start()
+
+        conn = PooledConnection(self._server.getsockname())
+        futures = [conn.submit(4, f'doc{i}'.encode()) for i in range(count)]
+
+        results = [bytes(future.result(5)) for future in futures]
+        server.join()
+        conn.close()
+
+        self.assertEqual(results, [f'DOC{i}'.encode() for i in range(count)])
+
+    def test_request_id_skips_zero_on_wrap(self):
+        count = 3
+        server = threading.Thread(target=self._reply_in_reverse_order, args=(count,))
+        server.start()
+
+        conn = PooledConnection(self._server.getsockname())
+        conn._request_ids = itertools.count((1 << 32) - 1)
+        futures = [conn.submit(4, f'doc{i}'.encode()) for i in range(count)]
+
+        results = [bytes(future.result(5)) for future in futures]
+        server.join()
+        conn.close()
+
+        self.assertEqual(results, [f'DOC{i}'.encode() for i in range(count)])
+
+    def _reply_by_stream(self):
+        connection, _ = self._server.accept()
+        reader = FrameReader(connection)
+
+        stream, single = reader.read_frame(), reader.read_frame()
+        for i in range(3):
+            connection.sendall(Frame(stream.opcode, f'part{i}'.encode(), FRAME_FLAG_MORE, stream.request_id).encode())
+            # the streamed response is interleaved with the other ones
+            if i == 0:
+                connection.sendall(Frame(single.opcode, b'single', request_id=single.request_id).encode())
+        connection.sendall(Frame(stream.opcode, b'last', request_id=stream.request_id).encode())
+
+        connection.close()
+
+    def test_streamed_response_is_received_frame_by_frame(self):
+        server = threading.Thread(target=self._reply_by_stream)
+        server.start()
+
+        conn = PooledConnection(self._server.getsockname())
+        frames = conn.submit_stream(8, b'')
+        single = conn.submit(4, b'')
+
+        self.assertEqual(bytes(single.result(5)), b'single')
+        received = list()
+        while True:
+            payload = frames.get(timeout=5)
+            if payload is None:
+                break
+            received.append(bytes(payload))
+
+        server.join()
+        conn.close()
+
+        self.assertEqual(received, [b'part0', b'part1', b'part2', b'last'])
+
+    def _reply_by_endless_stream(self, sent: list):
+        connection, _ = self._server.accept()
+        stream = FrameReader(connection).read_frame()
+        try:
+            while True:
+                connection.sendall(Frame(stream.opcode, b'x' * 1024, FRAME_FLAG_MORE, stream.request_id).encode())
+                sent.append(1)
+        except OSError:
+            pass
+
+        connection.close()
+
+    def test_abandoned_stream_is_cancelled(self):
+        sent = list()
+        server = threading.Thread(target=self._reply_by_endless_stream, args=(sent,))
+        server.start()
+
+        conn = PooledConnection(self._server.getsockname())
+        frames = conn.submit_stream(8, b'')
+        self.assertEqual(len(frames.get(timeout=5)), 1024)
+        self.assertTrue(conn.has_streams)
+
+        frames.close()
+        server.join(5)
+
+        self.assertFalse(server.is_alive())
+        self.assertTrue(conn.is_closed)
+        self.assertEqual(conn.in_flight, 0)
+        # the stream which is not read is not buffered by the client, only by the socket buffers
+        self.assertLess(len(sent), 100000)
+
+    def _serve_connection(self, connection: socket.socket):
+        reader = FrameReader(connection)
+        while True:
+            frame = reader.read_frame()
+            if frame is None:
+                break
+
+            if frame.opcode == 8:
+                # the stream is longer than the client buffer, so its connection is not read until it is consumed
+                for i in range(10):
+                    connection.sendall(Frame(frame.opcode, f'part{i}'.encode(), FRAME_FLAG_MORE,
+                                             frame.request_id).encode())
+                connection.sendall(Frame(frame.opcode, b'last', request_id=frame.request_id).encode())
+            else:
+                connection.sendall(Frame(frame.opcode, b'single', request_id=frame.request_id).encode())
+
+        connection.close()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+    def test_pool_does_not_share_stream_connection(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+        pool = ConnectionPool(self._server.getsockname(), max_connections=1)
+        stream_acquired, requested = threading.Event(), threading.Event()
+        used = dict()
+
+        submit_stream, submit = PooledConnection.submit_stream, PooledConnection.submit
+
+        def delayed_submit_stream(conn, *args, **kwargs):
+            # the request is routed after the stream got its connection, but before the stream is sent
+            used['stream'] = conn
+            stream_acquired.set()
+            requested.wait(5)
+            return submit_stream(conn, *args, **kwargs)
+
+        def recorded_submit(conn, *args, **kwargs):
+            used['single'] = conn
+            requested.set()
+            return submit(conn, *args, **kwargs)
+
+        results = dict()
+
+        def streaming():
+            frames = pool.submit_stream(8, b'')
+            received = list()
+            while True:
+                payload = frames.get(timeout=5)
+                if payload is None:
+                    break
+                received.append(bytes(payload))
+            results['stream'] = len(received)
+
+        with mock.patch.object(PooledConnection, 'submit_stream', delayed_submit_stream), \
+                mock.patch.object(PooledConnection, 'submit', recorded_submit):
+            thread = threading.Thread(target=streaming)
+            thread.start()
+            stream_acquired.wait(5)
+            results['single'] = bytes(pool.submit(4, b'').result(5))
+            thread.join()
+        pool.close()
+
+        self.assertIsNot(used['stream'], used['single'])
+        self.assertEqual(results, {'stream': 11, 'single': b'single'})
@@ -0,0 +1,109 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# TODO we need this import to avoid circular import
+from autumn_db.autumn_db import DBCoreEngine, StorageEngine
+
+from autumn_db.data_storage.data_access.log_structured import LogStructuredAccess
+
+updated_at = datetime.datetime(2024, 2, 7, 8, 32, 20, 594746)
+
+
+class TestLogStructuredAccess(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._path = tempfile.mkdtemp()
+        self._store = LogStructuredAccess(self._path, compaction_interval=None)
+
+    def tearDown(self) -> None:
+        self._store.close()
+        shutil.rmtree(self._path)
+
+    def _reopen(self, segment_max_size: int = LogStructuredAccess.SEGMENT_MAX_SIZE):
+        self._store.close()
+        self._store = LogStructuredAccess(self._path, segment_max_size, compaction_interval=None)
+
+    def test_records_survive_reopen(self):
+        self._store.put('doc1', '{"a": 1}', updated_at, must_exist=False)
+        self._store.put('doc2', '{"a": 2}', updated_at, must_exist=False)
+        self._store.put('doc1', '{"a": 3}', updated_at + datetime.timedelta(seconds=1), must_exist=True)
+        self._store.delete('doc2')
+
+        self._reopen()
+
+        self.assertEqual(self._store.get('doc1'), ('{"a": 3}', updated_at + datetime.timedelta(seconds=1)))
+        self.assertFalse(self._store.contains('doc2'))
+        self.assertEqual(self._store.keys(), ['doc1'])
+
+    def test_create_and_update_are_checked(self):
+        self._store.create('doc1', '{}')
+
+        with self.assertRaises(RuntimeError):
+            self._store.create('doc1', '{}')
+
+        with self.assertRaises(RuntimeError):
+            self._store.update('doc2', '{}')
+
+    def test_compaction_keeps_live_records(self):
+        self._reopen(segment_max_size=1024)
+        for i in range(200):
+            self._store.put(f'doc{i % 10}', json.dumps({'i': i}), updated_at)
+        self._store.delete('doc9')
+
+        before = self._store.stats()
+        self._store.compact()
+        after = self._store.stats()
+
+        self.assertLess(after['total_bytes'], before['total_bytes'])
+        self.assertEqual(after['records'], 9)
+
+        self._reopen(segment_max_size=1024)
+        for i in range(9):
+            self.assertEqual(self._store.read(f'doc{i}'), json.dumps({'i': 190 + i}))
+        self.assertFalse(self._store.contains('doc9'))
+
+    def test_truncated_tail_is_dropped(self):
+        self._store.put('doc1', '{"a": 1}', updated_at)
+        self._store.put('doc2', '{"a": 2}', updated_at)
+        self._store.close()
+
+        segment = os.path.join(self._path, '00000000.log')
+        os.truncate(segment, os.path.getsize(segment) - 3)
+
+        self._store = LogStructuredAccess(self._path, compaction_interval=None)
+        self.assertEqual(self._store.keys(), ['doc1'])
+
+        self._store.put('doc3', '{"a": 3}', updated_at)
+        self._reopen()
+        self.assertEqual(sorted(self._store.keys()), ['doc1', 'doc3'])
+
+
+class TestStorageEngineMigration(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._holder = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self._holder)
+
+    def test_filesystem_holder_is_migrated(self):
+        db_core = DBCoreEngine(self._holder)
+        collection = db_core.get_collection_safely('users')
+        collection.create_document('2024_02_07_08_32_20_594746', '{"firstname": "Valerii"}', updated_at)
+
+        with self.assertRaises(Exception):
+            DBCoreEngine(self._holder, StorageEngine.LOG_STRUCTURED)
+
+        DBCoreEngine.migrate(self._holder, StorageEngine.LOG_STRUCTURED)
+
+        db_core = DBCoreEngine(self._holder, StorageEngine.LOG_STRUCTURED)
+        collection = db_core.collections['users']
+        self.assertEqual(
+            collection.read_document_with_updated_at('2024_02_07_08_32_20_594746'),
+            ('{"firstname": "Valerii"}', updated_at)
+        )
+        collection.close()
@@ -0,0 +1,50 @@
+import unittest
+
+from algorithms.merkle_tree import MerkleTree
+
+snapshot = bytes(range(14))
+
+
+class TestMerkleTree(unittest.TestCase):
+
+    def test_equal_documents_give_equal_roots(self):
+        left, right = MerkleTree(), MerkleTree()
+        for i in range(100):
+            left.update(f'doc{i}', snapshot)
+        for i in reversed(range(100)):
+            right.update(f'doc{i}', snapshot)
+
+        self.assertEqual(left.root(), right.root())
+        self.assertNotEqual(left.root(), MerkleTree().root())
+
+    def test_changes_are_found_by_descending(self):
+        left, right = MerkleTree(), MerkleTree()
+        for i in range(100):
+            left.update(f'doc{i}', snapshot)
+            right.update(f'doc{i}', snapshot)
+
+        right.update('doc7', bytes(14))
+        right.update('doc100', snapshot)
+
+        differing = [(0, 0)]
+        for level in range(left.depth):
+            differing = [
+                (level + 1, index * left.fanout + i)
+                for _, index in differing
+                for i, (a, b) in enumerate(zip(left.children(level, index), right.children(level, index)))
+                if a != b
+            ]
+
+        doc_ids = set()
+        for _, leaf in differing:
+            doc_ids.update(right.doc_ids(leaf))
+        self.assertEqual(doc_ids.intersection({'doc7', 'doc100'}), {'doc7', 'doc100'})
+
+        # the changes are reverted incrementally
+        right.update('doc7', snapshot)
+        right.remove('doc100')
+        self.assertEqual(left.root(), right.root())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import random
+import unittest
+
+from algorithms import ph2
+from algorithms.ph2 import PH2, hashing_python, hashing_numpy
+
+# hashes computed by the original per-byte implementation
+GOLDEN = [
+    (b'', '000000000000'),
+    (b'\x00', '010000000000'),
+    (bytes(range(256)) * 3, '60a275398a47'),
+    (b'{"firstname": "Valerii", "lastname": "Nikitin"}' * 100, '82ebe1a56e8f'),
+    (random.Random(7).randbytes(10000), 'e4529ad45da4'),
+    (b'\xff' * 1000, 'eb0000eb0000'),
+]
+
+
+class TestPH2(unittest.TestCase):
+
+    def test_python_hashing_matches_golden(self):
+        for src, expected in GOLDEN:
+            self.assertEqual(hashing_python(src).hex(), expected)
+
+    @unittest.skipIf(ph2.numpy is None, 'NumPy is not installed')
+    def test_numpy_hashing_matches_golden(self):
+        for src, expected in GOLDEN:
+            self.assertEqual(hashing_numpy(src).hex(), expected)
+
+    @unittest.skipIf(ph2.numpy is None, 'NumPy is not installed')
+    def test_numpy_hashing_matches_python_hashing(self):
+        rnd = random.Random(13)
+        for length in [1, 63, 64, 255, 256, 4096, 100000]:
+            src = rnd.randbytes(length)
+            self.assertEqual(hashing_numpy(src), hashing_python(src))
+
+    def test_appended_parts_are_hashed_as_whole(self):
+        for src, expected in GOLDEN:
+            ph2_hash = PH2()
+            for i in range(0, len(src), 700):
+                ph2_hash.append(src[i:i + 700])
+
+            self.assertEqual(ph2_hash.hashing().hex(), expected)
+
+    def test_digest(self):
+        ph2_hash = PH2()
+        ph2_hash.append(GOLDEN[4][0])
+
+        self.assertEqual(ph2_hash.digest(), 251043436060068)
+        self.assertEqual(PH2.from_hashed(ph2_hash.hashing()).digest(), 251043436060068)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from algorithms.phi_accrual import PhiAccrualFailureDetector
+
+
+class TestPhiAccrualFailureDetector(unittest.TestCase):
+
+    def test_silent_node_is_suspected(self):
+        detector = PhiAccrualFailureDetector(0.5, now=0.0)
+        for i in range(1, 20):
+            detector.heartbeat(now=i * 0.5)
+
+        self.assertTrue(detector.is_available(now=10.0))
+        self.assertFalse(detector.is_available(now=12.0))
+        self.assertLess(detector.phi(now=10.0), detector.phi(now=11.0))
+
+    def test_node_is_available_after_heartbeat(self):
+        detector = PhiAccrualFailureDetector(0.5, now=0.0)
+        self.assertFalse(detector.is_available(now=60.0))
+
+        detector.heartbeat(now=60.0)
+        self.assertTrue(detector.is_available(now=60.5))
+        # the silence is not taken as an interval
+        self.assertFalse(detector.is_available(now=63.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
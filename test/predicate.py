@@ -0,0 +1,41 @@
+import unittest
+
+from autumn_db.data_storage.predicate import Predicate, matches_all, value_at, MISSING
+
+
+class TestPredicate(unittest.TestCase):
+    DOC = {'name': 'Valerii', 'age': 30, 'admin': True, 'address': {'city': 'Kyiv'}, 'tags': ['a', 'b']}
+
+    def test_value_at_path(self):
+        self.assertEqual(value_at(self.DOC, 'address.city'), 'Kyiv')
+        self.assertEqual(value_at(self.DOC, 'tags.1'), 'b')
+        self.assertIs(value_at(self.DOC, 'tags.2'), MISSING)
+        self.assertIs(value_at(self.DOC, 'name.first'), MISSING)
+
+    def test_predicates_are_matched(self):
+        def match(*src):
+            return matches_all(Predicate.parse_all(list(src)), self.DOC)
+
+        self.assertTrue(match({'path': 'name', 'eq': 'Valerii'}))
+        self.assertTrue(match({'path': 'age', 'gte': 18, 'lt': 65}, {'path': 'address.city', 'exists': True}))
+        self.assertTrue(match({'path': 'email', 'exists': False}))
+        self.assertTrue(match())
+
+        self.assertFalse(match({'path': 'age', 'gt': 30}))
+        self.assertFalse(match({'path': 'age', 'lt': '65'}))
+        self.assertFalse(match({'path': 'admin', 'eq': 1}))
+        self.assertFalse(match({'path': 'email', 'eq': None}))
+
+    def test_invalid_predicate_fails(self):
+        with self.assertRaises(Exception):
+            Predicate.parse({'eq': 1})
+
+        with self.assertRaises(Exception):
+            Predicate.parse({'path': 'age', 'between': [1, 2]})
+
+        with self.assertRaises(Exception):
+            Predicate.parse_all({'path': 'age'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import random
+import unittest
+
+from algorithms import spectral_bloom_filter
+from algorithms.spectral_bloom_filter import SpectralBloomFilter
+
+# filters computed by the original per-byte implementation
+GOLDEN = [
+    (b'', '0000000000000000'),
+    (b'\x00', '0101010101010100'),
+    (bytes(range(256)) * 3, '81039c6f483c3090'),
+    (b'{"firstname": "Valerii", "lastname": "Nikitin"}' * 100, '9619b45a916487eb'),
+    (random.Random(7).randbytes(10000), 'aa11c39dc40a5e56'),
+    (b'\xff' * 1000, '00ebeb000000eb00'),
+]
+
+
+class TestSpectralBloomFilter(unittest.TestCase):
+
+    def test_add_matches_golden(self):
+        for src, expected in GOLDEN:
+            sbf = SpectralBloomFilter()
+            sbf.add(src)
+            self.assertEqual(sbf.get().hex(), expected)
+
+    def test_add_matches_golden_without_numpy(self):
+        numpy = spectral_bloom_filter.numpy
+        spectral_bloom_filter.numpy = None
+        try:
+            self.test_add_matches_golden()
+        finally:
+            spectral_bloom_filter.numpy = numpy
+
+
+if __name__ == '__main__':
+    unittest.main()
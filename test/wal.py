@@ -0,0 +1,192 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# TODO we need this import to avoid circular import
+from autumn_db.autumn_db import DBCoreEngine, DBOperationEngine, UpdateOperation, CreateOperation, \
+    BatchOperation, DBOperationType
+
+from autumn_db import DocumentId
+from autumn_db.data_storage.wal import WriteAheadLog, WALRecord, WALRecordType, FsyncPolicy
+from db_driver import DocumentOperation
+
+updated_at = datetime.datetime(2024, 2, 7, 8, 32, 20, 594746)
+doc_id = '2024-02-07T08:32:20.594746Z'
+
+
+class Crash(BaseException):
+    """The process dies, unlike the exception of the write it does not abort the logged records"""
+
+
+class TestWriteAheadLog(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._path = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self._path)
+
+    def test_record_encoding(self):
+        record = WALRecord(WALRecordType.UPDATE, 'users', doc_id, updated_at, '{"a": 1}')
+        src = record.encode()
+
+        decoded, length = WALRecord.decode(src)
+        self.assertEqual(length, len(src))
+        self.assertEqual((decoded.record_type, decoded.collection, decoded.doc_id, decoded.updated_at, decoded.data),
+                         (WALRecordType.UPDATE, 'users', doc_id, updated_at, '{"a": 1}'))
+
+        self.assertIsNone(WALRecord.decode(src[:-1]))
+
+    def test_appended_records_are_replayed_after_restart(self):
+        for policy in FsyncPolicy:
+            path = os.path.join(self._path, policy.value)
+            wal = WriteAheadLog(path, policy, interval_ms=1)
+            durable = wal.append([
+                WALRecord(WALRecordType.CREATE, 'users', 'doc1', updated_at, '{"a": 1}'),
+                WALRecord(WALRecordType.DELETE, 'users', 'doc1', updated_at),
+            ])
+            self.assertIsNone(durable.result(10))
+            wal.close()
+
+            wal = WriteAheadLog(path, policy)
+            self.assertEqual([record.record_type for record in wal.replay()],
+                             [WALRecordType.CREATE, WALRecordType.DELETE])
+
+            wal.checkpoint()
+            self.assertEqual(list(wal.replay()), [])
+            wal.close()
+
+    def test_engine_replays_operations_lost_by_storage(self):
+        wal = WriteAheadLog(os.path.join(self._path, DBCoreEngine.WAL_DIR))
+        wal.append([
+            WALRecord(WALRecordType.CREATE, 'users', 'doc1', updated_at, '{"a": 1}'),
+            WALRecord(WALRecordType.CREATE, 'users', 'doc2', updated_at, '{"a": 2}'),
+            WALRecord(WALRecordType.UPDATE, 'users', 'doc1', updated_at + datetime.timedelta(seconds=1), '{"a": 3}'),
+            WALRecord(WALRecordType.DELETE, 'users', 'doc2', updated_at),
+        ]).result(10)
+        wal.close()
+
+        db_core = DBCoreEngine(self._path)
+        users = db_core.collections['users']
+        self.assertEqual(users.read_document_with_updated_at('doc1'),
+                         ('{"a": 3}', updated_at + datetime.timedelta(seconds=1)))
+        self.assertFalse(users.document_exists('doc2'))
+        db_core.close()
+
+        # the replay is idempotent and does not overwrite newer versions
+        db_core = DBCoreEngine(self._path)
+        self.assertEqual(db_core.collections['users'].read_document('doc1'), '{"a": 3}')
+        db_core.close()
+
+    def test_checkpoint_waits_for_logged_operations(self):
+        wal = WriteAheadLog(self._path)
+        checkpointed = threading.Event()
+
+        with wal.logged([WALRecord(WALRecordType.DELETE, 'users', 'doc1', updated_at)]) as durable:
+            threading.Thread(target=lambda: (wal.checkpoint(), checkpointed.set()), daemon=True).start()
+            self.assertFalse(checkpointed.wait(0.2))
+
+        self.assertTrue(checkpointed.wait(10))
+        self.assertIsNone(durable.result(10))
+        wal.close()
+
+    def test_write_interrupted_after_logging_is_redone(self):
+        db_core = DBCoreEngine(self._path)
+        db_core.create_collection('users')
+        doc_id = DocumentId()
+        db_core.collections['users'].create_document(str(doc_id), '{"a": 1}')
+        db_core.wal.checkpoint()
+
+        db_operation = DBOperationEngine(db_core)
+        published = list()
+        db_operation.event_bus.subscribe(DocumentOperation.UPDATE_DOC, published.append)
+
+        def crash(*args):
+            # the process dies after the record is logged, before the document is rewritten
+            raise Crash()
+
+        db_core.collections['users'].update_document = crash
+        update = UpdateOperation('users', doc_id, '{"a": 2}')
+        with self.assertRaises(Crash):
+            db_operation._handle_update_operation(update)
+
+        self.assertFalse(update.is_finished())
+        self.assertEqual(published, [])
+        db_core.close()
+
+        db_core = DBCoreEngine(self._path)
+        self.assertEqual(db_core.collections['users'].read_document(doc_id), '{"a": 2}')
+        db_core.close()
+
+    def test_aborted_records_are_not_replayed(self):
+        wal = WriteAheadLog(self._path)
+        created = WALRecord(WALRecordType.CREATE, 'users', 'doc1', updated_at, '{"a": 1}')
+        with self.assertRaises(Exception):
+            with wal.logged([created]):
+                raise Exception('could not write')
+        wal.append([WALRecord(WALRecordType.CREATE, 'users', 'doc1', updated_at, '{"a": 2}')])
+        wal.close()
+
+        wal = WriteAheadLog(self._path)
+        self.assertEqual([record.data for record in wal.replay()], ['{"a": 2}'])
+        wal.close()
+
+    def test_failed_create_is_not_replayed(self):
+        db_core = DBCoreEngine(self._path)
+        db_core.create_collection('users')
+        db_operation = DBOperationEngine(db_core)
+
+        def fail(*args):
+            raise Exception('disk is full')
+
+        db_core.collections['users'].create_document = fail
+        create = CreateOperation('users', '{"a": 1}')
+        db_operation._execute(create)
+
+        self.assertIsNotNone(create.future.exception(10))
+        db_core.close()
+
+        db_core = DBCoreEngine(self._path)
+        self.assertFalse(db_core.collections['users'].document_exists(str(create.document_id)))
+        db_core.close()
+
+    def test_dropped_batch_update_is_not_replayed(self):
+        db_core = DBCoreEngine(self._path)
+        db_core.create_collection('users')
+        users = db_core.collections['users']
+        doc_ids = [DocumentId(), DocumentId()]
+        for i, doc_id in enumerate(doc_ids):
+            users.create_document(str(doc_id), f'{{"a": {i}}}')
+        db_core.wal.checkpoint()
+        db_operation = DBOperationEngine(db_core)
+
+        update_documents = users.update_documents
+
+        def fail_second(docs, updated_at=None):
+            # the second document could not be written by any attempt
+            failing = [doc_id for doc_id, _ in docs if doc_id == doc_ids[1]]
+            return update_documents([doc for doc in docs if doc[0] != doc_ids[1]], updated_at) + failing
+
+        users.update_documents = fail_second
+        batch = BatchOperation(DBOperationType.UPDATE, 'users', [
+            UpdateOperation('users', doc_id, '{"a": 10}') for doc_id in doc_ids
+        ])
+        db_operation._execute(batch)
+
+        self.assertIsNotNone(batch.future.exception(10))
+        self.assertEqual(batch.operations[0].result(10), doc_ids[0])
+        self.assertIsNotNone(batch.operations[1].future.exception(10))
+        db_core.close()
+
+        db_core = DBCoreEngine(self._path)
+        users = db_core.collections['users']
+        self.assertEqual(users.read_document(str(doc_ids[0])), '{"a": 10}')
+        self.assertEqual(users.read_document(str(doc_ids[1])), '{"a": 1}')
+        db_core.close()
+
+
+if __name__ == '__main__':
+    unittest.main()